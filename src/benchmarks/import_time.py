@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import tempfile
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'sklearn', 'scipy', 'joblib', 'xgboost', 'catboost', 'flask']
+
+# (module, import time budget in seconds, heavy modules it must not load)
+IMPORT_BUDGETS = [
+    ('src.logger', 0.1, HEAVY_MODULES + ['pandas', 'numpy']),
+    ('src.components.scoring_service', 1.0, HEAVY_MODULES),
+    ('src.pipeline', 1.0, HEAVY_MODULES),
+    ('src.components.data_analysis', 1.0, HEAVY_MODULES),
+    ('src.components.data_transformation', 1.0, HEAVY_MODULES),
+    ('src.components.model_trainer', 1.0, HEAVY_MODULES),
+    ('src.components.model_explainer', 1.0, HEAVY_MODULES),
+    ('src.components.drift_monitor', 1.0, HEAVY_MODULES)
+]
+
+_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted({{name.split('.')[0] for name in sys.modules}})}}))
+"""
+
+
+def measure_import(module, repeat=3):
+    '''
+    Best of repeat cold imports of module, each in a fresh interpreter started in an empty
+    directory. Returns (seconds, top-level modules loaded, files the import created).
+    '''
+    best, loaded, created = None, [], []
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], cwd=work_dir, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            created = os.listdir(work_dir)
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best:
+            best, loaded = result['seconds'], result['modules']
+    return best, loaded, created
+
+
+def check_budgets(budgets=IMPORT_BUDGETS, repeat=3):
+    '''
+    Print the import time of every module against its budget and return the violations
+    '''
+    violations = []
+    for module, budget, forbidden in budgets:
+        seconds, loaded, created = measure_import(module, repeat)
+        problems = []
+        if seconds > budget:
+            problems.append(f"{seconds:.3f}s over the {budget:.3f}s budget")
+        heavy = sorted(set(forbidden) & set(loaded))
+        if heavy:
+            problems.append(f"imports {', '.join(heavy)}")
+        if created:
+            problems.append(f"creates {', '.join(created)} at import")
+        print(f"{module:<40} {seconds:7.3f}s / {budget:.3f}s  {'; '.join(problems) or 'ok'}")
+        if problems:
+            violations.append((module, problems))
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the import time budget of the package entry points")
+    parser.add_argument('--repeat', type=int, default=3, help="cold imports per module, the best one counts")
+    args = parser.parse_args()
+    sys.exit(1 if check_budgets(repeat=args.repeat) else 0)
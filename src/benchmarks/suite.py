@@ -0,0 +1,410 @@
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import List
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import file_fingerprint
+
+
+@dataclass
+class BenchmarkConfig:
+    work_dir: str = os.path.join('data', 'benchmarks')
+    client_data_path: str = os.path.join('data', "client_data.csv")
+    price_data_path: str = os.path.join('data', "price_data.csv")
+    scales: List[int] = field(default_factory=lambda: [10, 100, 1000])
+    seed: int = 0
+    # Forest size for the trainer stage, the full 1000 trees take hours at the larger scales
+    n_estimators: int = 100
+    # Rows scored in one batch by the scoring stage, and single-row requests timed after it
+    score_rows: int = 10_000
+    single_row_requests: int = 50
+    # A metric regresses when it gets worse by more than threshold and by more than the absolute floor
+    threshold: float = 0.10
+    min_seconds: float = 0.05
+    min_rss_mb: float = 5.0
+    min_latency_ms: float = 1.0
+    # Price rows per chunk of the streaming stage, and the sizes the sweep tries (0 reads the table whole)
+    price_chunksize: int = 100_000
+    price_chunksizes: List[int] = field(default_factory=lambda: [0, 10_000, 100_000, 1_000_000])
+
+
+def _data_validation(options):
+    from src.components.data_validation import DataValidation
+    DataValidation().validate()
+
+
+def _price_features(options):
+    # The single-pass engine and the pandas groupby code it replaced, timed on the same frame
+    import pandas as pd
+    from src.benchmarks.reference import groupby_price_features
+    from src.price_features import build_price_features
+    from src.schema import PRICE_SCHEMA, csv_options
+    price_df = pd.read_csv(os.path.join('data', "price_data.csv"), **csv_options(PRICE_SCHEMA))
+    start = time.perf_counter()
+    build_price_features(price_df)
+    engine_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    groupby_price_features(price_df)
+    groupby_seconds = time.perf_counter() - start
+    return {'price_rows': len(price_df), 'engine_s': engine_seconds, 'groupby_s': groupby_seconds,
+            'engine_speedup': groupby_seconds / engine_seconds}
+
+
+def _price_stream(options):
+    # The price features streamed in chunks of price_chunksize rows, or built from the whole table for 0
+    from src.price_features import build_price_features, stream_price_features
+    price_data_path = os.path.join('data', "price_data.csv")
+    if options['price_chunksize']:
+        features = stream_price_features(price_data_path, options['price_chunksize'])
+    else:
+        import pandas as pd
+        from src.schema import PRICE_SCHEMA, csv_options
+        features = build_price_features(pd.read_csv(price_data_path, **csv_options(PRICE_SCHEMA)))
+    return {'price_chunksize': options['price_chunksize'], 'feature_rows': len(features)}
+
+
+def _transform_kernel(options):
+    # The per-column log transforms of apply_transforms and the one-block alternative, on the same columns
+    import tracemalloc
+    import pandas as pd
+    from src.benchmarks.reference import block_log_transform
+    from src.transform_kernel import LOG10_COLUMNS, apply_transforms
+    client_df = pd.read_csv(os.path.join('data', "client_data.csv"), usecols=LOG10_COLUMNS)
+    results = {'rows': len(client_df)}
+    variants = [('kernel', lambda df: apply_transforms(df, [(column, 'log1p10', None) for column in LOG10_COLUMNS])),
+                ('block', lambda df: block_log_transform(df, LOG10_COLUMNS))]
+    for name, transform in variants:
+        df = client_df.copy()
+        tracemalloc.start()
+        start = time.perf_counter()
+        transform(df)
+        results[f'{name}_s'] = time.perf_counter() - start
+        results[f'{name}_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return results
+
+
+def _data_analysis(options):
+    from src.components.data_analysis import DataAnalysis
+    obj = DataAnalysis()
+    obj.analysis_config.headless = True
+    obj.initiate_data_analysis()
+    obj.write_clean_data()
+
+
+def _data_transformation(options):
+    from src.components.data_transformation import DataTransformation
+    obj = DataTransformation()
+    obj.data_transformation_config.headless = True
+    obj.data_transformer()
+
+
+def _prediction_data(options):
+    from src.components.data_transformation import DataTransformation
+    DataTransformation().build_prediction_data()
+
+
+def _model_trainer(options):
+    from src.components.model_trainer import ModelTrainer
+    obj = ModelTrainer()
+    obj.model_trainer_config.n_estimators = options['n_estimators']
+    obj.model_trainer()
+
+
+def _model_load(options):
+    # Only the model artifacts, ScoringService.load() also builds the price features
+    from src.components.model_trainer import ModelTrainerConfig
+    from src.model_store import ModelStore
+    config = ModelTrainerConfig()
+    store = ModelStore(config.model_store_dir)
+    start = time.perf_counter()
+    store.load_flat(config.serving_model_name)
+    flat_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    store.load_model(config.serving_model_name)
+    return {'flat_load_s': flat_seconds, 'sklearn_load_s': time.perf_counter() - start}
+
+
+def _scoring(options):
+    import numpy as np
+    import pandas as pd
+    from src.components.scoring_service import ScoringService, check_clients
+    service = ScoringService().load()
+    # Read as strings like a csv request body, every request is checked against the schema first
+    clients = pd.read_csv(os.path.join('data', "client_data.csv"), nrows=options['score_rows'], dtype=str)
+
+    start = time.perf_counter()
+    scores = service.score_frame(check_clients(clients))
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    for i in range(options['single_row_requests']):
+        start = time.perf_counter()
+        service.score_frame(check_clients(clients.iloc[[i % len(clients)]]))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        'rows_scored': len(scores),
+        'rows_per_s': len(scores) / batch_seconds,
+        'single_row_p50_ms': float(np.percentile(latencies, 50)),
+        'single_row_p99_ms': float(np.percentile(latencies, 99))
+    }
+
+
+# Run in this order, each stage reads what the previous ones wrote
+STAGES = {
+    'data_validation': _data_validation,
+    'price_features': _price_features,
+    'price_stream': _price_stream,
+    'transform_kernel': _transform_kernel,
+    'data_analysis': _data_analysis,
+    'data_transformation': _data_transformation,
+    'prediction_data': _prediction_data,
+    'model_trainer': _model_trainer,
+    'model_load': _model_load,
+    'scoring': _scoring
+}
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _max_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(who).ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def _measure(stage, scale_dir, options):
+    '''
+    Run one stage in the current (fresh) process and return its timings and memory peaks: this
+    process's own peak, and the largest peak of the worker processes it waited for (plots,
+    partitions), which ran at other times and are not added to it.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    os.chdir(scale_dir)
+    start_rss = _max_rss_mb(resource.RUSAGE_SELF)
+    start_cpu = _cpu_seconds()
+    start = time.perf_counter()
+    extra = STAGES[stage](options) or {}
+    wall_seconds, cpu_seconds = time.perf_counter() - start, _cpu_seconds() - start_cpu
+    result = {
+        'wall_s': wall_seconds,
+        'cpu_s': cpu_seconds,
+        'self_peak_rss_mb': _max_rss_mb(resource.RUSAGE_SELF),
+        'children_peak_rss_mb': _max_rss_mb(resource.RUSAGE_CHILDREN),
+        'start_rss_mb': start_rss
+    }
+    result.update(extra)
+    return result
+
+
+def _format_metrics(metrics):
+    return (f"{metrics['wall_s']:9.2f} s {metrics['self_peak_rss_mb']:9.0f} MB self "
+            f"{metrics['children_peak_rss_mb']:7.0f} MB workers")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchmarkSuite:
+    '''
+    Times every pipeline stage on synthetic data at several multiples of the real client table.
+
+    Each scale gets its own directory holding generated data/client_data.csv and data/price_data.csv
+    (kept between runs and regenerated when the source data or seed change). Every stage runs in a
+    fresh process with empty caches, so wall time, CPU time (including worker processes) and peak
+    RSS belong to that stage alone.
+    '''
+
+    def __init__(self, config=None):
+        self.config = config or BenchmarkConfig()
+
+    def prepare(self, scale):
+        from src.benchmarks.synthetic import generate
+
+        config = self.config
+        scale_dir = os.path.abspath(os.path.join(config.work_dir, f"scale-{scale}"))
+        marker_path = os.path.join(scale_dir, "generated.json")
+        source = {
+            'client_data': file_fingerprint(config.client_data_path),
+            'price_data': file_fingerprint(config.price_data_path) if os.path.exists(config.price_data_path) else None,
+            'seed': config.seed
+        }
+        if os.path.exists(marker_path):
+            with open(marker_path) as file_obj:
+                marker = json.load(file_obj)
+            if marker['source'] == source:
+                return scale_dir, marker
+
+        n_clients, n_prices = generate(scale, scale_dir, config.client_data_path, config.price_data_path,
+                                       seed=config.seed)
+        marker = {'source': source, 'clients': n_clients, 'price_rows': n_prices}
+        with open(marker_path, "w") as file_obj:
+            json.dump(marker, file_obj, indent=2)
+        return scale_dir, marker
+
+    def run_scale(self, scale):
+        scale_dir, marker = self.prepare(scale)
+        for directory in ('images', os.path.join('data', 'cache'), os.path.join('data', 'features'),
+                          os.path.join('data', 'models')):
+            shutil.rmtree(os.path.join(scale_dir, directory), ignore_errors=True)
+        os.makedirs(os.path.join(scale_dir, 'images'))
+
+        options = {
+            'n_estimators': self.config.n_estimators,
+            'score_rows': self.config.score_rows,
+            'single_row_requests': self.config.single_row_requests,
+            'price_chunksize': self.config.price_chunksize
+        }
+        stages = {}
+        for stage in STAGES:
+            logging.info(f"Benchmarking {stage} at scale {scale}")
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                stages[stage] = executor.submit(_measure, stage, scale_dir, options).result()
+            print(f"scale {scale:>5} {stage:<20} {_format_metrics(stages[stage])}")
+        return {'clients': marker['clients'], 'price_rows': marker['price_rows'], 'stages': stages}
+
+    def run(self, output_path=None):
+        '''
+        Benchmark every configured scale and write the results as json, returning them
+        '''
+        try:
+            from src.model_store import library_versions
+
+            results = {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'git_commit': _git_commit(),
+                'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                            'cpu_count': os.cpu_count()},
+                'library_versions': library_versions(),
+                'config': {'n_estimators': self.config.n_estimators, 'score_rows': self.config.score_rows,
+                           'seed': self.config.seed},
+                'scales': {}
+            }
+            for scale in self.config.scales:
+                results['scales'][str(scale)] = self.run_scale(scale)
+
+            output_path = output_path or os.path.join(
+                self.config.work_dir, f"results-{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.json")
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            with open(output_path, "w") as file_obj:
+                json.dump(results, file_obj, indent=2)
+            print(f"Results written to {output_path}")
+            return results
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def sweep_price_chunks(self, scale):
+        '''
+        Run the price_stream stage once per chunk size of price_chunksizes, each in a fresh process,
+        so the time and the peak memory of streaming can be traded off. Returns {chunksize: metrics}.
+        '''
+        try:
+            scale_dir, marker = self.prepare(scale)
+            results = {}
+            for chunksize in self.config.price_chunksizes:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    results[chunksize] = executor.submit(_measure, 'price_stream', scale_dir,
+                                                         {'price_chunksize': chunksize}).result()
+                print(f"scale {scale:>5} {marker['price_rows']:>10} price rows chunksize {chunksize or 'whole':>9} "
+                      f"{_format_metrics(results[chunksize])}")
+            return results
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def compare(self, baseline, candidate):
+        '''
+        Regressions of candidate against baseline (both result dicts) for the stages and scales in
+        both runs, as a list of (scale, stage, metric, baseline value, candidate value)
+        '''
+        # metric: (1 when higher is worse, -1 when lower is worse, smallest change that counts)
+        directions = {
+            'wall_s': (1, self.config.min_seconds),
+            'cpu_s': (1, self.config.min_seconds),
+            'engine_s': (1, self.config.min_seconds),
+            'kernel_s': (1, self.config.min_seconds),
+            'kernel_peak_mb': (1, self.config.min_rss_mb),
+            'self_peak_rss_mb': (1, self.config.min_rss_mb),
+            'children_peak_rss_mb': (1, self.config.min_rss_mb),
+            'rows_per_s': (-1, 0.0),
+            'single_row_p50_ms': (1, self.config.min_latency_ms),
+            'single_row_p99_ms': (1, self.config.min_latency_ms)
+        }
+        regressions = []
+        for scale, candidate_scale in candidate['scales'].items():
+            baseline_scale = baseline['scales'].get(scale)
+            if baseline_scale is None:
+                continue
+            for stage, metrics in candidate_scale['stages'].items():
+                baseline_metrics = baseline_scale['stages'].get(stage)
+                if baseline_metrics is None:
+                    continue
+                for metric, (direction, floor) in directions.items():
+                    if metric not in metrics or metric not in baseline_metrics:
+                        continue
+                    before, after = baseline_metrics[metric], metrics[metric]
+                    worse = (after - before) * direction
+                    regressed = worse > abs(before) * self.config.threshold and worse > floor
+                    print(f"scale {scale:>5} {stage:<20} {metric:<17} {before:10.2f} -> {after:10.2f} "
+                          f"({(after / before - 1) * 100 if before else 0.0:+6.1f}%)"
+                          + ("  REGRESSION" if regressed else ""))
+                    if regressed:
+                        regressions.append((scale, stage, metric, before, after))
+        return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="generate the data if needed and time every stage")
+    run_parser.add_argument('--scales', type=int, nargs='+', default=None)
+    run_parser.add_argument('--n-estimators', type=int, default=None)
+    run_parser.add_argument('--output')
+    sweep_parser = commands.add_parser('sweep', help="time and peak memory of price streaming per chunk size")
+    sweep_parser.add_argument('--scale', type=int, default=1)
+    sweep_parser.add_argument('--chunksizes', type=int, nargs='+', default=None, help="0 reads the table whole")
+    compare_parser = commands.add_parser('compare', help="flag regressions between two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=None)
+    args = parser.parse_args()
+
+    config = BenchmarkConfig()
+    if args.command == 'run':
+        config.scales = args.scales or config.scales
+        config.n_estimators = args.n_estimators or config.n_estimators
+        BenchmarkSuite(config).run(args.output)
+    elif args.command == 'sweep':
+        config.price_chunksizes = args.chunksizes or config.price_chunksizes
+        BenchmarkSuite(config).sweep_price_chunks(args.scale)
+    else:
+        if args.threshold is not None:
+            config.threshold = args.threshold
+        with open(args.baseline) as file_obj:
+            baseline = json.load(file_obj)
+        with open(args.candidate) as file_obj:
+            candidate = json.load(file_obj)
+        regressions = BenchmarkSuite(config).compare(baseline, candidate)
+        print(f"{len(regressions)} regression(s)")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging
+from src.price_features import PRICE_COLUMNS
+
+# Odd 128-bit multiplier, i -> i * _ID_MULTIPLIER mod 2**128 is a bijection so generated ids never collide
+_ID_MULTIPLIER = 0x9E3779B97F4A7C15F39CC0605CEDC835
+PRICE_MONTHS = pd.date_range('2015-01-01', periods=12, freq='MS').strftime('%Y-%m-%d')
+
+
+def synthetic_ids(start, stop):
+    return [f"{(i * _ID_MULTIPLIER) % (1 << 128):032x}" for i in range(start, stop)]
+
+
+def _synthetic_prices(clients, rng):
+    '''
+    Twelve monthly price rows per client when no real price table is available. The variable and
+    fixed off-peak prices follow the client's forecast prices, the other periods are fractions of
+    them, and each month moves by a small random step.
+    '''
+    n = len(clients)
+    base = np.column_stack([
+        clients['forecast_price_energy_off_peak'].to_numpy(),
+        clients['forecast_price_energy_peak'].to_numpy(),
+        clients['forecast_price_energy_peak'].to_numpy() * rng.uniform(0.6, 0.9, n),
+        clients['forecast_price_pow_off_peak'].to_numpy(),
+        clients['forecast_price_pow_off_peak'].to_numpy() * rng.choice([0.0, 0.6], n),
+        clients['forecast_price_pow_off_peak'].to_numpy() * rng.choice([0.0, 0.4], n)
+    ])
+    steps = rng.normal(0, 0.01, (n, len(PRICE_MONTHS), 1)).cumsum(axis=1)
+    values = (base[:, np.newaxis, :] * (1 + steps)).reshape(-1, len(PRICE_COLUMNS))
+    prices = pd.DataFrame(values, columns=PRICE_COLUMNS)
+    prices.insert(0, 'id', np.repeat(clients['id'].to_numpy(), len(PRICE_MONTHS)))
+    prices.insert(1, 'price_date', np.tile(PRICE_MONTHS, n))
+    return prices
+
+
+def generate(scale, out_dir, client_data_path=os.path.join('data', "client_data.csv"),
+             price_data_path=os.path.join('data', "price_data.csv"), seed=0, chunk_clients=100_000):
+    '''
+    Write client_data.csv and price_data.csv with scale times the clients of client_data_path
+    into out_dir/data.
+
+    Clients are resampled as whole rows, so every column keeps its distribution and the columns
+    keep their joint structure, and get fresh unique ids. Each synthetic client gets the price
+    history of the client it was sampled from when price_data_path exists, otherwise twelve
+    generated months. Both files are written in chunks, so memory stays bounded at any scale.
+    Returns the number of client and price rows written.
+    '''
+    try:
+        clients = pd.read_csv(client_data_path)
+        prices = None
+        if price_data_path and os.path.exists(price_data_path):
+            prices = pd.read_csv(price_data_path)
+            prices = prices[prices['id'].isin(clients['id'])]
+            # Price rows of each source client as one slice, in file order inside the slice
+            codes = pd.Categorical(prices['id'], categories=clients['id']).codes
+            order = np.argsort(codes, kind='stable')
+            prices, codes = prices.iloc[order], codes[order]
+            price_starts = np.searchsorted(codes, np.arange(len(clients)))
+            price_counts = np.bincount(codes, minlength=len(clients))
+
+        data_dir = os.path.join(out_dir, 'data')
+        os.makedirs(data_dir, exist_ok=True)
+        client_out = os.path.join(data_dir, "client_data.csv")
+        price_out = os.path.join(data_dir, "price_data.csv")
+        rng = np.random.default_rng(seed)
+        n_clients = scale * len(clients)
+        n_prices = 0
+
+        for start in range(0, n_clients, chunk_clients):
+            stop = min(start + chunk_clients, n_clients)
+            source = rng.integers(0, len(clients), stop - start)
+            chunk = clients.iloc[source].reset_index(drop=True)
+            chunk['id'] = synthetic_ids(start, stop)
+
+            if prices is None:
+                price_chunk = _synthetic_prices(chunk, rng)
+            else:
+                counts = price_counts[source]
+                rows = np.repeat(price_starts[source] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+                price_chunk = prices.iloc[rows].reset_index(drop=True)
+                price_chunk['id'] = np.repeat(chunk['id'].to_numpy(), counts)
+
+            header = start == 0
+            chunk.to_csv(client_out, mode='w' if header else 'a', header=header, index=False)
+            price_chunk.to_csv(price_out, mode='w' if header else 'a', header=header, index=False)
+            n_prices += len(price_chunk)
+
+        logging.info(f"Generated {n_clients} clients and {n_prices} price rows in {data_dir}")
+        return n_clients, n_prices
+
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -1,87 +1,217 @@
 import os
 import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
 from src.exception import CustomException
-from src.logger import logging
+from src.logger import logging, profile_step
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from dataclasses import dataclass
-from src.utils import plot_stacked_bars, plot_distribution
-sns.set(color_codes=True)
+from typing import Optional
+from src.utils import plot_stacked_bars, plot_distribution_stats, plot_box_stats, distribution_stats, \
+    read_csv_cached, CACHE_DIR
+from src.schema import CLIENT_SCHEMA, PRICE_SCHEMA, read_options, csv_options
+
+# The only client columns the EDA statistics use
+EDA_CLIENT_COLUMNS = ['id', 'channel_sales', 'cons_12m', 'cons_gas_12m', 'cons_last_month', 'has_gas', 'imp_cons',
+                      'churn']
+
+
+@functools.lru_cache(maxsize=None)
+def _pyplot():
+    # matplotlib and seaborn are imported, and the seaborn theme set, on the first plot only
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set(color_codes=True)
+    return plt
+
 
 @dataclass
 class DataAnalysisConfig:
     client_data_path: str = os.path.join('data', "client_data.csv")
     price_data_path: str = os.path.join('data', "price_data.csv")
+    clean_data_path: str = os.path.join('data', "clean_data_after_eda.csv")
+    report_path: str = os.path.join('images', "eda_summary.json")
+    # Histogram bins and where the precomputed plot statistics are cached
+    bins: int = 50
+    cache_dir: str = CACHE_DIR
+    # Headless report mode: no plt.show(), figures closed after saving and rendered in a process pool
+    headless: bool = False
+    max_workers: Optional[int] = None
+    # Rows per chunk when streaming the price table, None reads it in one go
+    price_chunksize: Optional[int] = None
 
 
 class DataAnalysis:
     def __init__(self):
         self.analysis_config = DataAnalysisConfig()
 
-    def initiate_data_analysis(self):
-        logging.info("Entered the data analysis component")
+    def write_clean_data(self):
+        '''
+        Write the client table handed to the transformation stage: one row per company, dates in ISO format
+        '''
+        logging.info("Writing the clean client data")
         try:
-            client_df = pd.read_csv(self.analysis_config.client_data_path)
-            price_df = pd.read_csv(self.analysis_config.price_data_path)
-            logging.info('Read the dataset as dataframe')
+            client_df = read_csv_cached(self.analysis_config.client_data_path, **read_options(CLIENT_SCHEMA))
+            client_df = client_df.drop_duplicates(subset='id')
+            client_df.to_csv(self.analysis_config.clean_data_path, index=False)
+            logging.info(f"Wrote {len(client_df)} clients to {self.analysis_config.clean_data_path}")
+
+        except Exception as e:
+            raise CustomException(e, sys)
 
-            print(client_df.info())
+    def _stats_path(self, name, file_path):
+        # Keyed by the size and modification time of the source, so a cache hit does not read it
+        stat = os.stat(file_path)
+        key = hashlib.sha256(json.dumps([
+            os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, self.analysis_config.bins
+        ]).encode()).hexdigest()[:16]
+        return os.path.join(self.analysis_config.cache_dir, f"{name}-{key}.json")
+
+    @staticmethod
+    def _write_stats(stats_path, stats):
+        cache_dir, file_name = os.path.split(stats_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Entries of older versions of the source are never read again
+        name = file_name.rsplit('-', 1)[0]
+        for stale_path in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(name)}-*.json")):
+            if stale_path != stats_path:
+                os.remove(stale_path)
+        with open(stats_path, "w") as file_obj:
+            json.dump(stats, file_obj, default=str)
+        logging.info(f"Cached the EDA statistics as {stats_path}")
+
+    @profile_step("price_non_null")
+    def price_non_null(self):
+        '''
+        Non-null count of every price column, the only price data the EDA uses, cached on its own
+        '''
+        config = self.analysis_config
+        stats_path = self._stats_path("eda_price_counts", config.price_data_path)
+        if os.path.exists(stats_path):
+            with open(stats_path) as file_obj:
+                return json.load(file_obj)
+
+        if config.price_chunksize:
+            # Only the non-null counts are needed, so never hold more than one chunk
+            price_counts = None
+            for chunk in pd.read_csv(config.price_data_path, chunksize=config.price_chunksize,
+                                     **csv_options(PRICE_SCHEMA)):
+                counts = chunk.notna().sum()
+                price_counts = counts if price_counts is None else price_counts + counts
+        else:
+            price_df = read_csv_cached(config.price_data_path, **read_options(PRICE_SCHEMA))
             print(price_df.info())
+            price_counts = price_df.notna().sum()
 
-            churn = client_df[['id', 'churn']]
-            churn.columns = ['Companies', 'churn']
-            churn_total = churn.groupby(churn['churn']).count()
-            churn_percentage = churn_total / churn_total.sum() * 100
+        price_counts = {column: int(count) for column, count in price_counts.items()}
+        self._write_stats(stats_path, price_counts)
+        return price_counts
 
-            # plot to visualize the churn percentage
-            plot_stacked_bars(churn_percentage.transpose(), "Churning status", (5, 5), legend_="lower right")
+    @profile_step("eda_stats")
+    def eda_stats(self):
+        '''
+        Everything the EDA plots draw, computed in one pass over the client table and cached on disk
+        next to the price counts, both keyed by their file's size and modification time, so plots
+        can be redrawn from the cache without reading the raw tables
+        '''
+        config = self.analysis_config
+        stats_path = self._stats_path("eda_stats", config.client_data_path)
+        if os.path.exists(stats_path):
+            logging.info(f"Read the EDA statistics from {stats_path}")
+            with open(stats_path) as file_obj:
+                stats = json.load(file_obj)
+            return stats | {'price_non_null': self.price_non_null()}
 
-            channel = client_df[['id', 'channel_sales', 'churn']]
-            channel = channel.groupby([channel['channel_sales'], channel['churn']])['id'].count().unstack(
-                level=1).fillna(0)
-            channel_churn = (channel.div(channel.sum(axis=1), axis=0) * 100).sort_values(by=[1], ascending=False)
+        client_df = read_csv_cached(config.client_data_path, **read_options(CLIENT_SCHEMA, EDA_CLIENT_COLUMNS))
+        logging.info('Read the dataset as dataframe')
 
-            # Channel wise churn rate analysis
-            plot_stacked_bars(channel_churn, 'Sales channel', rot_=30)
+        print(client_df.info())
 
-            # Histograms to visualize distribution of the consumption in the last year and month
-            consumption = client_df[['id', 'cons_12m', 'cons_gas_12m', 'cons_last_month', 'imp_cons', 'has_gas', 'churn']]
+        churn = client_df[['id', 'churn']]
+        churn.columns = ['Companies', 'churn']
+        churn_total = churn.groupby(churn['churn']).count()
+        churn_percentage = churn_total / churn_total.sum() * 100
 
-            fig, axs = plt.subplots(nrows=4, figsize=(18, 25))
+        channel = client_df[['id', 'channel_sales', 'churn']]
+        channel = channel.groupby([channel['channel_sales'], channel['churn']])['id'].count().unstack(
+            level=1).fillna(0)
+        channel_churn = (channel.div(channel.sum(axis=1), axis=0) * 100).sort_values(by=[1], ascending=False)
 
-            plot_distribution(consumption, 'cons_12m', axs[0])
-            plot_distribution(consumption[consumption['has_gas'] == 't'], 'cons_gas_12m', axs[1])
-            plot_distribution(consumption, 'cons_last_month', axs[2])
-            plot_distribution(consumption, 'imp_cons', axs[3])
+        contract_type = client_df[['id', 'has_gas', 'churn']]
+        contract = contract_type.groupby([contract_type['churn'], contract_type['has_gas']])['id'].count().unstack(
+            level=0)
+        contract_percentage = (contract.div(contract.sum(axis=1), axis=0) * 100).sort_values(by=[1],
+                                                                                             ascending=False)
 
-            plt.savefig(os.path.join('images', "consumption.png"))
-            plt.show()
+        # Histograms and box plots of the consumption in the last year and month, gas only for gas clients
+        churn_flag = client_df['churn'].to_numpy()
+        has_gas = (client_df['has_gas'] == 't').to_numpy()
+        columns = {}
+        for column in ['cons_12m', 'cons_gas_12m', 'cons_last_month', 'imp_cons']:
+            values = client_df[column].to_numpy()
+            if column == 'cons_gas_12m':
+                columns[column] = distribution_stats(values[has_gas], churn_flag[has_gas], config.bins)
+            else:
+                columns[column] = distribution_stats(values, churn_flag, config.bins)
 
-            # Clearly, the consumption data is highly positively skewed, presenting a very long right-tail
-            # towards the higher values of the distribution. The values on the higher and lower end of the
-            # distribution are likely to be outliers. We can use a standard plot to visualise the outliers
-            # in more detail.
+        stats = {
+            'clients': len(client_df),
+            'churn_percentage': churn_percentage.to_dict(orient='split'),
+            'channel_churn': channel_churn.to_dict(orient='split'),
+            'contract_percentage': contract_percentage.to_dict(orient='split'),
+            'columns': columns
+        }
+        self._write_stats(stats_path, stats)
+        return stats | {'price_non_null': self.price_non_null()}
 
-            # A boxplot is a standardized way of displaying the distribution to reveal skewness
-            fig, axs = plt.subplots(nrows=4, figsize=(18, 25))
+    def initiate_data_analysis(self):
+        logging.info("Entered the data analysis component")
+        try:
+            stats = self.eda_stats()
+            print(pd.Series(stats['price_non_null'], name='Non-Null Count'))
 
-            # Plot histogram
-            sns.boxplot(consumption["cons_12m"], ax=axs[0])
-            sns.boxplot(consumption[consumption["has_gas"] == "t"]["cons_gas_12m"], ax=axs[1])
-            sns.boxplot(consumption["cons_last_month"], ax=axs[2])
-            sns.boxplot(consumption["imp_cons"], ax=axs[3])
-            plt.savefig(os.path.join('images', "box_plot.png"))
-            plt.show()
+            churn_percentage = pd.DataFrame(**stats['churn_percentage'])
+            channel_churn = pd.DataFrame(**stats['channel_churn'])
+            contract_percentage = pd.DataFrame(**stats['contract_percentage'])
 
+            plots = [
+                (plot_churn_status, churn_percentage),
+                (plot_sales_channel, channel_churn),
+                (plot_consumption, stats['columns']),
+                (plot_box_plots, stats['columns']),
+                (plot_contract_type, contract_percentage)
+            ]
+            headless = self.analysis_config.headless
+            plt = _pyplot()
+            if headless:
+                # Every figure is independent, so each one is rendered in its own worker process
+                with ProcessPoolExecutor(max_workers=self.analysis_config.max_workers,
+                                         initializer=plt.switch_backend, initargs=('Agg',)) as executor:
+                    futures = [executor.submit(_timed, plot, data, False) for plot, data in plots]
+                    rendered = [future.result() for future in futures]
+            else:
+                rendered = [_timed(plot, data, True) for plot, data in plots]
 
-            contract_type = client_df[['id', 'has_gas', 'churn']]
-            contract = contract_type.groupby([contract_type['churn'], contract_type['has_gas']])['id'].count().unstack(
-                level=0)
-            contract_percentage = (contract.div(contract.sum(axis=1), axis=0) * 100).sort_values(by=[1],
-                                                                                                 ascending=False)
-            # Churn rate based on contract types
-            plot_stacked_bars(contract_percentage, 'Contract type (with gas')
+            summary = {
+                'clients': stats['clients'],
+                'churn_percentage': churn_percentage['Companies'].to_dict(),
+                'channel_churn_percentage': channel_churn[1].to_dict(),
+                'contract_churn_percentage': contract_percentage[1].to_dict(),
+                'consumption': {
+                    column: {name: column_stats[name] for name in ('count', 'mean', 'min', 'max')}
+                    | {name: column_stats['box'][name] for name in ('q1', 'med', 'q3')}
+                    for column, column_stats in stats['columns'].items()
+                },
+                'images': {path: seconds for path, seconds in rendered}
+            }
+            with open(self.analysis_config.report_path, "w") as file_obj:
+                json.dump(summary, file_obj, indent=2, default=str)
+            logging.info(f"Wrote the EDA summary to {self.analysis_config.report_path}")
 
             logging.info("Exploratory data analysis completed")
 
@@ -89,6 +219,81 @@ class DataAnalysis:
             raise CustomException(e, sys)
 
 
+def _timed(plot, data, show):
+    _pyplot()
+    start = time.perf_counter()
+    with profile_step(f"plot:{plot.__name__}", rows_in=len(data)):
+        path = plot(data, show)
+    return path, round(time.perf_counter() - start, 3)
+
+
+def plot_churn_status(churn_percentage, show=True):
+    # plot to visualize the churn percentage
+    plot_stacked_bars(churn_percentage.transpose(), "Churning status", (5, 5), legend_="lower right", show=show)
+    return os.path.join('images', "Churning status.png")
+
+
+def plot_sales_channel(channel_churn, show=True):
+    # Channel wise churn rate analysis
+    plot_stacked_bars(channel_churn, 'Sales channel', rot_=30, show=show)
+    return os.path.join('images', "Sales channel.png")
+
+
+def plot_consumption(columns, show=True):
+    plt = _pyplot()
+    fig, axs = plt.subplots(nrows=4, figsize=(18, 25))
+
+    plot_distribution_stats(columns['cons_12m'], 'cons_12m', axs[0])
+    plot_distribution_stats(columns['cons_gas_12m'], 'cons_gas_12m', axs[1])
+    plot_distribution_stats(columns['cons_last_month'], 'cons_last_month', axs[2])
+    plot_distribution_stats(columns['imp_cons'], 'imp_cons', axs[3])
+
+    plt.savefig(os.path.join('images', "consumption.png"))
+    _show_or_close(fig, show)
+    return os.path.join('images', "consumption.png")
+
+
+def plot_box_plots(columns, show=True):
+    # Clearly, the consumption data is highly positively skewed, presenting a very long right-tail
+    # towards the higher values of the distribution. The values on the higher and lower end of the
+    # distribution are likely to be outliers. We can use a standard plot to visualise the outliers
+    # in more detail.
+
+    # A boxplot is a standardized way of displaying the distribution to reveal skewness
+    plt = _pyplot()
+    fig, axs = plt.subplots(nrows=4, figsize=(18, 25))
+
+    # Plot histogram
+    plot_box_stats(columns['cons_12m'], 'cons_12m', axs[0])
+    plot_box_stats(columns['cons_gas_12m'], 'cons_gas_12m', axs[1])
+    plot_box_stats(columns['cons_last_month'], 'cons_last_month', axs[2])
+    plot_box_stats(columns['imp_cons'], 'imp_cons', axs[3])
+    plt.savefig(os.path.join('images', "box_plot.png"))
+    _show_or_close(fig, show)
+    return os.path.join('images', "box_plot.png")
+
+
+def plot_contract_type(contract_percentage, show=True):
+    # Churn rate based on contract types
+    plot_stacked_bars(contract_percentage, 'Contract type (with gas', show=show)
+    return os.path.join('images', "Contract type (with gas.png")
+
+
+def _show_or_close(fig, show):
+    plt = _pyplot()
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exploratory data analysis of the client and price tables")
+    parser.add_argument('--headless', action='store_true', help="save the figures without showing them")
+    parser.add_argument('--workers', type=int, default=None, help="processes rendering the figures when headless")
+    args = parser.parse_args()
+
     obj = DataAnalysis()
+    obj.analysis_config.headless = args.headless
+    obj.analysis_config.max_workers = args.workers
     obj.initiate_data_analysis()
\ No newline at end of file
@@ -1,15 +1,20 @@
 import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from dataclasses import dataclass
-import seaborn as sns
-
-import matplotlib.pyplot as plt
+from typing import Optional
 import numpy as np
 import pandas as pd
 
 from src.exception import CustomException
-from src.logger import logging
+from src.logger import logging, profile_step
+from src.price_features import build_price_features, stream_price_features, PRICE_COLUMNS
+from src.feature_store import PriceFeatureStore
+from src.transform_kernel import apply_transforms, CLIENT_TRANSFORMS, ORIGIN_TRANSFORMS
+from src.schema import CLIENT_SCHEMA, PRICE_SCHEMA, DATE_FORMAT, read_options
+from src.utils import read_csv_cached, CLIENT_DATE_COLUMNS
 import os
-pd.set_option('future.no_silent_downcasting', True)
 
 
 
@@ -18,12 +23,132 @@ class DataTransformationConfig:
     data_path: str = os.path.join('data', "clean_data_after_eda.csv")
     price_data_path: str = os.path.join('data', "price_data.csv")
     transformed_data_path: str = os.path.join('data', "transformed_data.csv")
+    prediction_data_path: str = os.path.join('data', "data_for_predictions.csv")
+    # Rows per chunk when streaming the price table, None reads it in one go
+    price_chunksize: Optional[int] = None
+    # Keep the price features in an incremental store so appended months only cost their own rows
+    incremental_prices: bool = False
+    price_feature_store_dir: str = os.path.join('data', 'features', "price_store")
+    # Hash-partition the clients and their price rows by id and transform the partitions in a
+    # process pool, None runs everything in this process
+    n_partitions: Optional[int] = None
+    max_workers: Optional[int] = None
+    # Headless mode closes the figure after saving instead of calling plt.show()
+    headless: bool = False
 
 
 class DataTransformation:
     def __init__(self):
         self.data_transformation_config = DataTransformationConfig()
 
+    @staticmethod
+    def transform_features(df, price_features):
+        '''
+        Join the price features to the client rows and apply the encodings and skew transforms.
+        Shared by data_transformer and the scoring service so both see exactly the same features.
+        '''
+        for column in CLIENT_DATE_COLUMNS:
+            df[column] = pd.to_datetime(df[column], format=DATE_FORMAT)
+
+        with profile_step("merge_price_features", rows_in=len(df)) as step:
+            df = pd.merge(df, price_features, on='id')
+            step.rows_out = len(df)
+
+        # Transforming skewed data The reason why we need to treat skewness is because some predictive models
+        # have inherent assumptions about the distribution of the features that are being supplied to it. Such
+        # models are called parametric models, and they typically assume that all variables are both independent
+        # and normally distributed. Skewness isn't always a bad thing, but as a rule of thumb it is always good
+        # practice to treat highly skewed variables because of the reason stated above, but also as it can
+        # improve the speed at which predictive models are able to converge to its best solution.
+
+        # Boolean has_gas, one-hot sales channels and log10 transformations in one fused pass
+        with profile_step("apply_transforms", rows_in=len(df), rows_out=len(df)):
+            df = apply_transforms(df, CLIENT_TRANSFORMS)
+
+        return df
+
+    @staticmethod
+    def prediction_features(df, reference_date='2016-01-01'):
+        '''
+        Replace the contract dates by tenure and month counts relative to reference_date and one-hot
+        encode origin_up, giving the model's input columns
+        '''
+        reference_date = pd.Timestamp(reference_date)
+        df['tenure'] = ((df['date_end'] - df['date_activ']).dt.days / 365.25).astype(int)
+        df['months_activ'] = ((reference_date - df['date_activ']).dt.days / 30.4375).astype(int)
+        df['months_to_end'] = ((df['date_end'] - reference_date).dt.days / 30.4375).astype(int)
+        df['months_modif_prod'] = ((reference_date - df['date_modif_prod']).dt.days / 30.4375).astype(int)
+        df['months_renewal'] = ((reference_date - df['date_renewal']).dt.days / 30.4375).astype(int)
+        df = df.drop(columns=CLIENT_DATE_COLUMNS)
+
+        return apply_transforms(df, ORIGIN_TRANSFORMS)
+
+    @staticmethod
+    def partitioned_transform(df, price_df, n_partitions, max_workers=None):
+        '''
+        transform_features over hash partitions of the client ids, one process per partition.
+
+        Every feature depends on one company's rows only, so each partition builds its own price
+        features and transforms its own clients. The price rows go to the workers through shared
+        memory, sorted so each partition is one contiguous slice, with their original order kept
+        inside the partition. The result is in the order of df and identical to the serial path.
+        '''
+        try:
+            # Price ids are hashed once per distinct id, clients and prices must land in the same partition
+            price_df = price_df[price_df['id'].notna()]
+            codes, uniques = pd.factorize(price_df['id'])
+            price_partition = _partition_of(uniques, n_partitions)[codes]
+            client_partition = _partition_of(df['id'].to_numpy(), n_partitions)
+
+            order = np.argsort(price_partition, kind='stable')
+            bounds = np.searchsorted(price_partition[order], np.arange(n_partitions + 1))
+            keys = np.column_stack([
+                codes[order],
+                price_df['price_date'].to_numpy(dtype='datetime64[ns]').view(np.int64)[order]
+            ])
+            values = price_df[PRICE_COLUMNS].to_numpy(dtype=np.float64)[order]
+
+            df = df.assign(_row=np.arange(len(df)))
+            blocks = [shared_memory.SharedMemory(create=True, size=max(1, array.nbytes)) for array in (keys, values)]
+            try:
+                for block, array in zip(blocks, (keys, values)):
+                    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+                shapes = [(block.name, array.shape, array.dtype.str) for block, array in zip(blocks, (keys, values))]
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [
+                        executor.submit(_transform_partition, df[client_partition == i], uniques, shapes,
+                                        bounds[i], bounds[i + 1])
+                        for i in range(n_partitions)
+                    ]
+                    parts = [future.result() for future in futures]
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+
+            df = pd.concat(parts, ignore_index=True).sort_values('_row', ignore_index=True)
+            logging.info(f"Transformed {len(df)} clients in {n_partitions} partitions")
+            return df.drop(columns='_row')
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def build_prediction_data(self):
+        '''
+        Write the model input table from the transformed data
+        '''
+        try:
+            logging.info("Building the prediction data")
+            df = read_csv_cached(self.data_transformation_config.transformed_data_path, index_col=0,
+                                 parse_dates=CLIENT_DATE_COLUMNS)
+            df = df.drop(columns=[column for column in df.columns if column.startswith('Unnamed')])
+            df = self.prediction_features(df)
+            df.to_csv(self.data_transformation_config.prediction_data_path)
+            logging.info(f"Wrote the prediction data with {df.shape[1]} columns")
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
     def data_transformer(self):
         '''
         This function si responsible for data trnasformation
@@ -32,186 +157,56 @@ class DataTransformation:
         try:
             logging.info("Initiated data transformation")
 
-            df = pd.read_csv(self.data_transformation_config.data_path)
+            df = read_csv_cached(self.data_transformation_config.data_path, **read_options(CLIENT_SCHEMA))
 
             logging.info("Loaded the data")
 
-            df["date_activ"] = pd.to_datetime(df["date_activ"], format='%Y-%m-%d')
-            df["date_end"] = pd.to_datetime(df["date_end"], format='%Y-%m-%d')
-            df["date_modif_prod"] = pd.to_datetime(df["date_modif_prod"], format='%Y-%m-%d')
-            df["date_renewal"] = pd.to_datetime(df["date_renewal"], format='%Y-%m-%d')
-
-            # Calculate Difference between off-peak prices in December and preceding January
-            price_df = pd.read_csv(self.data_transformation_config.price_data_path)
-            price_df["price_date"] = pd.to_datetime(price_df["price_date"], format='%Y-%m-%d')
-            # Group off-peak prices by companies and month
-            monthly_price_by_id = price_df.groupby(['id', 'price_date']).agg(
-                {'price_off_peak_var': 'mean', 'price_off_peak_fix': 'mean'}).reset_index()
-
-            # Get january and december prices
-            jan_prices = monthly_price_by_id.groupby('id').first().reset_index()
-            dec_prices = monthly_price_by_id.groupby('id').last().reset_index()
-
-            # Calculate the difference
-            diff = pd.merge(dec_prices.rename(columns={'price_off_peak_var': 'dec_1', 'price_off_peak_fix': 'dec_2'}),
-                            jan_prices.drop(columns='price_date'), on='id')
-            diff['offpeak_diff_dec_january_energy'] = diff['dec_1'] - diff['price_off_peak_var']
-            diff['offpeak_diff_dec_january_power'] = diff['dec_2'] - diff['price_off_peak_fix']
-            diff = diff[['id', 'offpeak_diff_dec_january_energy', 'offpeak_diff_dec_january_power']]
-
-            df = pd.merge(df, diff, on='id')
+            # Off-peak December/January differences, mean differences between periods and maximum
+            # monthly differences between periods, all computed in one pass over the price table
+            if self.data_transformation_config.incremental_prices:
+                store = PriceFeatureStore(self.data_transformation_config.price_feature_store_dir,
+                                          self.data_transformation_config.price_chunksize or 1_000_000)
+                price_features = store.refresh(self.data_transformation_config.price_data_path)
+            elif self.data_transformation_config.price_chunksize:
+                price_features = stream_price_features(self.data_transformation_config.price_data_path,
+                                                       self.data_transformation_config.price_chunksize)
+            else:
+                price_df = read_csv_cached(self.data_transformation_config.price_data_path,
+                                           **read_options(PRICE_SCHEMA))
+                price_features = None
+                if not self.data_transformation_config.n_partitions:
+                    price_features = build_price_features(price_df)
+
+            if price_features is None:
+                df = self.partitioned_transform(df, price_df, self.data_transformation_config.n_partitions,
+                                                self.data_transformation_config.max_workers)
+            else:
+                df = self.transform_features(df, price_features)
             print(df.head())
 
-            # Aggregate average prices per period by company
-            mean_prices = price_df.groupby(['id']).agg({
-                'price_off_peak_var': 'mean',
-                'price_peak_var': 'mean',
-                'price_mid_peak_var': 'mean',
-                'price_off_peak_fix': 'mean',
-                'price_peak_fix': 'mean',
-                'price_mid_peak_fix': 'mean'
-            }).reset_index()
-
-            # Calculate the mean difference between consecutive periods
-            mean_prices['off_peak_peak_var_mean_diff'] = mean_prices['price_off_peak_var'] - mean_prices[
-                'price_peak_var']
-            mean_prices['peak_mid_peak_var_mean_diff'] = mean_prices['price_peak_var'] - mean_prices[
-                'price_mid_peak_var']
-            mean_prices['off_peak_mid_peak_var_mean_diff'] = mean_prices['price_off_peak_var'] - mean_prices[
-                'price_mid_peak_var']
-            mean_prices['off_peak_peak_fix_mean_diff'] = mean_prices['price_off_peak_fix'] - mean_prices[
-                'price_peak_fix']
-            mean_prices['peak_mid_peak_fix_mean_diff'] = mean_prices['price_peak_fix'] - mean_prices[
-                'price_mid_peak_fix']
-            mean_prices['off_peak_mid_peak_fix_mean_diff'] = mean_prices['price_off_peak_fix'] - mean_prices[
-                'price_mid_peak_fix']
-
-            columns = [
-                'id',
-                'off_peak_peak_var_mean_diff',
-                'peak_mid_peak_var_mean_diff',
-                'off_peak_mid_peak_var_mean_diff',
-                'off_peak_peak_fix_mean_diff',
-                'peak_mid_peak_fix_mean_diff',
-                'off_peak_mid_peak_fix_mean_diff'
-            ]
-            df = pd.merge(df, mean_prices[columns], on='id')
-
-            # Aggregate average prices per period by company
-            mean_prices_by_month = price_df.groupby(['id', 'price_date']).agg({
-                'price_off_peak_var': 'mean',
-                'price_peak_var': 'mean',
-                'price_mid_peak_var': 'mean',
-                'price_off_peak_fix': 'mean',
-                'price_peak_fix': 'mean',
-                'price_mid_peak_fix': 'mean'
-            }).reset_index()
-
-            # Calculate the mean difference between consecutive periods
-            mean_prices_by_month['off_peak_peak_var_mean_diff'] = mean_prices_by_month['price_off_peak_var'] - \
-                                                                  mean_prices_by_month['price_peak_var']
-            mean_prices_by_month['peak_mid_peak_var_mean_diff'] = mean_prices_by_month['price_peak_var'] - \
-                                                                  mean_prices_by_month['price_mid_peak_var']
-            mean_prices_by_month['off_peak_mid_peak_var_mean_diff'] = mean_prices_by_month['price_off_peak_var'] - \
-                                                                      mean_prices_by_month['price_mid_peak_var']
-            mean_prices_by_month['off_peak_peak_fix_mean_diff'] = mean_prices_by_month['price_off_peak_fix'] - \
-                                                                  mean_prices_by_month['price_peak_fix']
-            mean_prices_by_month['peak_mid_peak_fix_mean_diff'] = mean_prices_by_month['price_peak_fix'] - \
-                                                                  mean_prices_by_month['price_mid_peak_fix']
-            mean_prices_by_month['off_peak_mid_peak_fix_mean_diff'] = mean_prices_by_month['price_off_peak_fix'] - \
-                                                                      mean_prices_by_month['price_mid_peak_fix']
-
-            # Calculate the maximum monthly difference across time periods
-            max_diff_across_periods_months = mean_prices_by_month.groupby(['id']).agg({
-                'off_peak_peak_var_mean_diff': 'max',
-                'peak_mid_peak_var_mean_diff': 'max',
-                'off_peak_mid_peak_var_mean_diff': 'max',
-                'off_peak_peak_fix_mean_diff': 'max',
-                'peak_mid_peak_fix_mean_diff': 'max',
-                'off_peak_mid_peak_fix_mean_diff': 'max'
-            }).reset_index().rename(
-                columns={
-                    'off_peak_peak_var_mean_diff': 'off_peak_peak_var_max_monthly_diff',
-                    'peak_mid_peak_var_mean_diff': 'peak_mid_peak_var_max_monthly_diff',
-                    'off_peak_mid_peak_var_mean_diff': 'off_peak_mid_peak_var_max_monthly_diff',
-                    'off_peak_peak_fix_mean_diff': 'off_peak_peak_fix_max_monthly_diff',
-                    'peak_mid_peak_fix_mean_diff': 'peak_mid_peak_fix_max_monthly_diff',
-                    'off_peak_mid_peak_fix_mean_diff': 'off_peak_mid_peak_fix_max_monthly_diff'
-                }
-            )
-
-            columns = [
-                'id',
-                'off_peak_peak_var_max_monthly_diff',
-                'peak_mid_peak_var_max_monthly_diff',
-                'off_peak_mid_peak_var_max_monthly_diff',
-                'off_peak_peak_fix_max_monthly_diff',
-                'peak_mid_peak_fix_max_monthly_diff',
-                'off_peak_mid_peak_fix_max_monthly_diff'
-            ]
-
-            df = pd.merge(df, max_diff_across_periods_months[columns], on='id')
-            df.head()
+            with profile_step("plot:skew_transformed", rows_in=len(df)):
+                # Plotting libraries are only loaded here, transform_features does not need them
+                import matplotlib.pyplot as plt
+                import seaborn as sns
 
-            # Transforming Boolean data
-            df['has_gas'] = df['has_gas'].replace(['t', 'f'], [1, 0])
-            df.groupby(['has_gas']).agg({'churn': 'mean'})
-
-            # Transform into categorical type
-            df['channel_sales'] = df['channel_sales'].astype('category')
-            # Let's see how many categories are within this column
-            df['channel_sales'].value_counts()
-            df = pd.get_dummies(df, columns=['channel_sales'], prefix='channel')
-            df = df.drop(
-                columns=['channel_sddiedcslfslkckwlfkdpoeeailfpeds', 'channel_epumfxlbckeskwekxbiuasklxalciiuu',
-                         'channel_fixdbufsefwooaasfcxdxadsiekoceaa'])
-            df.head()
+                fig, axs = plt.subplots(nrows=3, figsize=(18, 20))
+                # Plot histograms
+                sns.histplot((df["cons_12m"].dropna()), ax=axs[0])
+                sns.histplot((df[df["has_gas"] == 1]["cons_gas_12m"].dropna()), ax=axs[1])
+                sns.histplot((df["cons_last_month"].dropna()), ax=axs[2])
+
+                plt.savefig(os.path.join('images', "skew_transformed.png"))
 
-            # Transforming skewed data The reason why we need to treat skewness is because some predictive models
-            # have inherent assumptions about the distribution of the features that are being supplied to it. Such
-            # models are called parametric models, and they typically assume that all variables are both independent
-            # and normally distributed. Skewness isn't always a bad thing, but as a rule of thumb it is always good
-            # practice to treat highly skewed variables because of the reason stated above, but also as it can
-            # improve the speed at which predictive models are able to converge to its best solution.
-
-            skewed = [
-                'cons_12m',
-                'cons_gas_12m',
-                'cons_last_month',
-                'forecast_cons_12m',
-                'forecast_cons_year',
-                'forecast_discount_energy',
-                'forecast_meter_rent_12m',
-                'forecast_price_energy_off_peak',
-                'forecast_price_energy_peak',
-                'forecast_price_pow_off_peak'
-            ]
-
-            df[skewed].describe()
-
-            # Apply log10 transformation
-            df["cons_12m"] = np.log10(df["cons_12m"] + 1)
-            df["cons_gas_12m"] = np.log10(df["cons_gas_12m"] + 1)
-            df["cons_last_month"] = np.log10(df["cons_last_month"] + 1)
-            df["forecast_cons_12m"] = np.log10(df["forecast_cons_12m"] + 1)
-            df["forecast_cons_year"] = np.log10(df["forecast_cons_year"] + 1)
-            df["forecast_meter_rent_12m"] = np.log10(df["forecast_meter_rent_12m"] + 1)
-            df["imp_cons"] = np.log10(df["imp_cons"] + 1)
-
-            fig, axs = plt.subplots(nrows=3, figsize=(18, 20))
-            # Plot histograms
-            sns.histplot((df["cons_12m"].dropna()), ax=axs[0])
-            sns.histplot((df[df["has_gas"] == 1]["cons_gas_12m"].dropna()), ax=axs[1])
-            sns.histplot((df["cons_last_month"].dropna()), ax=axs[2])
-
-            plt.savefig(os.path.join('images', "skew_transformed.png"))
-
-            plt.show()
+            if self.data_transformation_config.headless:
+                plt.close(fig)
+            else:
+                plt.show()
 
 
             df.head()
 
-            df.to_csv(self.data_transformation_config.transformed_data_path)
+            with profile_step("write_csv:transformed_data", rows_in=len(df)):
+                df.to_csv(self.data_transformation_config.transformed_data_path)
 
             logging.info("Exited data transformation")
 
@@ -219,6 +214,35 @@ class DataTransformation:
         except Exception as e:
             raise CustomException(e, sys)
 
+def _partition_of(ids, n_partitions):
+    return (pd.util.hash_array(np.asarray(ids, dtype=object)) % np.uint64(n_partitions)).astype(np.int64)
+
+
+def _transform_partition(client_df, uniques, shapes, start, stop):
+    '''
+    Worker of partitioned_transform: rebuild the partition's price rows from shared memory and
+    transform its clients
+    '''
+    arrays = []
+    for name, shape, dtype in shapes:
+        block = shared_memory.SharedMemory(name=name)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=block.buf)[start:stop].copy())
+        block.close()
+    keys, values = arrays
+    price_df = pd.DataFrame(values, columns=PRICE_COLUMNS)
+    price_df.insert(0, 'id', uniques[keys[:, 0]])
+    price_df.insert(1, 'price_date', keys[:, 1].view('datetime64[ns]'))
+    return DataTransformation.transform_features(client_df, build_price_features(price_df))
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the transformed client table")
+    parser.add_argument('--incremental', action='store_true',
+                        help="refresh the price features from the incremental feature store")
+    parser.add_argument('--partitions', type=int, default=None,
+                        help="transform hash partitions of the clients in parallel processes")
+    args = parser.parse_args()
     obj = DataTransformation()
+    obj.data_transformation_config.incremental_prices = args.incremental
+    obj.data_transformation_config.n_partitions = args.partitions
     obj.data_transformer()
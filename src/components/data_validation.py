@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import argparse
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging, profile_step
+from src.schema import CLIENT_SCHEMA, PRICE_SCHEMA, SchemaError, check_frame, format_report
+
+
+@dataclass
+class DataValidationConfig:
+    client_data_path: str = os.path.join('data', "client_data.csv")
+    price_data_path: str = os.path.join('data', "price_data.csv")
+    report_path: str = os.path.join('data', "validation_report.json")
+    # Rows per chunk when checking the price table, None reads it in one go
+    price_chunksize: Optional[int] = 1_000_000
+
+
+class DataValidation:
+    '''
+    Checks the raw client and price tables against src.schema before any expensive stage reads them.
+
+    Each table is read once, as strings and only the schema's columns, and every rule is a vectorized
+    pass over a column (the price table chunk by chunk, so memory stays bounded). The report is written
+    as json in every case, and a SchemaError with the compact text report is raised on any problem.
+    '''
+
+    def __init__(self):
+        self.data_validation_config = DataValidationConfig()
+
+    @staticmethod
+    def check_table(file_path, schema, chunksize=None):
+        '''
+        Return (rows, problems) for the csv at file_path
+        '''
+        header = pd.read_csv(file_path, nrows=0).columns
+        columns = [column for column in schema if column in header]
+        problems, n_rows = {}, 0
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        with profile_step(f"validate:{stem}") as step:
+            chunks = pd.read_csv(file_path, usecols=columns, dtype=str, chunksize=chunksize)
+            for chunk in (chunks if chunksize else [chunks]):
+                check_frame(chunk, schema, problems)
+                n_rows += len(chunk)
+            step.rows_in = n_rows
+        return n_rows, problems
+
+    def validate(self):
+        '''
+        Validate both tables, write the report and raise a SchemaError when a table breaks its schema
+        '''
+        try:
+            logging.info("Entered the data validation component")
+            config = self.data_validation_config
+            tables = [
+                (config.client_data_path, CLIENT_SCHEMA, None),
+                (config.price_data_path, PRICE_SCHEMA, config.price_chunksize)
+            ]
+            report, texts = {}, []
+            for file_path, schema, chunksize in tables:
+                n_rows, problems = self.check_table(file_path, schema, chunksize)
+                report[os.path.basename(file_path)] = {
+                    'rows': n_rows,
+                    'problems': [{'column': column, 'check': check, 'count': count, 'examples': examples}
+                                 for (column, check), (count, examples) in problems.items()]
+                }
+                texts.append(format_report(os.path.basename(file_path), n_rows, problems))
+
+            os.makedirs(os.path.dirname(config.report_path) or '.', exist_ok=True)
+            with open(config.report_path, "w") as file_obj:
+                json.dump(report, file_obj, indent=2, default=str)
+            print("\n".join(texts))
+
+            if any(table['problems'] for table in report.values()):
+                raise SchemaError("The input data does not match the schema\n" + "\n".join(texts))
+            logging.info("The input data matches the schema")
+            return report
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the client and price tables against the schema")
+    parser.add_argument('--chunksize', type=int, default=None, help="price rows checked at a time")
+    args = parser.parse_args()
+    obj = DataValidation()
+    if args.chunksize:
+        obj.data_validation_config.price_chunksize = args.chunksize
+    obj.validate()
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from datetime import datetime
+from dataclasses import dataclass
+
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging, profile_step
+from src.components.data_transformation import DataTransformationConfig
+from src.components.model_trainer import ModelTrainerConfig
+from src.components.scoring_service import ScoringService
+from src.drift import FeatureSketch, drift_metrics
+from src.feature_store import PriceFeatureStore
+from src.model_store import ModelStore
+from src.schema import CLIENT_SCHEMA, csv_options
+
+
+@dataclass
+class DriftMonitorConfig:
+    model_store_dir = os.path.join("data", "models")
+    # The monitored model's features are built like the scoring service builds them
+    model_name = "churn_serving"
+    model_version = None  # None monitors the latest version
+    reference_file = ModelTrainerConfig.drift_reference_file
+    # Price features persisted by the incremental transformation, read for the batch's ids only
+    price_feature_store_dir = DataTransformationConfig.price_feature_store_dir
+    monitor_dir = os.path.join("data", "monitoring")
+    report_path = os.path.join("data", "monitoring", "drift_report.csv")
+    alerts_path = os.path.join("data", "monitoring", "drift_alerts.jsonl")
+    # Rows read and sketched at a time, memory does not grow with the batch size
+    chunksize = 100_000
+    # A feature alerts when its PSI or KS distance to the training distribution crosses these
+    psi_threshold = 0.25
+    ks_threshold = 0.1
+    # Smaller batches are added to the window but not checked on their own
+    min_batch_rows = 500
+    # The window is the last window_batches batch sketches, so old batches stop diluting recent drift
+    window_batches = 30
+
+
+class DriftMonitor:
+    '''
+    Compares batches of raw client rows with the training distribution saved next to the model.
+
+    Each batch file is streamed in chunks through the scoring service's feature pipeline, joined
+    to the persisted price features of the chunk's ids only, and only its histogram sketch is kept.
+    The sketch is checked on its own and saved per model version, and the window merging the last
+    window_batches sketches is checked too, so the cost of a run is linear in the new rows and the
+    state is a few counts per feature and batch. PSI and KS per feature go to the report csv, and
+    every crossed threshold is appended to the alerts file as a json line.
+    '''
+
+    def __init__(self):
+        self.drift_monitor_config = DriftMonitorConfig()
+
+    def load(self):
+        '''
+        Load the training sketch and the feature columns of the model
+        '''
+        try:
+            config = self.drift_monitor_config
+            store = ModelStore(config.model_store_dir)
+            self.version = config.model_version or store.latest(config.model_name)
+            reference_path = store.artifact_path(config.model_name, config.reference_file, self.version)
+            if not os.path.exists(reference_path):
+                raise FileNotFoundError(f"{config.model_name} {self.version} has no drift reference, retrain it")
+            self.reference = FeatureSketch.load(reference_path)
+
+            # Only the feature pipeline of the service is used, so neither the model nor the price
+            # table is loaded
+            self.service = ScoringService()
+            self.service.feature_columns = store.manifest(config.model_name, self.version)['feature_columns']
+            self.price_store = PriceFeatureStore(config.price_feature_store_dir)
+
+            self.window_dir = os.path.join(config.monitor_dir, f"{config.model_name}-{self.version}-window")
+            return self
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def sketch_batch(self, batch_path):
+        '''
+        Histogram sketch of the model features of the client rows in batch_path
+        '''
+        sketch = self.reference.empty()
+        header = pd.read_csv(batch_path, nrows=0).columns
+        options = csv_options(CLIENT_SCHEMA, [column for column in CLIENT_SCHEMA if column in header])
+        with profile_step("sketch_batch") as step:
+            for chunk in pd.read_csv(batch_path, chunksize=self.drift_monitor_config.chunksize, **options):
+                price_features = self.price_store.features(chunk['id'].unique()).set_index('id')
+                _, X = self.service.feature_matrix(chunk, price_features)
+                sketch.update(X)
+            step.rows_in = sketch.n_rows
+        return sketch
+
+    def _alerts(self, scope, metrics):
+        config = self.drift_monitor_config
+        alerts = []
+        for row in metrics.itertuples(index=False):
+            for metric, threshold in (('psi', config.psi_threshold), ('ks', config.ks_threshold)):
+                value = getattr(row, metric)
+                if value > threshold:
+                    alerts.append({'model': config.model_name, 'version': self.version, 'scope': scope,
+                                   'feature': row.feature, 'metric': metric, 'value': round(float(value), 6),
+                                   'threshold': threshold, 'rows': int(row.rows)})
+        return alerts
+
+    def _window_files(self):
+        # Batch sketches are named by arrival number, so the names sort in arrival order
+        return sorted(file_name for file_name in os.listdir(self.window_dir) if file_name.endswith(".npz"))
+
+    def monitor(self, batch_paths, reset=False):
+        '''
+        Check every batch and the updated window, write the report and append the alerts.
+        Returns (report, alerts).
+        '''
+        try:
+            logging.info("Entered the drift monitor")
+            config = self.drift_monitor_config
+            if reset:
+                shutil.rmtree(self.window_dir, ignore_errors=True)
+            os.makedirs(self.window_dir, exist_ok=True)
+            window_files = self._window_files()
+            arrival = int(window_files[-1].split("-", 1)[0]) + 1 if window_files else 0
+
+            reports, alerts = [], []
+            for batch_path in batch_paths:
+                batch = self.sketch_batch(batch_path)
+                stem = os.path.splitext(os.path.basename(batch_path))[0]
+                sketch_path = os.path.join(self.window_dir, f"{arrival:08d}-{stem}.npz")
+                batch.save(sketch_path + ".tmp")
+                os.replace(sketch_path + ".tmp", sketch_path)
+                arrival += 1
+                if batch.n_rows >= config.min_batch_rows:
+                    metrics = drift_metrics(self.reference, batch)
+                    metrics.insert(0, 'scope', os.path.basename(batch_path))
+                    reports.append(metrics)
+                    alerts += self._alerts(os.path.basename(batch_path), metrics)
+                logging.info(f"Sketched {batch.n_rows} rows of {batch_path}")
+
+            window_files = self._window_files()
+            for file_name in window_files[:-config.window_batches]:
+                os.remove(os.path.join(self.window_dir, file_name))
+            window = self.reference.empty()
+            for file_name in window_files[-config.window_batches:]:
+                window.merge(FeatureSketch.load(os.path.join(self.window_dir, file_name)))
+            metrics = drift_metrics(self.reference, window)
+            metrics.insert(0, 'scope', 'window')
+            reports.append(metrics)
+            alerts += self._alerts('window', metrics)
+
+            report = pd.concat(reports, ignore_index=True)
+            report.to_csv(config.report_path, index=False)
+            created = datetime.now().isoformat(timespec='seconds')
+            with open(config.alerts_path, "a") as file_obj:
+                for alert in alerts:
+                    file_obj.write(json.dumps({'created': created, **alert}) + "\n")
+
+            print(metrics.sort_values('psi', ascending=False).head(10).to_string(index=False))
+            print(f"{len(alerts)} drift alert(s), window of {window.n_rows} rows "
+                  f"in the last {min(len(window_files), config.window_batches)} batch(es)")
+            for alert in alerts:
+                logging.warning(f"Drift alert: {alert}")
+            return report, alerts
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check batches of client rows for drift from the training data")
+    parser.add_argument('batches', nargs='+', help="csv files of raw client rows, in arrival order")
+    parser.add_argument('--model', default=None, help="stored model name, the serving forest by default")
+    parser.add_argument('--reset', action='store_true', help="start a new window instead of extending the stored one")
+    parser.add_argument('--window-batches', type=int, default=None, help="batches kept in the window")
+    parser.add_argument('--chunksize', type=int, default=None)
+    args = parser.parse_args()
+    obj = DriftMonitor()
+    if args.model:
+        obj.drift_monitor_config.model_name = args.model
+    if args.chunksize:
+        obj.drift_monitor_config.chunksize = args.chunksize
+    if args.window_batches:
+        obj.drift_monitor_config.window_batches = args.window_batches
+    obj.load().monitor(args.batches, reset=args.reset)
@@ -0,0 +1,187 @@
+import os
+import sys
+import argparse
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging, profile_step
+from src.feature_matrix import load_feature_matrix
+from src.model_store import ModelStore
+from src.tree_shap import forest_shap_values
+
+
+@dataclass
+class ModelExplainerConfig:
+    data_path = os.path.join("data", "data_for_predictions.csv")
+    feature_matrix_dir = os.path.join("data", "features")
+    model_store_dir = os.path.join("data", "models")
+    # The explanations describe the model that scores the clients
+    model_name = "churn_serving"
+    model_version = None  # None explains the latest version
+    contributions_path = os.path.join("data", "explanations", "contributions.parquet")
+    importance_path = os.path.join("data", "explanations", "permutation_importance.csv")
+    # Permutation importance is measured on a random subsample of the clients
+    importance_rows = 5000
+    n_repeats = 5
+    scoring = "roc_auc"  # "roc_auc" or "accuracy"
+    # Permuted copies of the subsample are stacked and scored together, up to batch_rows rows per call
+    batch_rows = 1 << 18
+    max_workers = os.cpu_count()
+    random_state = 42
+
+
+# Set once in every worker process by _init_scorer, so the model and the subsample are not
+# sent again with each batch
+_scorer = {}
+
+
+def _init_scorer(model_store_dir, model_name, model_version, X, y, scoring):
+    store = ModelStore(model_store_dir)
+    # Manifests written before the boosted models were stored have no 'flat' entry and are forests
+    if store.manifest(model_name, model_version).get('flat', True):
+        model = store.load_flat(model_name, model_version)
+    else:
+        model = store.load_model(model_name, model_version)
+    _scorer.update(model=model, X=X, y=y, scoring=scoring)
+
+
+def _score(y_true, proba, scoring):
+    from sklearn import metrics
+
+    if scoring == "accuracy":
+        return metrics.accuracy_score(y_true, proba >= 0.5)
+    return metrics.roc_auc_score(y_true, proba)
+
+
+def _score_permutations(tasks, random_state):
+    '''
+    Scores of the subsample with one column permuted, for every (feature, repeat) of tasks, from
+    one predict_proba call over the stacked copies
+    '''
+    X, y = _scorer['X'], _scorer['y']
+    stacked = np.tile(X, (len(tasks), 1))
+    for i, (feature, repeat) in enumerate(tasks):
+        rng = np.random.default_rng([random_state, feature, repeat])
+        stacked[i * len(X):(i + 1) * len(X), feature] = X[rng.permutation(len(X)), feature]
+    proba = _scorer['model'].predict_proba(stacked)[:, 1].reshape(len(tasks), len(X))
+    return [_score(y, row, _scorer['scoring']) for row in proba]
+
+
+class ModelExplainer:
+    '''
+    Global and per-client explanations of the stored churn model.
+
+    Permutation importance permutes one column of a subsample at a time and stacks many permuted
+    copies into each predict_proba call of the flat forest, with the batches split between worker
+    processes. The per-client contributions are exact TreeSHAP values for every row of the
+    prediction data, written as one float32 column per feature to a parquet file keyed by id.
+    '''
+
+    def __init__(self):
+        self.model_explainer_config = ModelExplainerConfig()
+
+    def permutation_importance(self, X, y, feature_columns):
+        '''
+        Mean and standard deviation of the score lost when each feature is permuted
+        '''
+        config = self.model_explainer_config
+        rng = np.random.default_rng(config.random_state)
+        rows = np.sort(rng.choice(len(y), size=min(config.importance_rows, len(y)), replace=False))
+        X_sample, y_sample = np.ascontiguousarray(X[rows]), y[rows]
+
+        tasks = [(feature, repeat) for feature in range(X.shape[1]) for repeat in range(config.n_repeats)]
+        per_batch = max(1, config.batch_rows // len(rows))
+        batches = [tasks[start:start + per_batch] for start in range(0, len(tasks), per_batch)]
+        init_args = (config.model_store_dir, config.model_name, config.model_version, X_sample, y_sample,
+                     config.scoring)
+
+        with profile_step("permutation_importance", rows_in=len(rows) * (len(tasks) + 1)):
+            workers = min(len(batches), config.max_workers or 1)
+            if workers <= 1:
+                _init_scorer(*init_args)
+                baseline = _score(y_sample, _scorer['model'].predict_proba(X_sample)[:, 1], config.scoring)
+                scores = [_score_permutations(batch, config.random_state) for batch in batches]
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_scorer, initargs=init_args) as executor:
+                    futures = [executor.submit(_score_permutations, batch, config.random_state) for batch in batches]
+                    _init_scorer(*init_args)
+                    baseline = _score(y_sample, _scorer['model'].predict_proba(X_sample)[:, 1], config.scoring)
+                    scores = [future.result() for future in futures]
+
+        drops = baseline - np.array([score for batch in scores for score in batch]).reshape(X.shape[1], config.n_repeats)
+        importance = pd.DataFrame({
+            'feature': feature_columns,
+            'importance_mean': drops.mean(axis=1),
+            'importance_std': drops.std(axis=1)
+        })
+        logging.info(f"Permutation importance on {len(rows)} rows, baseline {config.scoring} {baseline}")
+        return importance.sort_values('importance_mean', ascending=False, ignore_index=True)
+
+    def contributions(self, model, X, ids, feature_columns):
+        '''
+        One row per client: id, churn probability, the expected value and the contribution of every feature
+        '''
+        config = self.model_explainer_config
+        with profile_step("tree_shap", rows_in=len(X)):
+            phi, expected_value = forest_shap_values(model, X, class_index=list(model.classes_).index(1),
+                                                     max_workers=config.max_workers)
+        explanations = pd.DataFrame(phi.astype(np.float32), columns=feature_columns)
+        explanations.insert(0, 'id', ids)
+        explanations.insert(1, 'churn_probability', (phi.sum(axis=1) + expected_value).astype(np.float32))
+        explanations.insert(2, 'expected_value', np.float32(expected_value))
+        return explanations
+
+    def explain(self):
+        '''
+        Write the permutation importance csv and the per-client contributions parquet, returning both frames
+        '''
+        try:
+            logging.info("Entered the model explainer module")
+            config = self.model_explainer_config
+            store = ModelStore(config.model_store_dir)
+            manifest = store.manifest(config.model_name, config.model_version)
+            if not manifest.get('flat', True):
+                raise ValueError(f"{config.model_name} is a {manifest['model_class']}, "
+                                 "the TreeSHAP contributions need a random forest")
+
+            X, y, feature_columns = load_feature_matrix(config.data_path, config.feature_matrix_dir)
+            if list(feature_columns) != manifest['feature_columns']:
+                raise ValueError(f"The columns of {config.data_path} do not match the features of {config.model_name}")
+            ids = pd.read_csv(config.data_path, usecols=['id'])['id'].to_numpy()
+
+            importance = self.permutation_importance(X, y, feature_columns)
+            os.makedirs(os.path.dirname(config.importance_path) or '.', exist_ok=True)
+            importance.to_csv(config.importance_path, index=False)
+            print(importance.head(15).to_string(index=False))
+
+            model = store.load_model(config.model_name, config.model_version)
+            explanations = self.contributions(model, X, ids, feature_columns)
+            os.makedirs(os.path.dirname(config.contributions_path) or '.', exist_ok=True)
+            with profile_step("write_parquet:contributions", rows_out=len(explanations)):
+                explanations.to_parquet(config.contributions_path + ".tmp", index=False, compression='zstd')
+                os.replace(config.contributions_path + ".tmp", config.contributions_path)
+            logging.info(f"Wrote the contributions of {len(explanations)} clients to {config.contributions_path}")
+            return importance, explanations
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Permutation importance and per-client TreeSHAP contributions")
+    parser.add_argument('--model', default=None, help="stored model name, the serving forest by default")
+    parser.add_argument('--importance-rows', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    obj = ModelExplainer()
+    if args.model:
+        obj.model_explainer_config.model_name = args.model
+    if args.importance_rows:
+        obj.model_explainer_config.importance_rows = args.importance_rows
+    if args.workers:
+        obj.model_explainer_config.max_workers = args.workers
+    obj.explain()
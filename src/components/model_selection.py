@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging, profile_step
+from src.utils import file_fingerprint
+from src.feature_matrix import load_feature_matrix
+from src.model_store import ModelStore
+
+# Values sampled for each hyperparameter, per model family
+SEARCH_SPACES = {
+    'random_forest': {
+        'max_depth': [None, 8, 12, 16],
+        'min_samples_leaf': [1, 2, 5, 10],
+        'max_features': ['sqrt', 0.3, 0.5],
+        'class_weight': [None, 'balanced_subsample']
+    },
+    'xgboost': {
+        'max_depth': [3, 4, 6, 8],
+        'learning_rate': [0.03, 0.1, 0.3],
+        'subsample': [0.7, 0.85, 1.0],
+        'colsample_bytree': [0.6, 0.8, 1.0],
+        'min_child_weight': [1, 5],
+        'reg_lambda': [1.0, 5.0]
+    },
+    'catboost': {
+        'depth': [4, 6, 8],
+        'learning_rate': [0.03, 0.1, 0.3],
+        'l2_leaf_reg': [1.0, 3.0, 10.0],
+        'random_strength': [0.5, 1.0, 2.0]
+    }
+}
+
+
+@dataclass
+class ModelSelectionConfig:
+    train_data_path = os.path.join("data", "data_for_predictions.csv")
+    feature_matrix_dir = os.path.join("data", "features")
+    model_store_dir = os.path.join("data", "models")
+    model_name = "churn_selected"
+    leaderboard_path = os.path.join("data", "model_selection_leaderboard.csv")
+    families = ('random_forest', 'xgboost', 'catboost')
+    candidates_per_family = 9
+    # Successive halving over the number of trees / boosting rounds, from each family's minimum to
+    # its maximum: every rung multiplies the budget by eta and keeps the best 1/eta of the candidates
+    resources = {
+        'random_forest': (25, 500),
+        'xgboost': (50, 1000),
+        'catboost': (50, 1000)
+    }
+    eta = 3
+    n_folds = 5
+    # Held-out split, the same as ModelTrainer's, used only to report the selected model
+    test_size = 0.25
+    scoring = "roc_auc"  # "roc_auc" or "accuracy"
+    # Quantile bins of the xgboost and catboost candidates, the binning is done once per fold and trial thread
+    n_bins = 255
+    # Total CPU threads, split between parallel_trials trials running at the same time
+    cpu_budget = os.cpu_count()
+    parallel_trials = None  # None runs one trial per 4 threads
+    random_state = 42
+
+
+class ModelSelection:
+    '''
+    Hyperparameter search over random forest, xgboost (hist) and catboost candidates with
+    successive halving.
+
+    The stratified fold assignment is computed once and cached next to the feature matrix and the
+    fold slices of the float32 feature matrix are cut once. Trials (candidate, fold) run in a
+    thread pool, each with its share of the CPU budget. The xgboost QuantileDMatrix and quantized
+    catboost Pool of a fold are built once per worker thread and reused by the trials that thread
+    runs, so concurrent trials never share one.
+    '''
+
+    def __init__(self):
+        self.model_selection_config = ModelSelectionConfig()
+        self._thread_matrices = threading.local()
+
+    def sample_candidates(self):
+        config = self.model_selection_config
+        rng = np.random.default_rng(config.random_state)
+        candidates = []
+        for family in config.families:
+            space = SEARCH_SPACES[family]
+            seen = set()
+            for _ in range(config.candidates_per_family * 20):
+                params = {name: values[rng.integers(len(values))] for name, values in space.items()}
+                key = json.dumps(params, sort_keys=True, default=str)
+                if key not in seen:
+                    seen.add(key)
+                    candidates.append({'family': family, 'params': params})
+                if len(seen) == config.candidates_per_family:
+                    break
+        return candidates
+
+    def fold_assignment(self, y, source_fingerprint):
+        '''
+        Stratified fold number of every training row, cached on disk for the same data and settings
+        '''
+        from sklearn.model_selection import StratifiedKFold
+
+        config = self.model_selection_config
+        stem = os.path.splitext(os.path.basename(config.train_data_path))[0]
+        fold_path = os.path.join(config.feature_matrix_dir,
+                                 f"{stem}.folds-{config.n_folds}-{config.random_state}-{source_fingerprint[:16]}.npy")
+        if os.path.exists(fold_path):
+            folds = np.load(fold_path)
+            if len(folds) == len(y):
+                return folds
+
+        folds = np.empty(len(y), dtype=np.int8)
+        splitter = StratifiedKFold(n_splits=config.n_folds, shuffle=True, random_state=config.random_state)
+        for fold, (_, val_idx) in enumerate(splitter.split(np.zeros(len(y)), y)):
+            folds[val_idx] = fold
+        os.makedirs(config.feature_matrix_dir, exist_ok=True)
+        np.save(fold_path, folds)
+        return folds
+
+    def _fold_data(self, X, y, folds):
+        config = self.model_selection_config
+        fold_data = []
+        for fold in range(config.n_folds):
+            train_idx, val_idx = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+            fold_data.append({'X_train': X[train_idx], 'y_train': y[train_idx], 'X_val': X[val_idx],
+                              'y_val': y[val_idx]})
+        return fold_data
+
+    def _fold_matrices(self, family, fold, data):
+        '''
+        The binned training data of a boosted family on a fold, built on the first trial of the
+        calling thread and kept for its later trials
+        '''
+        config = self.model_selection_config
+        matrices = getattr(self._thread_matrices, 'folds', None)
+        if matrices is None:
+            matrices = self._thread_matrices.folds = {}
+        if (family, fold) not in matrices:
+            if family == 'xgboost':
+                import xgboost as xgb
+                dtrain = xgb.QuantileDMatrix(data['X_train'], data['y_train'], max_bin=config.n_bins)
+                matrices[(family, fold)] = (dtrain, xgb.DMatrix(data['X_val']))
+            else:
+                from catboost import Pool
+                pool = Pool(data['X_train'], data['y_train'])
+                pool.quantize(border_count=config.n_bins - 1)
+                matrices[(family, fold)] = pool
+        return matrices[(family, fold)]
+
+    def _score(self, y_true, proba):
+        from sklearn import metrics
+
+        if self.model_selection_config.scoring == "accuracy":
+            return metrics.accuracy_score(y_true, proba >= 0.5)
+        return metrics.roc_auc_score(y_true, proba)
+
+    def _trial(self, candidate, fold, data, resource, threads):
+        '''
+        Fit one candidate with resource trees / rounds on one fold and score it on the fold's rows
+        '''
+        model = self.build_model(candidate, resource, threads)
+        if candidate['family'] == 'random_forest':
+            model.fit(data['X_train'], data['y_train'])
+            proba = model.predict_proba(data['X_val'])[:, 1]
+        elif candidate['family'] == 'xgboost':
+            import xgboost as xgb
+            dtrain, dval = self._fold_matrices('xgboost', fold, data)
+            # The booster parameters the XGBClassifier of the refit trains with
+            params = {name: value for name, value in model.get_xgb_params().items() if value is not None}
+            proba = xgb.train(params, dtrain, num_boost_round=model.n_estimators).predict(dval)
+        else:
+            model.fit(self._fold_matrices('catboost', fold, data))
+            proba = model.predict_proba(data['X_val'])[:, 1]
+        return self._score(data['y_val'], proba)
+
+    def model_params(self, candidate, resource, threads):
+        '''
+        Constructor arguments of a candidate's estimator with resource trees / rounds, the same for
+        its trials and for the refit
+        '''
+        config = self.model_selection_config
+        params = candidate['params']
+        if candidate['family'] == 'random_forest':
+            return dict(n_estimators=resource, n_jobs=threads, random_state=config.random_state, **params)
+        if candidate['family'] == 'xgboost':
+            return dict(n_estimators=resource, tree_method='hist', max_bin=config.n_bins, n_jobs=threads,
+                        random_state=config.random_state, **params)
+        return dict(iterations=resource, thread_count=threads, random_seed=config.random_state,
+                    border_count=config.n_bins - 1, verbose=False, allow_writing_files=False, **params)
+
+    def build_model(self, candidate, resource, threads):
+        '''
+        Unfitted sklearn-compatible estimator for a candidate
+        '''
+        if candidate['family'] == 'random_forest':
+            from sklearn.ensemble import RandomForestClassifier as Estimator
+        elif candidate['family'] == 'xgboost':
+            from xgboost import XGBClassifier as Estimator
+        else:
+            from catboost import CatBoostClassifier as Estimator
+        return Estimator(**self.model_params(candidate, resource, threads))
+
+    def rung_resource(self, family, rung):
+        '''
+        Trees / rounds of a family's candidates at a rung: the family's minimum times eta per rung,
+        capped at its maximum
+        '''
+        min_resource, max_resource = self.model_selection_config.resources[family]
+        return min(min_resource * self.model_selection_config.eta ** rung, max_resource)
+
+    def successive_halving(self, candidates, fold_data):
+        '''
+        Run the rungs and return one leaderboard row per candidate, from the last rung it reached
+        '''
+        config = self.model_selection_config
+        parallel = config.parallel_trials or max(1, config.cpu_budget // 4)
+        threads = max(1, config.cpu_budget // parallel)
+        rows = {}
+        survivors = list(range(len(candidates)))
+        rung = 0
+        # Matrices of an earlier search are not reused, the worker threads are new
+        self._thread_matrices = threading.local()
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            while True:
+                resource = {i: self.rung_resource(candidates[i]['family'], rung) for i in survivors}
+                start = time.perf_counter()
+                with profile_step(f"selection_rung_{rung}", rows_in=len(survivors)):
+                    futures = {
+                        (i, fold): executor.submit(self._trial, candidates[i], fold, data, resource[i], threads)
+                        for i in survivors for fold, data in enumerate(fold_data)
+                    }
+                    scores = {i: [futures[(i, fold)].result() for fold in range(len(fold_data))] for i in survivors}
+                seconds = time.perf_counter() - start
+
+                for i in survivors:
+                    rows[i] = {
+                        'candidate': i,
+                        'family': candidates[i]['family'],
+                        'params': json.dumps(candidates[i]['params'], default=str),
+                        'rung': rung,
+                        'n_estimators': resource[i],
+                        'score_mean': float(np.mean(scores[i])),
+                        'score_std': float(np.std(scores[i]))
+                    }
+                ranked = sorted(survivors, key=lambda i: rows[i]['score_mean'], reverse=True)
+                trees = f"{min(resource.values())}-{max(resource.values())}"
+                logging.info(f"Rung {rung}: {len(survivors)} candidates at {trees} trees in {seconds:.1f}s, "
+                             f"best {rows[ranked[0]]['family']} {config.scoring} {rows[ranked[0]]['score_mean']:.4f}")
+                print(f"rung {rung}: {len(survivors):>3} candidates x {trees:>9} trees  {seconds:7.1f}s  "
+                      f"best {config.scoring} {rows[ranked[0]]['score_mean']:.4f} ({rows[ranked[0]]['family']})")
+
+                if len(survivors) == 1 or all(resource[i] >= config.resources[candidates[i]['family']][1]
+                                              for i in survivors):
+                    break
+                survivors = ranked[:max(1, len(survivors) // config.eta)]
+                rung += 1
+
+        leaderboard = pd.DataFrame(list(rows.values()))
+        return leaderboard.sort_values(['rung', 'score_mean'], ascending=False, ignore_index=True)
+
+    def select_model(self):
+        '''
+        Search the candidates, refit the winner on the whole training split and store it.
+        Returns (best model, leaderboard).
+        '''
+        try:
+            from sklearn import metrics
+            from sklearn.model_selection import train_test_split
+
+            config = self.model_selection_config
+            logging.info("Entered the model selection module")
+            X, y, feature_columns = load_feature_matrix(config.train_data_path, config.feature_matrix_dir)
+            train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=config.test_size, random_state=42)
+            X_train, y_train = X[train_idx], y[train_idx]
+            X_test, y_test = X[test_idx], y[test_idx]
+
+            training_data_hash = file_fingerprint(config.train_data_path)
+            folds = self.fold_assignment(y_train, training_data_hash)
+            with profile_step("selection_fold_data", rows_in=len(y_train)):
+                fold_data = self._fold_data(X_train, y_train, folds)
+
+            candidates = self.sample_candidates()
+            leaderboard = self.successive_halving(candidates, fold_data)
+            best = leaderboard.iloc[0]
+            candidate = candidates[int(best['candidate'])]
+            print(leaderboard.head(10).to_string(index=False))
+
+            with profile_step("selection_refit", rows_in=len(y_train)):
+                model = self.build_model(candidate, int(best['n_estimators']), config.cpu_budget)
+                model.fit(X_train, y_train)
+            proba = model.predict_proba(X_test)[:, 1]
+            scores = {
+                'family': candidate['family'],
+                'params': candidate['params'],
+                'cv_' + config.scoring: float(best['score_mean']),
+                'roc_auc': float(metrics.roc_auc_score(y_test, proba)),
+                'accuracy': float(metrics.accuracy_score(y_test, model.classes_[(proba >= 0.5).astype(int)])),
+                'n_estimators': int(best['n_estimators'])
+            }
+            print(f"Selected {candidate['family']} {candidate['params']}: test roc_auc {scores['roc_auc']:.4f}, "
+                  f"accuracy {scores['accuracy']:.4f}")
+
+            os.makedirs(os.path.dirname(config.leaderboard_path) or '.', exist_ok=True)
+            leaderboard.to_csv(config.leaderboard_path, index=False)
+            ModelStore(config.model_store_dir).save(config.model_name, model, feature_columns, training_data_hash,
+                                                    scores)
+            logging.info(f"Selected {candidate['family']} with test roc_auc {scores['roc_auc']}")
+            return model, leaderboard
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hyperparameter search with successive halving")
+    parser.add_argument('--families', nargs='+', choices=sorted(SEARCH_SPACES), default=None)
+    parser.add_argument('--candidates', type=int, default=None, help="candidates per family")
+    parser.add_argument('--cpu-budget', type=int, default=None, help="total threads used by the trials")
+    args = parser.parse_args()
+    obj = ModelSelection()
+    if args.families:
+        obj.model_selection_config.families = tuple(args.families)
+    if args.candidates:
+        obj.model_selection_config.candidates_per_family = args.candidates
+    if args.cpu_budget:
+        obj.model_selection_config.cpu_budget = args.cpu_budget
+    obj.select_model()
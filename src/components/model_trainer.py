@@ -1,56 +1,194 @@
 import os
 import sys
+import copy
 from dataclasses import dataclass
+import numpy as np
 import pandas as pd
-from sklearn import metrics
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-import matplotlib.pyplot as plt
 
 
 from src.exception import CustomException
-from src.logger import logging
+from src.logger import logging, profile_step
 
-from src.utils import save_object
+from src.utils import file_fingerprint
+from src.feature_matrix import load_feature_matrix
+from src.model_store import ModelStore
+from src.drift import FeatureSketch
 
 @dataclass
 class ModelTrainerConfig:
     train_data_path=os.path.join("data","data_for_predictions.csv")
-    model_path = os.path.join("data", "model.pkl")
+    # Versioned artifacts of the full forest and of the smaller serving forest
+    model_store_dir = os.path.join("data", "models")
+    model_name = "churn"
+    serving_model_name = "churn_serving"
+    keep_model_versions = 5
+    model_compress = 0  # joblib compression level, 0 keeps the artifact memory-mappable
+    feature_matrix_dir = os.path.join("data", "features")
+    # Upper bound on the forest size, grown in warm-start steps of estimator_step trees
+    n_estimators = 1000
+    estimator_step = 50
+    # Stop growing once the score has not improved by min_improvement for patience steps
+    early_stopping = True
+    early_stopping_score = "oob"  # "oob" or "validation"
+    validation_fraction = 0.1
+    patience = 3
+    min_improvement = 1e-4
+    # -1 uses every core, the backend is any joblib backend ("threading", "loky", ...)
+    n_jobs = -1
+    joblib_backend = "threading"
+    # Largest out-of-bag (or validation) accuracy loss accepted for the smaller serving forest
+    serving_tolerance = 0.005
+    # Histogram bins per feature of the training distribution saved for drift monitoring
+    drift_bins = 64
+    drift_reference_file = "drift_reference.npz"
+
+
+def out_of_bag_rows(tree, n_samples):
+    '''
+    Mask of the rows left out of the bootstrap sample of a forest tree, redrawn from its
+    random_state as the forest drew it
+    '''
+    bootstrap = np.random.RandomState(tree.random_state).randint(0, n_samples, n_samples)
+    return np.bincount(bootstrap, minlength=n_samples) == 0
 
 class ModelTrainer:
     def __init__(self):
         self.model_trainer_config=ModelTrainerConfig()
 
 
+    def validation_split(self, y_train):
+        '''
+        Row indices (fit, validation) of the training rows, for the validation early stopping score
+        '''
+        from sklearn.model_selection import train_test_split
+
+        return train_test_split(np.arange(len(y_train)), test_size=self.model_trainer_config.validation_fraction,
+                                random_state=42, stratify=y_train)
+
+    def fit_forest(self, X_train, y_train):
+        '''
+        Grow the random forest in warm-start steps until the out-of-bag or validation accuracy
+        stops improving, or the n_estimators budget is spent
+        '''
+        from sklearn import metrics
+        from sklearn.ensemble import RandomForestClassifier
+
+        config = self.model_trainer_config
+        use_oob = config.early_stopping and config.early_stopping_score == "oob"
+        # The out-of-bag score is accumulated below, sklearn's oob_score would recompute it over every tree at each step
+        model = RandomForestClassifier(
+            n_jobs=config.n_jobs,
+            warm_start=True
+        )
+
+        X_fit, y_fit = X_train, y_train
+        X_val, y_val = X_train, y_train
+        if config.early_stopping and not use_oob:
+            fit_idx, val_idx = self.validation_split(y_train)
+            X_fit, y_fit = X_train[fit_idx], y_train[fit_idx]
+            X_val, y_val = X_train[val_idx], y_train[val_idx]
+        val_proba = None
+
+        best_score, stale_steps, grown = -np.inf, 0, 0
+        while grown < config.n_estimators:
+            model.set_params(n_estimators=min(grown + config.estimator_step, config.n_estimators))
+            model.fit(X_fit, y_fit)
+            new_trees, grown = model.estimators_[grown:], model.n_estimators
+            if not config.early_stopping:
+                continue
+
+            # Only the new trees are evaluated, their probabilities are added to the running sum
+            if val_proba is None:
+                val_proba = np.zeros((len(y_val), len(model.classes_)))
+            for tree in new_trees:
+                # Out-of-bag, each tree votes on the training rows left out of its bootstrap sample
+                rows = out_of_bag_rows(tree, len(y_val)) if use_oob else slice(None)
+                val_proba[rows] += tree.predict_proba(X_val[rows])
+            score = metrics.accuracy_score(y_val, model.classes_[val_proba.argmax(axis=1)])
+            logging.info(f"{model.n_estimators} trees, {config.early_stopping_score} accuracy {score}")
+
+            if score > best_score + config.min_improvement:
+                best_score, stale_steps = score, 0
+            else:
+                stale_steps += 1
+                if stale_steps >= config.patience:
+                    break
+
+        return model
+
+    def serving_forest(self, model, X_train, y_train):
+        '''
+        Smallest leading subset of the forest, in multiples of estimator_step trees, whose accuracy is
+        within serving_tolerance of the full forest. The accuracy is taken on training rows the trees
+        did not see, the validation rows when the forest was grown against them and otherwise each
+        tree's out-of-bag rows, so the test split is only used to report the chosen forest. Every size
+        is scored on the same rows, the ones the smallest size has a vote for.
+        '''
+        from sklearn import metrics
+
+        config = self.model_trainer_config
+        if config.early_stopping and config.early_stopping_score == "validation":
+            _, val_idx = self.validation_split(y_train)
+            X_held, y_held = X_train[val_idx], y_train[val_idx]
+            held_out = [slice(None)] * len(model.estimators_)
+        else:
+            X_held, y_held = X_train, y_train
+            held_out = [out_of_bag_rows(tree, len(y_train)) for tree in model.estimators_]
+
+        n_trees = len(model.estimators_)
+        sizes = set(range(config.estimator_step, n_trees, config.estimator_step)) | {n_trees}
+        accuracy, proba, voted = {}, np.zeros((len(y_held), len(model.classes_))), None
+        for i, (tree, rows) in enumerate(zip(model.estimators_, held_out), start=1):
+            proba[rows] += tree.predict_proba(X_held[rows])
+            if i in sizes:
+                # Larger sizes only add votes, so the rows voted at the smallest size are voted at every size
+                if voted is None:
+                    voted = proba.sum(axis=1) > 0
+                accuracy[i] = metrics.accuracy_score(y_held[voted], model.classes_[proba[voted].argmax(axis=1)])
+
+        size = next(size for size in sorted(sizes) if accuracy[size] >= accuracy[n_trees] - config.serving_tolerance)
+        logging.info(f"Serving forest: {size} trees, accuracy {accuracy[size]} (full {accuracy[n_trees]})")
+
+        # The trees are shared with the full forest, only the out-of-bag results are not carried over
+        serving_model = copy.copy(model)
+        serving_model.estimators_ = model.estimators_[:size]
+        serving_model.n_estimators = size
+        for attribute in ('oob_score_', 'oob_decision_function_'):
+            serving_model.__dict__.pop(attribute, None)
+        return serving_model
+
     def model_trainer(self):
         try:
-            logging.info("Entered the model training module")
-            df = pd.read_csv(self.model_trainer_config.train_data_path)
-            df.drop(columns=["Unnamed: 0"], inplace=True)
-            df.head()
-
-            # Make a copy of our data
-            train_df = df.copy()
+            # sklearn and matplotlib are imported here so importing the module (e.g. for its config) stays cheap
+            import matplotlib.pyplot as plt
+            from joblib import parallel_config
+            from sklearn import metrics
+            from sklearn.model_selection import train_test_split
 
-            # Separate target variable from independent variables
-            y = df['churn']
-            X = df.drop(columns=['id', 'churn'])
+            logging.info("Entered the model training module")
+            # Contiguous float32 memory map of the features, splits are taken as row indices
+            X, y, feature_columns = load_feature_matrix(self.model_trainer_config.train_data_path,
+                                                        self.model_trainer_config.feature_matrix_dir)
             print(X.shape)
             print(y.shape)
 
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=42)
+            train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=0.25, random_state=42)
+            X_train, y_train = X[train_idx], y[train_idx]
+            X_test, y_test = X[test_idx], y[test_idx]
             print(X_train.shape)
             print(y_train.shape)
             print(X_test.shape)
             print(y_test.shape)
 
-            model = RandomForestClassifier(
-                n_estimators=1000
-            )
-            model.fit(X_train, y_train)
+            with parallel_config(backend=self.model_trainer_config.joblib_backend,
+                                 n_jobs=self.model_trainer_config.n_jobs), \
+                    profile_step("fit_forest", rows_in=len(y_train)):
+                model = self.fit_forest(X_train, y_train)
+            print(f"Trees used: {len(model.estimators_)}")
+            logging.info(f"Trained a forest of {len(model.estimators_)} trees")
 
-            predictions = model.predict(X_test)
+            with profile_step("predict", rows_in=len(y_test), rows_out=len(y_test)):
+                predictions = model.predict(X_test)
             tn, fp, fn, tp = metrics.confusion_matrix(y_test, predictions).ravel()
 
             print(f"True positives: {tp}")
@@ -58,9 +196,18 @@ class ModelTrainer:
             print(f"True negatives: {tn}")
             print(f"False negatives: {fn}\n")
 
-            print(f"Accuracy: {metrics.accuracy_score(y_test, predictions)}")
-            print(f"Precision: {metrics.precision_score(y_test, predictions)}")
-            print(f"Recall: {metrics.recall_score(y_test, predictions)}")
+            scores = {
+                'accuracy': float(metrics.accuracy_score(y_test, predictions)),
+                'precision': float(metrics.precision_score(y_test, predictions)),
+                'recall': float(metrics.recall_score(y_test, predictions)),
+                'true_positives': int(tp),
+                'false_positives': int(fp),
+                'true_negatives': int(tn),
+                'false_negatives': int(fn)
+            }
+            print(f"Accuracy: {scores['accuracy']}")
+            print(f"Precision: {scores['precision']}")
+            print(f"Recall: {scores['recall']}")
 
             # Model understanding
             # A simple way of understanding the results of a model is to look at feature importance's.
@@ -68,7 +215,7 @@ class ModelTrainer:
             # there are several ways to calculate feature importance,
 
             feature_importance = pd.DataFrame({
-                'features': X_train.columns,
+                'features': feature_columns,
                 'importance': model.feature_importances_
             }).sort_values(by='importance', ascending=True).reset_index()
 
@@ -78,15 +225,24 @@ class ModelTrainer:
             plt.yticks(range(len(feature_importance)), feature_importance['features'])
             plt.xlabel('Importance')
             plt.savefig(os.path.join('images', "feature_importance.png"))
-            plt.show()
-
-            save_object(self.model_trainer_config.model_path, model)
-
-
-
-
-
-
+            plt.close()
+
+            store = ModelStore(self.model_trainer_config.model_store_dir,
+                               keep_versions=self.model_trainer_config.keep_model_versions)
+            training_data_hash = file_fingerprint(self.model_trainer_config.train_data_path)
+            # Both models keep the training distribution, the drift monitor compares scored batches to it
+            reference = FeatureSketch.from_reference(X_train, feature_columns, self.model_trainer_config.drift_bins)
+            artifacts = {self.model_trainer_config.drift_reference_file: reference.save}
+            store.save(self.model_trainer_config.model_name, model, feature_columns, training_data_hash, scores,
+                       compress=self.model_trainer_config.model_compress, artifacts=artifacts)
+
+            serving_model = self.serving_forest(model, X_train, y_train)
+            print(f"Serving trees: {len(serving_model.estimators_)}")
+            # The serving size was chosen without the test rows, their accuracy is only reported
+            serving_scores = {'accuracy': float(metrics.accuracy_score(y_test, serving_model.predict(X_test)))}
+            store.save(self.model_trainer_config.serving_model_name, serving_model, feature_columns,
+                       training_data_hash, serving_scores, compress=self.model_trainer_config.model_compress,
+                       artifacts=artifacts)
 
         except Exception as e:
             raise CustomException(e,sys)
@@ -0,0 +1,298 @@
+import io
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib import request as urllib_request
+
+import numpy as np
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging, profile_step
+from src.components.data_transformation import DataTransformation
+from src.model_store import ModelStore
+from src.price_features import build_price_features
+from src.schema import CLIENT_SCHEMA, PRICE_SCHEMA, SchemaError, check_frame, csv_options, format_report, read_options
+from src.utils import read_csv_cached
+
+# Columns of a scoring request, the raw client columns without the churn label
+REQUEST_SCHEMA = {column: rules for column, rules in CLIENT_SCHEMA.items() if column != 'churn'}
+
+
+@dataclass
+class ScoringServiceConfig:
+    model_store_dir = os.path.join("data", "models")
+    model_name = "churn_serving"
+    model_version = None  # None serves the latest version
+    # "flat" serves the memory-mapped flat array predictor, "sklearn" the joblib estimator
+    model_kind = "flat"
+    price_data_path = os.path.join("data", "price_data.csv")
+    # Concurrent requests are merged into one predict_proba call of at most max_batch_rows rows,
+    # waiting at most max_wait_ms for more requests to join the batch
+    max_batch_rows = 4096
+    max_wait_ms = 5
+    # Latency budget checked by the load generator
+    p50_budget_ms = 100
+    p99_budget_ms = 400
+
+
+class ScoringService:
+    def __init__(self):
+        self.scoring_config = ScoringServiceConfig()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''
+        Load the model, the feature column order and the price features once, before serving
+        '''
+        try:
+            logging.info("Loading the scoring model")
+            store = ModelStore(self.scoring_config.model_store_dir)
+            config = self.scoring_config
+            if config.model_kind == "flat":
+                self.model = store.load_flat(config.model_name, config.model_version)
+            else:
+                self.model = store.load_model(config.model_name, config.model_version)
+            self.manifest = store.manifest(config.model_name, config.model_version)
+            self.feature_columns = self.manifest['feature_columns']
+            price_df = read_csv_cached(self.scoring_config.price_data_path, **read_options(PRICE_SCHEMA))
+            self.price_features = build_price_features(price_df).set_index('id')
+            logging.info(f"Scoring model {config.model_name} {self.manifest['version']} loaded")
+            return self
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def feature_matrix(self, client_df, price_features=None):
+        '''
+        The transformed frame and the float32 model input of the raw client rows that have price
+        history, in input order. price_features, indexed by id, defaults to the service's table.
+        Shared by score_frame and the drift monitor.
+        '''
+        price_features = self.price_features if price_features is None else price_features
+        # Only the price features of the batch's ids go into the join, not the whole table
+        ids = client_df['id'].unique()
+        ids = ids[price_features.index.get_indexer(ids) >= 0]
+        price_features = price_features.loc[ids].reset_index()
+        df = DataTransformation.transform_features(client_df.copy(), price_features)
+        df = DataTransformation.prediction_features(df)
+        # Dummy columns of channels and campaigns absent from the batch are all zeros
+        missing = [column for column in self.feature_columns if column not in df.columns]
+        for column in missing:
+            if not column.startswith(('channel_', 'origin_up_')):
+                raise ValueError(f"Client rows are missing the column {column}")
+            df[column] = 0
+        return df, df[self.feature_columns].to_numpy(dtype=np.float32)
+
+    def score_frame(self, client_df):
+        '''
+        Churn probability for each raw client row that has price history, in input order.
+        Returns a frame with the columns id and churn_probability.
+        '''
+        try:
+            df, X = self.feature_matrix(client_df)
+            with profile_step("predict_proba", rows_in=len(X), rows_out=len(X)):
+                probabilities = self.model.predict_proba(X)[:, 1] if len(X) else np.zeros(0)
+            scores = pd.DataFrame({'id': df['id'].to_numpy(), 'churn_probability': probabilities})
+            if '_request' in df.columns:
+                scores['_request'] = df['_request'].to_numpy()
+            return scores
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def submit(self, client_df):
+        '''
+        Score client rows through the micro-batcher, blocking until the batch holding them is done.
+        The rows are checked before they are queued, so a malformed request fails on its own.
+        '''
+        client_df = check_clients(client_df)
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._batch_worker, daemon=True)
+                self._worker.start()
+        future = Future()
+        self._queue.put((client_df, future))
+        return future.result()
+
+    def _batch_worker(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                frames = [client_df.assign(_request=i) for i, (client_df, _) in enumerate(batch)]
+                scores = self.score_frame(pd.concat(frames, ignore_index=True))
+                # The join keeps the row order, so each request's scores are one contiguous slice
+                bounds = np.searchsorted(scores.pop('_request').to_numpy(), np.arange(len(batch) + 1))
+                for i, (_, future) in enumerate(batch):
+                    future.set_result(scores.iloc[bounds[i]:bounds[i + 1]].reset_index(drop=True))
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._score_one_by_one(batch)
+
+    def _collect_batch(self):
+        '''
+        Queued requests up to max_batch_rows rows, waiting at most max_wait_ms after the first one
+        '''
+        batch = [self._queue.get()]
+        rows = len(batch[0][0])
+        deadline = time.monotonic() + self.scoring_config.max_wait_ms / 1000
+        while rows < self.scoring_config.max_batch_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _score_one_by_one(self, batch):
+        '''
+        Score the requests of a failed batch one at a time, so only the request that fails gets the error
+        '''
+        for client_df, future in batch:
+            try:
+                future.set_result(self.score_frame(client_df))
+            except Exception as error:
+                future.set_exception(error)
+
+
+def check_clients(client_df):
+    '''
+    Check raw client rows against REQUEST_SCHEMA and return the schema's columns with the numbers
+    cast to their types. Raises a SchemaError with the report of every problem.
+    '''
+    problems = check_frame(client_df, REQUEST_SCHEMA)
+    if problems:
+        raise SchemaError(format_report("request", len(client_df), problems))
+    client_df = client_df[list(REQUEST_SCHEMA)].copy()
+    for column, dtype in csv_options(REQUEST_SCHEMA)['dtype'].items():
+        if dtype != 'str':
+            client_df[column] = pd.to_numeric(client_df[column]).astype(dtype)
+    return client_df
+
+
+def parse_clients(body, content_type):
+    '''
+    Client rows from a request body: csv, a json list of records or {"clients": [records]}.
+    Only the columns of REQUEST_SCHEMA are kept, csv values are read as strings for check_clients.
+    '''
+    if 'csv' in (content_type or ''):
+        options = csv_options(REQUEST_SCHEMA)
+        return pd.read_csv(io.StringIO(body.decode() if isinstance(body, bytes) else body),
+                           usecols=lambda column: column in options['usecols'], dtype=str)
+    records = json.loads(body)
+    if isinstance(records, dict):
+        if 'clients' not in records:
+            raise ValueError("A json object body needs the clients key")
+        records = records['clients']
+    client_df = pd.DataFrame.from_records(records)
+    return client_df[[column for column in client_df.columns if column in REQUEST_SCHEMA]]
+
+
+def scores_to_json(client_df, scores):
+    scored = set(scores['id'])
+    return {
+        'scores': scores.to_dict(orient='records'),
+        'unscored': [client_id for client_id in client_df['id'] if client_id not in scored]
+    }
+
+
+def create_app(service):
+    '''
+    Flask app exposing POST /score (json or csv client rows) and GET /health
+    '''
+    from flask import Flask, request, jsonify
+
+    app = Flask(__name__)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({'status': 'ok', 'model': service.manifest['name'], 'version': service.manifest['version']})
+
+    @app.route('/score', methods=['POST'])
+    def score():
+        try:
+            client_df = parse_clients(request.get_data(), request.content_type)
+            return jsonify(scores_to_json(client_df, service.submit(client_df)))
+        except (SchemaError, ValueError) as e:
+            # A malformed body or the schema report, which names every offending column with a few of its values
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logging.exception("Scoring request failed")
+            return jsonify({'error': str(e)}), 500
+
+    return app
+
+
+def load_test(url, client_df, n_requests, concurrency, rows_per_request):
+    '''
+    Fire n_requests csv requests of rows_per_request client rows at url from concurrency threads,
+    returning the per-request latencies in milliseconds
+    '''
+    bodies = [
+        client_df.sample(rows_per_request, replace=True, random_state=i).to_csv(index=False).encode()
+        for i in range(min(n_requests, 64))
+    ]
+
+    def send(i):
+        req = urllib_request.Request(url, data=bodies[i % len(bodies)], headers={'Content-Type': 'text/csv'})
+        start = time.perf_counter()
+        with urllib_request.urlopen(req) as response:
+            response.read()
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return np.array(list(executor.map(send, range(n_requests))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Churn scoring over the trained model")
+    commands = parser.add_subparsers(dest='command', required=True)
+    score_parser = commands.add_parser('score', help="score a csv or json file of client rows")
+    score_parser.add_argument('--input', required=True)
+    score_parser.add_argument('--output')
+    serve_parser = commands.add_parser('serve', help="run the scoring endpoint")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    load_parser = commands.add_parser('loadtest', help="check a running endpoint against the latency budget")
+    load_parser.add_argument('--input', required=True, help="csv of client rows to sample requests from")
+    load_parser.add_argument('--url', default='http://127.0.0.1:5000/score')
+    load_parser.add_argument('--requests', type=int, default=500)
+    load_parser.add_argument('--concurrency', type=int, default=16)
+    load_parser.add_argument('--rows-per-request', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'loadtest':
+        config = ScoringServiceConfig()
+        latencies = load_test(args.url, pd.read_csv(args.input), args.requests, args.concurrency,
+                              args.rows_per_request)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"p50: {p50:.1f} ms (budget {config.p50_budget_ms} ms)")
+        print(f"p99: {p99:.1f} ms (budget {config.p99_budget_ms} ms)")
+        sys.exit(0 if p50 <= config.p50_budget_ms and p99 <= config.p99_budget_ms else 1)
+
+    obj = ScoringService().load()
+    if args.command == 'serve':
+        create_app(obj).run(host=args.host, port=args.port, threaded=True)
+    else:
+        with open(args.input, "rb") as file_obj:
+            content_type = 'text/csv' if args.input.endswith('.csv') else 'application/json'
+            clients = parse_clients(file_obj.read(), content_type)
+        scores = obj.score_frame(check_clients(clients))
+        if args.output:
+            scores.to_csv(args.output, index=False)
+        else:
+            print(scores.to_csv(index=False))
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+# Proportions are floored at this value in the PSI, so an empty bin on one side stays finite
+PSI_EPSILON = 1e-4
+
+
+class FeatureSketch:
+    '''
+    Fixed-edge histograms of every feature, a mergeable sketch of a feature distribution.
+
+    The bin edges are the training quantiles of each feature (repeated quantiles of discrete
+    features collapse into one edge, the unused edge slots are +inf), so the reference histogram
+    is close to uniform. Any batch is then summarised by its counts over the same edges: updating
+    costs one searchsorted and one bincount per batch, the memory is n_features x n_bins counts
+    whatever the number of rows, and sketches with the same edges merge by adding their counts.
+    '''
+
+    def __init__(self, feature_columns, edges, counts, missing):
+        self.feature_columns = list(feature_columns)
+        self.edges = edges        # (n_features, n_bins - 1) float64, bin k is [edges[k - 1], edges[k])
+        self.counts = counts      # (n_features, n_bins) int64
+        self.missing = missing    # (n_features,) int64 NaN counts
+
+    @property
+    def n_rows(self):
+        return int(self.counts[0].sum() + self.missing[0]) if len(self.counts) else 0
+
+    @classmethod
+    def from_reference(cls, X, feature_columns, n_bins=64):
+        '''
+        Sketch of the reference (training) rows, with edges at their quantiles
+        '''
+        X = np.asarray(X)
+        quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+        edges = np.full((X.shape[1], n_bins - 1), np.inf)
+        for j in range(X.shape[1]):
+            column = X[:, j].astype(np.float64)
+            column = column[~np.isnan(column)]
+            if len(column):
+                cuts = np.unique(np.quantile(column, quantiles))
+                edges[j, :len(cuts)] = cuts
+        sketch = cls(feature_columns, edges, np.zeros((X.shape[1], n_bins), dtype=np.int64),
+                     np.zeros(X.shape[1], dtype=np.int64))
+        return sketch.update(X)
+
+    def empty(self):
+        '''
+        A sketch with the same edges and no rows
+        '''
+        return FeatureSketch(self.feature_columns, self.edges, np.zeros_like(self.counts), np.zeros_like(self.missing))
+
+    def update(self, X):
+        '''
+        Add the rows of X (columns in feature_columns order) to the counts and return the sketch
+        '''
+        X = np.asarray(X)
+        n_features, n_bins = self.counts.shape
+        missing = np.isnan(X)
+        codes = np.empty(X.shape, dtype=np.int64)
+        for j in range(n_features):
+            codes[:, j] = np.searchsorted(self.edges[j], X[:, j], side='right')
+        codes += np.arange(n_features) * n_bins
+        self.counts += np.bincount(codes[~missing], minlength=n_features * n_bins).reshape(n_features, n_bins)
+        self.missing += missing.sum(axis=0)
+        return self
+
+    def merge(self, other):
+        if self.feature_columns != other.feature_columns or not np.array_equal(self.edges, other.edges):
+            raise ValueError("Only sketches with the same features and edges can be merged")
+        self.counts += other.counts
+        self.missing += other.missing
+        return self
+
+    def save(self, file_path):
+        with open(file_path, "wb") as file_obj:
+            np.savez(file_obj, feature_columns=np.array(self.feature_columns, dtype=str), edges=self.edges,
+                     counts=self.counts, missing=self.missing)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as arrays:
+            return cls(arrays['feature_columns'].tolist(), arrays['edges'], arrays['counts'], arrays['missing'])
+
+
+def drift_metrics(reference, current):
+    '''
+    Per feature population stability index and Kolmogorov-Smirnov distance of current against
+    reference, from the sketches alone. KS is taken at the bin edges, so it is a lower bound of
+    the exact statistic within one bin's share of the rows.
+    '''
+    if reference.feature_columns != current.feature_columns or not np.array_equal(reference.edges, current.edges):
+        raise ValueError("The sketches do not share features and edges")
+
+    def proportions(sketch):
+        totals = sketch.counts.sum(axis=1, keepdims=True)
+        return sketch.counts / np.maximum(totals, 1)
+
+    expected, actual = proportions(reference), proportions(current)
+    floored_expected, floored_actual = np.maximum(expected, PSI_EPSILON), np.maximum(actual, PSI_EPSILON)
+    psi = ((floored_actual - floored_expected) * np.log(floored_actual / floored_expected)).sum(axis=1)
+    ks = np.abs(np.cumsum(actual, axis=1) - np.cumsum(expected, axis=1)).max(axis=1)
+
+    return pd.DataFrame({
+        'feature': reference.feature_columns,
+        'psi': psi,
+        'ks': ks,
+        'reference_missing_rate': reference.missing / max(reference.n_rows, 1),
+        'current_missing_rate': current.missing / max(current.n_rows, 1),
+        'rows': current.n_rows
+    })
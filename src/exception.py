@@ -18,6 +18,17 @@ class CustomException(Exception):
     
     def __str__(self):
         return self.error_message
+
+    def __reduce__(self):
+        # Raised in a pipeline worker process, the exception is pickled back with its formatted message
+        return (_restore_custom_exception, (self.error_message,))
+
+
+def _restore_custom_exception(error_message):
+    exception = CustomException.__new__(CustomException)
+    Exception.__init__(exception, error_message)
+    exception.error_message = error_message
+    return exception
     
 
 
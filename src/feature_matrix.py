@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import file_fingerprint, read_csv_cached
+
+# sklearn's trees split on float32 internally, so storing the features as float32 loses nothing
+FEATURE_DTYPE = np.float32
+
+
+def _matrix_paths(matrix_dir, stem):
+    return (
+        os.path.join(matrix_dir, f"{stem}.X.npy"),
+        os.path.join(matrix_dir, f"{stem}.y.npy"),
+        os.path.join(matrix_dir, f"{stem}.schema.json")
+    )
+
+
+def build_feature_matrix(data_path, matrix_dir, target='churn', drop_columns=('Unnamed: 0', 'id')):
+    '''
+    Write the features of the csv at data_path as one contiguous float32 .npy, the target as a
+    second .npy and a json sidecar holding the column order and the fingerprint of the source csv.
+    The matrix is filled one column at a time so no float64 copy of the whole table is built.
+    '''
+    try:
+        stem = os.path.splitext(os.path.basename(data_path))[0]
+        x_path, y_path, schema_path = _matrix_paths(matrix_dir, stem)
+
+        df = read_csv_cached(data_path)
+        columns = [column for column in df.columns if column not in (target,) + tuple(drop_columns)]
+
+        os.makedirs(matrix_dir, exist_ok=True)
+        X = np.lib.format.open_memmap(x_path, mode='w+', dtype=FEATURE_DTYPE, shape=(len(df), len(columns)))
+        for i, column in enumerate(columns):
+            X[:, i] = df[column].to_numpy(dtype=FEATURE_DTYPE)
+        X.flush()
+        del X
+        np.save(y_path, df[target].to_numpy())
+
+        schema = {
+            'source': data_path,
+            'source_fingerprint': file_fingerprint(data_path),
+            'columns': columns,
+            'target': target,
+            'dtype': np.dtype(FEATURE_DTYPE).name,
+            'n_rows': len(df)
+        }
+        with open(schema_path, "w") as file_obj:
+            json.dump(schema, file_obj, indent=2)
+        logging.info(f"Wrote feature matrix {x_path} with shape ({len(df)}, {len(columns)})")
+        return schema
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def load_feature_matrix(data_path, matrix_dir):
+    '''
+    Return (X, y, columns) for the csv at data_path, X being a read-only memory map of the float32
+    feature matrix. The matrix is (re)built first when it is missing or older than the csv.
+    '''
+    try:
+        stem = os.path.splitext(os.path.basename(data_path))[0]
+        x_path, y_path, schema_path = _matrix_paths(matrix_dir, stem)
+
+        schema = None
+        if os.path.exists(schema_path) and os.path.exists(x_path) and os.path.exists(y_path):
+            with open(schema_path) as file_obj:
+                schema = json.load(file_obj)
+            if schema['source_fingerprint'] != file_fingerprint(data_path):
+                schema = None
+        if schema is None:
+            schema = build_feature_matrix(data_path, matrix_dir)
+
+        X = np.load(x_path, mmap_mode='r')
+        y = np.load(y_path)
+        return X, y, schema['columns']
+
+    except Exception as e:
+        raise CustomException(e, sys)
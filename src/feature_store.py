@@ -0,0 +1,193 @@
+import io
+import os
+import sys
+import json
+import hashlib
+
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging
+from src.price_features import PriceFeatureAccumulator
+from src.schema import PRICE_SCHEMA, csv_options
+
+STATE_FILE = "state.npz"
+FEATURES_FILE = "features.parquet"
+META_FILE = "meta.json"
+# Bytes at the start and at the end of the consumed part of the price csv checked on a refresh
+CHECK_BYTES = 1 << 16
+
+
+def _checkpoint(file_obj, length):
+    '''
+    sha256 of length and of the first and last CHECK_BYTES of the first length bytes of file_obj,
+    with the last of those bytes
+    '''
+    digest = hashlib.sha256(str(length).encode())
+    file_obj.seek(0)
+    digest.update(file_obj.read(min(CHECK_BYTES, length)))
+    file_obj.seek(max(0, length - CHECK_BYTES))
+    tail = file_obj.read(length - max(0, length - CHECK_BYTES))
+    digest.update(tail)
+    return digest.hexdigest(), tail[-1:]
+
+
+def _complete_lines(file_obj, size):
+    '''
+    Length of the first size bytes of file_obj up to and including their last newline
+    '''
+    end = size
+    while end > 0:
+        start = max(0, end - CHECK_BYTES)
+        file_obj.seek(start)
+        newline = file_obj.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+class _Prefix(io.RawIOBase):
+    '''
+    The first length bytes of a binary file, so a snapshot of a file still being appended to can be parsed
+    '''
+
+    def __init__(self, file_obj, length):
+        self.file_obj, self.remaining = file_obj, length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file_obj.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+class PriceFeatureStore:
+    '''
+    Price features kept up to date as months are appended to the price table.
+
+    The store holds the running per-company sums of a PriceFeatureAccumulator, the feature table
+    and how many bytes of the price csv they cover, with a checkpoint hash of the first and last
+    CHECK_BYTES of those bytes. refresh() checks the checkpoint, and when it is unchanged reads and
+    parses only the bytes appended since the last refresh, folds them into the state and recomputes
+    the features of the companies they touched, so a refresh is O(new rows) and gives exactly what
+    a full recompute gives. A truncation, a rewrite of the header or of the last consumed rows, or
+    any change of length before the end of the consumed part triggers a full rebuild; a rewrite in
+    the middle of the consumed part that keeps every byte offset is not detected.
+    '''
+
+    def __init__(self, store_dir=os.path.join("data", "features", "price_store"), chunksize=1_000_000):
+        self.store_dir = store_dir
+        self.chunksize = chunksize
+
+    def _path(self, file_name):
+        return os.path.join(self.store_dir, file_name)
+
+    def features(self, ids=None):
+        '''
+        The feature table as of the last refresh, or only its rows of ids, without the price csv
+        '''
+        if not os.path.exists(self._path(FEATURES_FILE)):
+            raise FileNotFoundError(f"No price features in {self.store_dir}, refresh the store first")
+        filters = None if ids is None else [('id', 'in', list(ids))]
+        return pd.read_parquet(self._path(FEATURES_FILE), filters=filters)
+
+    def _load_meta(self, price_data_path):
+        if not os.path.exists(self._path(META_FILE)):
+            return None
+        with open(self._path(META_FILE)) as file_obj:
+            meta = json.load(file_obj)
+        # Stores written before the checkpoint was kept are rebuilt
+        if meta['source'] != os.path.abspath(price_data_path) or 'checkpoint' not in meta:
+            return None
+        if os.path.getsize(price_data_path) < meta['offset']:
+            return None
+        return meta
+
+    def _save(self, accumulator, features, price_data_path, header, offset, checkpoint):
+        os.makedirs(self.store_dir, exist_ok=True)
+        accumulator.save(self._path(STATE_FILE + ".tmp.npz"))
+        os.replace(self._path(STATE_FILE + ".tmp.npz"), self._path(STATE_FILE))
+        features.to_parquet(self._path(FEATURES_FILE + ".tmp"), index=False)
+        os.replace(self._path(FEATURES_FILE + ".tmp"), self._path(FEATURES_FILE))
+        meta = {
+            'source': os.path.abspath(price_data_path),
+            'header': header,
+            'offset': offset,
+            'checkpoint': checkpoint,
+            'n_ids': len(features)
+        }
+        # The metadata is written last, so an interrupted save is seen as a stale store
+        with open(self._path(META_FILE + ".tmp"), "w") as file_obj:
+            json.dump(meta, file_obj, indent=2)
+        os.replace(self._path(META_FILE + ".tmp"), self._path(META_FILE))
+
+    def rebuild(self, price_data_path):
+        '''
+        Build the state and the feature table from the complete lines of the price csv
+        '''
+        try:
+            logging.info(f"Rebuilding the price feature store from {price_data_path}")
+            header = list(pd.read_csv(price_data_path, nrows=0).columns)
+            accumulator = PriceFeatureAccumulator()
+            with open(price_data_path, "rb") as file_obj:
+                # Only the lines present when the size was taken, a writer may still be appending
+                offset = _complete_lines(file_obj, os.fstat(file_obj.fileno()).st_size)
+                file_obj.seek(0)
+                snapshot = io.BufferedReader(_Prefix(file_obj, offset))
+                for chunk in pd.read_csv(snapshot, chunksize=self.chunksize, **csv_options(PRICE_SCHEMA)):
+                    accumulator.update(chunk)
+                checkpoint = _checkpoint(file_obj, offset)[0]
+            features = accumulator.features()
+            self._save(accumulator, features, price_data_path, header, offset, checkpoint)
+            return features
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def refresh(self, price_data_path):
+        '''
+        Bring the store up to date with the price csv and return the feature table, same as
+        build_price_features over the whole file
+        '''
+        try:
+            meta = self._load_meta(price_data_path)
+            if meta is None:
+                return self.rebuild(price_data_path)
+
+            with open(price_data_path, "rb") as file_obj:
+                checkpoint, last_byte = _checkpoint(file_obj, meta['offset'])
+                # A rewrite of rows already folded in needs a rebuild. The appended rows can only be
+                # read on their own when the consumed part ends a line.
+                if checkpoint != meta['checkpoint'] or (meta['offset'] and last_byte != b"\n"):
+                    logging.info(f"{price_data_path} changed before the last refreshed offset")
+                    return self.rebuild(price_data_path)
+                # Only the lines present when the size was taken, a writer may still be appending
+                offset = max(_complete_lines(file_obj, os.fstat(file_obj.fileno()).st_size), meta['offset'])
+                file_obj.seek(meta['offset'])
+                new_rows = file_obj.read(offset - meta['offset'])
+                checkpoint = _checkpoint(file_obj, offset)[0]
+
+            features = pd.read_parquet(self._path(FEATURES_FILE))
+            if not new_rows:
+                logging.info("Price feature store is up to date")
+                return features
+            accumulator = PriceFeatureAccumulator.load(self._path(STATE_FILE))
+            touched = set()
+            for chunk in pd.read_csv(io.BytesIO(new_rows), header=None, names=meta['header'],
+                                     chunksize=self.chunksize, **csv_options(PRICE_SCHEMA)):
+                touched.update(accumulator.update(chunk))
+
+            updated = accumulator.features(sorted(touched))
+            features = pd.concat([features[~features['id'].isin(touched)], updated], ignore_index=True)
+            features = features.sort_values('id', ignore_index=True)
+            self._save(accumulator, features, price_data_path, meta['header'], offset, checkpoint)
+            logging.info(f"Refreshed the price features of {len(touched)} companies from "
+                         f"{offset - meta['offset']} new bytes")
+            return features
+
+        except Exception as e:
+            raise CustomException(e, sys)
@@ -0,0 +1,127 @@
+import sys
+
+import numpy as np
+
+from src.exception import CustomException
+
+# Upper bound on (trees x rows) node indices held at once while walking the forest
+_BLOCK_SIZE = 1 << 22
+
+
+class FlatForest:
+    '''
+    A fitted RandomForestClassifier flattened into contiguous node arrays.
+
+    All trees share one set of arrays (feature, threshold, left/right child, missing-value direction
+    and the leaf class probabilities), with each tree's nodes stored after the previous tree's.
+    Leaves point to themselves, so a batch is evaluated for every tree at once, one tree level per
+    step, and predict_proba gives exactly what the sklearn forest gives when it sums the trees in order
+    (n_jobs=1; with several threads sklearn adds the trees in whatever order they finish).
+    This avoids the per-tree Python overhead that dominates sklearn's small-batch predictions.
+    '''
+
+    ARRAYS = ('classes', 'roots', 'feature', 'threshold', 'left', 'right', 'missing_left', 'leaf_proba')
+
+    def __init__(self, classes, roots, feature, threshold, left, right, missing_left, leaf_proba):
+        self.classes_ = classes
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.leaf_proba = leaf_proba
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        '''
+        Flatten the estimators_ of a fitted single-output RandomForestClassifier
+        '''
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees])
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        index_dtype = np.int32 if sizes.sum() < np.iinfo(np.int32).max else np.int64
+
+        feature, threshold, left, right, missing_left, leaf_proba = [], [], [], [], [], []
+        for root, tree in zip(roots, trees):
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            left.append(np.where(is_leaf, nodes, tree.children_left) + root)
+            right.append(np.where(is_leaf, nodes, tree.children_right) + root)
+            missing_left.append(tree.missing_go_to_left.astype(bool))
+            # Same normalisation as DecisionTreeClassifier.predict_proba
+            proba = tree.value[:, 0, :model.n_classes_].copy()
+            normalizer = proba.sum(axis=1)
+            normalizer[normalizer == 0.0] = 1.0
+            proba /= normalizer[:, np.newaxis]
+            leaf_proba.append(proba)
+
+        return cls(
+            classes=np.asarray(model.classes_),
+            roots=roots.astype(index_dtype),
+            feature=np.concatenate(feature).astype(index_dtype),
+            threshold=np.concatenate(threshold),
+            left=np.concatenate(left).astype(index_dtype),
+            right=np.concatenate(right).astype(index_dtype),
+            missing_left=np.concatenate(missing_left),
+            leaf_proba=np.concatenate(leaf_proba)
+        )
+
+    def to_arrays(self):
+        return {name: getattr(self, 'classes_' if name == 'classes' else name) for name in self.ARRAYS}
+
+    def save(self, file_path):
+        try:
+            np.savez(file_path, **self.to_arrays())
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    @classmethod
+    def load(cls, file_path):
+        try:
+            with np.load(file_path) as arrays:
+                return cls(**{name: arrays[name] for name in cls.ARRAYS})
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def apply(self, X):
+        '''
+        Global leaf index reached in every tree, shape (n_estimators, n_rows)
+        '''
+        n_rows, n_features = X.shape
+        X = np.ascontiguousarray(X).ravel()
+        nodes = np.repeat(self.roots, n_rows)
+        offsets = np.tile(np.arange(n_rows) * n_features, self.n_estimators)
+        # Only the (tree, row) pairs that have not reached a leaf are walked one more level
+        active = np.arange(nodes.size)
+        while active.size:
+            node = nodes[active]
+            x = X[offsets[active] + self.feature[node]]
+            go_left = (x <= self.threshold[node]) | (np.isnan(x) & self.missing_left[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+            nodes[active] = node
+            active = active[self.left[node] != node]
+        return nodes.reshape(self.n_estimators, n_rows)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        proba = np.zeros((len(X), len(self.classes_)))
+        block = max(1, _BLOCK_SIZE // max(1, self.n_estimators))
+        for start in range(0, len(X), block):
+            leaves = self.apply(X[start:start + block])
+            out = proba[start:start + block]
+            for tree_leaves in leaves:
+                out += self.leaf_proba[tree_leaves]
+        proba /= self.n_estimators
+        return proba
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
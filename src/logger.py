@@ -1,15 +1,223 @@
 import logging
 import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
 from datetime import datetime
 
 LOG_FILE=f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
 logs_path=os.path.join(os.getcwd(),"logs",LOG_FILE)
-os.makedirs(logs_path,exist_ok=True)
 
 LOG_FILE_PATH=os.path.join(logs_path,LOG_FILE)
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format="[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+
+class _DeferredFileHandler(logging.FileHandler):
+    # Opening the file (and creating the log directory) waits for the first record
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+def setup_logging():
+    '''
+    Attach the log file handler to the root logger, once. Importing this module only records the
+    file name; nothing is created on disk until something is logged.
+    '''
+    root = logging.getLogger()
+    if any(isinstance(handler, _DeferredFileHandler) for handler in root.handlers):
+        return
+    handler = _DeferredFileHandler(LOG_FILE_PATH, delay=True)
+    handler.setFormatter(logging.Formatter("[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+setup_logging()
+
+
+# Step profiling, off unless CHURN_PROFILE is set to something other than "" or "0".
+# Records go to CHURN_PROFILE_FILE (default: next to the log file) as one json object per line,
+# and the step named by CHURN_PROFILE_STEP also gets a cProfile dump and a tracemalloc report.
+PROFILE_ENABLED = os.environ.get("CHURN_PROFILE", "0") not in ("", "0")
+PROFILE_FILE_PATH = os.environ.get("CHURN_PROFILE_FILE") or os.path.join(
+    logs_path, LOG_FILE.replace(".log", ".profile.jsonl"))
+PROFILE_STEP = os.environ.get("CHURN_PROFILE_STEP")
+
+_profile_lock = threading.Lock()
+_profile_stack = threading.local()
+
+
+def _read_status_kb(field):
+    # Linux only: VmRSS is the current resident size, VmHWM the process peak
+    try:
+        with open("/proc/self/status") as file_obj:
+            for line in file_obj:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _lifetime_peak_rss_kb():
+    # Process lifetime peak in kilobytes (ru_maxrss is in bytes on macOS), None on Windows
+    # where there is no resource module
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+
+
+# The peak RSS of the open steps is sampled every PEAK_SAMPLE_S seconds by one daemon thread per
+# process, running while any step is open. The process peak (VmHWM, and ru_maxrss) is never reset,
+# other code relies on it.
+PEAK_SAMPLE_S = 0.01
+_open_steps = {}
+_sampler = None  # (thread, stop event) of the running sampler
+
+
+def _sample_rss(stop):
+    while not stop.wait(PEAK_SAMPLE_S):
+        rss = _read_status_kb("VmRSS:") or 0
+        with _profile_lock:
+            for frame in _open_steps.values():
+                frame["peak_kb"] = max(frame["peak_kb"], rss)
+
+
+def _open_step(frame):
+    global _sampler
+    with _profile_lock:
+        _open_steps[id(frame)] = frame
+        if _sampler is None:
+            stop = threading.Event()
+            thread = threading.Thread(target=_sample_rss, args=(stop,), name="profile_step-rss", daemon=True)
+            thread.start()
+            _sampler = (thread, stop)
+
+
+def _close_step(frame):
+    # The sampler is stopped and joined once the outermost open step of the process closes
+    global _sampler
+    with _profile_lock:
+        _open_steps.pop(id(frame), None)
+        if _open_steps or _sampler is None:
+            return
+        (thread, stop), _sampler = _sampler, None
+    stop.set()
+    thread.join()
+
+
+def _forget_parent_steps():
+    # Threads do not survive a fork, a forked worker starts its own sampler for its own steps
+    global _sampler
+    _open_steps.clear()
+    _sampler = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_parent_steps)
+
+
+class profile_step(contextlib.ContextDecorator):
+    '''
+    Record wall time, CPU time, peak RSS and rows in/out of a named step as one json line.
+
+        with profile_step("read_csv", rows_in=n) as step:
+            df = ...
+            step.rows_out = len(df)
+
+    or as a decorator, @profile_step("fit_forest"). Steps nest; the peak RSS of a step covers
+    the steps inside it. When profiling is off entering and leaving a step does nothing.
+
+    The peak is the process peak when it was reached inside the step (peak_rss_scope "step"),
+    otherwise the largest RSS sampled while the step was open ("sampled", which can miss a spike
+    shorter than PEAK_SAMPLE_S), or the process lifetime peak without /proc ("process"). RSS is per
+    process, so memory held by other threads counts towards every step open at the time.
+    '''
+
+    def __init__(self, name, rows_in=None, rows_out=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+
+    def __enter__(self):
+        if not PROFILE_ENABLED:
+            return self
+        stack = getattr(_profile_stack, "steps", None)
+        if stack is None:
+            stack = _profile_stack.steps = []
+        frame = {
+            "path": "/".join([step["name"] for step in stack] + [self.name]),
+            "name": self.name,
+            "hwm_kb": _read_status_kb("VmHWM:"),
+            "peak_kb": _read_status_kb("VmRSS:") or 0,
+            "start": time.time(),
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "profiler": None
+        }
+        if self.name == PROFILE_STEP:
+            import cProfile
+            frame["profiler"] = cProfile.Profile()
+            tracemalloc.start()
+            frame["profiler"].enable()
+        if frame["hwm_kb"] is not None:
+            _open_step(frame)
+        stack.append(frame)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not PROFILE_ENABLED:
+            return False
+        frame = _profile_stack.steps.pop()
+        wall = time.perf_counter() - frame["wall"]
+        cpu = time.process_time() - frame["cpu"]
+        if frame["hwm_kb"] is not None:
+            _close_step(frame)
+        hwm_kb = _read_status_kb("VmHWM:")
+        if frame["hwm_kb"] is None or hwm_kb is None:
+            peak_kb, scope = _lifetime_peak_rss_kb(), "process"
+        elif hwm_kb > frame["hwm_kb"]:
+            peak_kb, scope = hwm_kb, "step"
+        else:
+            peak_kb, scope = max(frame["peak_kb"], _read_status_kb("VmRSS:") or 0), "sampled"
+        if _profile_stack.steps and peak_kb is not None:
+            with _profile_lock:
+                _profile_stack.steps[-1]["peak_kb"] = max(_profile_stack.steps[-1]["peak_kb"], peak_kb)
+
+        record = {
+            "step": frame["path"],
+            "start": datetime.fromtimestamp(frame["start"]).isoformat(timespec="milliseconds"),
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "peak_rss_mb": None if peak_kb is None else round(peak_kb / 1024, 1),
+            "peak_rss_scope": scope,
+            "rss_mb": round((_read_status_kb("VmRSS:") or 0) / 1024, 1),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "pid": os.getpid(),
+            "status": "error" if exc_type else "ok"
+        }
+        os.makedirs(os.path.dirname(PROFILE_FILE_PATH) or ".", exist_ok=True)
+        if frame["profiler"] is not None:
+            frame["profiler"].disable()
+            stamp = datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
+            dump_path = os.path.join(os.path.dirname(PROFILE_FILE_PATH), f"{self.name}-{os.getpid()}-{stamp}")
+            frame["profiler"].dump_stats(dump_path + ".prof")
+            snapshot = tracemalloc.take_snapshot()
+            record["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+            tracemalloc.stop()
+            with open(dump_path + ".tracemalloc.txt", "w") as file_obj:
+                for stat in snapshot.statistics("lineno")[:25]:
+                    file_obj.write(f"{stat}\n")
+            record["profile_dump"] = dump_path + ".prof"
+
+        line = json.dumps(record) + "\n"
+        with _profile_lock:
+            with open(PROFILE_FILE_PATH, "a") as file_obj:
+                file_obj.write(line)
+        return False
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import shutil
+import platform
+from datetime import datetime
+from importlib import metadata
+
+import numpy as np
+
+from src.exception import CustomException
+from src.logger import logging
+from src.flat_forest import FlatForest
+
+MANIFEST_FILE = "manifest.json"
+LATEST_FILE = "LATEST"
+LIBRARIES = ['numpy', 'pandas', 'scikit-learn', 'joblib', 'xgboost', 'catboost']
+
+
+def library_versions():
+    versions = {'python': platform.python_version()}
+    for library in LIBRARIES:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            versions[library] = None
+    return versions
+
+
+class ModelStore:
+    '''
+    Versioned model artifacts under root/<name>/v0001, v0002, ...
+
+    Each version holds the estimator as a joblib file (optionally compressed), for random forests
+    the flat forest arrays as one .npy per array so they can be memory-mapped, and a manifest with the
+    feature column order, the training data fingerprint, the training metrics and the library
+    versions, plus any extra artifacts saved with it (e.g. the drift reference sketches).
+    root/<name>/LATEST names the current version; only the newest keep_versions versions are kept.
+    '''
+
+    def __init__(self, root=os.path.join("data", "models"), keep_versions=5):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    def versions(self, name):
+        model_dir = os.path.join(self.root, name)
+        if not os.path.isdir(model_dir):
+            return []
+        return sorted(entry for entry in os.listdir(model_dir) if entry.startswith('v') and entry[1:].isdigit())
+
+    def latest(self, name):
+        latest_path = os.path.join(self.root, name, LATEST_FILE)
+        if not os.path.exists(latest_path):
+            raise FileNotFoundError(f"No saved versions of model {name} in {self.root}")
+        with open(latest_path) as file_obj:
+            return file_obj.read().strip()
+
+    def _version_dir(self, name, version=None):
+        return os.path.join(self.root, name, version or self.latest(name))
+
+    def save(self, name, model, feature_columns, training_data_hash, metrics, compress=0, artifacts=None):
+        '''
+        Store the fitted model, and the flat export of a random forest, as a new version and return
+        the version name. artifacts maps extra file names to functions writing them to a given path.
+        '''
+        try:
+            existing = self.versions(name)
+            version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+            version_dir = self._version_dir(name, version)
+            tmp_dir = version_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            import joblib
+            joblib.dump(model, os.path.join(tmp_dir, "model.joblib"), compress=compress)
+            # Boosted models (xgboost, catboost) have no flat export and are served through load_model
+            flat = hasattr(model, 'estimators_') and all(hasattr(tree, 'tree_') for tree in model.estimators_)
+            if flat:
+                os.makedirs(os.path.join(tmp_dir, "flat"))
+                for array_name, array in FlatForest.from_sklearn(model).to_arrays().items():
+                    np.save(os.path.join(tmp_dir, "flat", f"{array_name}.npy"), array)
+            for file_name, write in (artifacts or {}).items():
+                write(os.path.join(tmp_dir, file_name))
+
+            manifest = {
+                'name': name,
+                'version': version,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'feature_columns': list(feature_columns),
+                'training_data_hash': training_data_hash,
+                'metrics': metrics,
+                'model_class': f"{type(model).__module__}.{type(model).__name__}",
+                'n_estimators': len(model.estimators_) if flat else (model.get_params().get('n_estimators')
+                                                                     or model.get_params().get('iterations')),
+                'flat': flat,
+                'compress': compress,
+                'artifacts': sorted(artifacts or {}),
+                'library_versions': library_versions()
+            }
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as file_obj:
+                json.dump(manifest, file_obj, indent=2, default=float)
+
+            # The version only becomes visible once it is complete
+            os.replace(tmp_dir, version_dir)
+            latest_tmp = os.path.join(self.root, name, LATEST_FILE + ".tmp")
+            with open(latest_tmp, "w") as file_obj:
+                file_obj.write(version)
+            os.replace(latest_tmp, os.path.join(self.root, name, LATEST_FILE))
+            logging.info(f"Saved model {name} {version} to {version_dir}")
+
+            self.prune(name)
+            return version
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def prune(self, name):
+        '''
+        Remove all but the newest keep_versions versions, never the current one
+        '''
+        latest = self.latest(name)
+        for version in self.versions(name)[:-self.keep_versions or None]:
+            if version != latest:
+                shutil.rmtree(self._version_dir(name, version))
+                logging.info(f"Pruned model {name} {version}")
+
+    def manifest(self, name, version=None):
+        try:
+            with open(os.path.join(self._version_dir(name, version), MANIFEST_FILE)) as file_obj:
+                return json.load(file_obj)
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def artifact_path(self, name, file_name, version=None):
+        return os.path.join(self._version_dir(name, version), file_name)
+
+    def load_flat(self, name, version=None, mmap_mode='r'):
+        '''
+        FlatForest whose arrays are memory-mapped, pages are only read when a prediction touches them
+        '''
+        try:
+            flat_dir = os.path.join(self._version_dir(name, version), "flat")
+            return FlatForest(**{
+                array_name: np.load(os.path.join(flat_dir, f"{array_name}.npy"), mmap_mode=mmap_mode)
+                for array_name in FlatForest.ARRAYS
+            })
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def load_model(self, name, version=None, mmap_mode='r'):
+        '''
+        The sklearn estimator, memory-mapping its large arrays when the artifact is uncompressed
+        '''
+        try:
+            version_dir = self._version_dir(name, version)
+            compressed = self.manifest(name, version)['compress']
+            import joblib
+            return joblib.load(os.path.join(version_dir, "model.joblib"), mmap_mode=None if compressed else mmap_mode)
+
+        except Exception as e:
+            raise CustomException(e, sys)
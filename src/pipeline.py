@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from dataclasses import dataclass, field
+from typing import Callable, List
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import file_fingerprint
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_data_validation():
+    from src.components.data_validation import DataValidation
+    DataValidation().validate()
+
+
+def run_data_analysis():
+    import matplotlib.pyplot as plt
+    from src.components.data_analysis import DataAnalysis
+    plt.switch_backend('Agg')
+    obj = DataAnalysis()
+    obj.analysis_config.headless = True
+    obj.initiate_data_analysis()
+
+
+def run_clean_data():
+    from src.components.data_analysis import DataAnalysis
+    DataAnalysis().write_clean_data()
+
+
+def run_data_transformation():
+    import matplotlib.pyplot as plt
+    from src.components.data_transformation import DataTransformation
+    plt.switch_backend('Agg')
+    obj = DataTransformation()
+    obj.data_transformation_config.headless = True
+    obj.data_transformation_config.incremental_prices = True
+    obj.data_transformer()
+
+
+def run_prediction_data():
+    from src.components.data_transformation import DataTransformation
+    DataTransformation().build_prediction_data()
+
+
+def run_model_trainer():
+    import matplotlib.pyplot as plt
+    from src.components.model_trainer import ModelTrainer
+    plt.switch_backend('Agg')
+    ModelTrainer().model_trainer()
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable
+    inputs: List[str]
+    outputs: List[str]
+    # Source files, relative to src/, whose contents are part of the stage fingerprint
+    code: List[str] = field(default_factory=list)
+
+
+def default_stages():
+    from src.components.data_validation import DataValidationConfig
+    from src.components.data_analysis import DataAnalysisConfig
+    from src.components.data_transformation import DataTransformationConfig
+    from src.components.model_trainer import ModelTrainerConfig
+
+    validation = DataValidationConfig()
+    analysis = DataAnalysisConfig()
+    transformation = DataTransformationConfig()
+    trainer = ModelTrainerConfig()
+    shared = ['utils.py', 'exception.py', 'logger.py', 'schema.py']
+    eda_images = ["Churning status.png", "Sales channel.png", "consumption.png", "box_plot.png",
+                  "Contract type (with gas.png"]
+    # The stages reading the raw tables take the validation report as an input, so they only
+    # start once both tables passed the schema checks
+    return [
+        Stage('data_validation', run_data_validation,
+              inputs=[validation.client_data_path, validation.price_data_path],
+              outputs=[validation.report_path],
+              code=['components/data_validation.py'] + shared),
+        Stage('data_analysis', run_data_analysis,
+              inputs=[analysis.client_data_path, analysis.price_data_path, validation.report_path],
+              outputs=[os.path.join('images', image) for image in eda_images] + [analysis.report_path],
+              code=['components/data_analysis.py'] + shared),
+        Stage('clean_data', run_clean_data,
+              inputs=[analysis.client_data_path, validation.report_path],
+              outputs=[analysis.clean_data_path],
+              code=['components/data_analysis.py'] + shared),
+        Stage('data_transformation', run_data_transformation,
+              inputs=[transformation.data_path, transformation.price_data_path, validation.report_path],
+              outputs=[transformation.transformed_data_path, os.path.join('images', "skew_transformed.png")],
+              code=['components/data_transformation.py', 'transform_kernel.py', 'price_features.py',
+                    'feature_store.py'] + shared),
+        Stage('prediction_data', run_prediction_data,
+              inputs=[transformation.transformed_data_path],
+              outputs=[transformation.prediction_data_path],
+              code=['components/data_transformation.py', 'transform_kernel.py'] + shared),
+        Stage('model_trainer', run_model_trainer,
+              inputs=[trainer.train_data_path],
+              outputs=[os.path.join(trainer.model_store_dir, name, "LATEST")
+                       for name in (trainer.model_name, trainer.serving_model_name)],
+              code=['components/model_trainer.py', 'feature_matrix.py', 'model_store.py', 'flat_forest.py',
+                    'drift.py'] + shared)
+    ]
+
+
+class Pipeline:
+    '''
+    Runs the stages in dependency order, a stage depending on every stage that produces one of its
+    inputs. A stage is skipped when the fingerprint of its inputs and code matches the last
+    successful run and its outputs are untouched since then. Stages whose dependencies are done
+    run concurrently in separate processes.
+    '''
+
+    def __init__(self, stages=None, state_path=os.path.join('data', "pipeline_state.json"), max_workers=None):
+        self.stages = stages if stages is not None else default_stages()
+        self.state_path = state_path
+        self.max_workers = max_workers
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as file_obj:
+            return json.load(file_obj)
+
+    def _save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as file_obj:
+            json.dump(state, file_obj, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def fingerprint(stage):
+        digest = hashlib.sha256(stage.name.encode())
+        for path in stage.inputs:
+            digest.update(path.encode())
+            digest.update(file_fingerprint(path).encode())
+        for path in stage.code:
+            digest.update(path.encode())
+            digest.update(file_fingerprint(os.path.join(SRC_DIR, path)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _output_stamps(stage):
+        # Outputs can be large, so they are checked by size and modification time only
+        stamps = {}
+        for path in stage.outputs:
+            if not os.path.exists(path):
+                return None
+            stat = os.stat(path)
+            stamps[path] = [stat.st_size, stat.st_mtime_ns]
+        return stamps
+
+    def _dependencies(self, stage):
+        return {other.name for other in self.stages
+                if other is not stage and set(other.outputs) & set(stage.inputs)}
+
+    def run(self, force=False):
+        '''
+        Run every out-of-date stage, returning {stage name: "ran" or "skipped"}
+        '''
+        try:
+            state = self._load_state()
+            pending = {stage.name: stage for stage in self.stages}
+            dependencies = {stage.name: self._dependencies(stage) for stage in self.stages}
+            results, running = {}, {}
+
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                while pending or running:
+                    ready = [name for name in pending if not dependencies[name] - set(results)]
+                    if not ready and not running:
+                        # Nothing left can finish, so the pending stages depend on each other
+                        raise ValueError(f"Stages {sorted(pending)} can never run, their inputs form a cycle")
+                    for name in ready:
+                        stage = pending.pop(name)
+                        fingerprint = self.fingerprint(stage)
+                        previous = state.get(name, {})
+                        if (not force and previous.get('fingerprint') == fingerprint
+                                and previous.get('outputs') == self._output_stamps(stage)):
+                            results[name] = "skipped"
+                            print(f"{name}: up to date, skipped")
+                            continue
+                        print(f"{name}: running")
+                        logging.info(f"Pipeline stage {name} started")
+                        running[executor.submit(stage.run)] = (stage, fingerprint, time.perf_counter())
+
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stage, fingerprint, started = running.pop(future)
+                        future.result()
+                        state[stage.name] = {'fingerprint': fingerprint, 'outputs': self._output_stamps(stage)}
+                        self._save_state(state)
+                        results[stage.name] = "ran"
+                        print(f"{stage.name}: done in {time.perf_counter() - started:.1f}s")
+                        logging.info(f"Pipeline stage {stage.name} finished")
+
+            return results
+
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the churn pipeline, skipping up-to-date stages")
+    parser.add_argument('--force', action='store_true', help="rerun every stage")
+    parser.add_argument('--workers', type=int, default=None, help="stages run at the same time")
+    args = parser.parse_args()
+    Pipeline(max_workers=args.workers).run(force=args.force)
@@ -0,0 +1,367 @@
+import numpy as np
+import pandas as pd
+
+from src.logger import profile_step
+from src.schema import PRICE_SCHEMA, DATE_FORMAT, csv_options
+
+PRICE_COLUMNS = [
+    'price_off_peak_var',
+    'price_peak_var',
+    'price_mid_peak_var',
+    'price_off_peak_fix',
+    'price_peak_fix',
+    'price_mid_peak_fix'
+]
+
+# (name, minuend, subtrahend) for the differences between consecutive periods
+PERIOD_DIFFS = [
+    ('off_peak_peak_var', 'price_off_peak_var', 'price_peak_var'),
+    ('peak_mid_peak_var', 'price_peak_var', 'price_mid_peak_var'),
+    ('off_peak_mid_peak_var', 'price_off_peak_var', 'price_mid_peak_var'),
+    ('off_peak_peak_fix', 'price_off_peak_fix', 'price_peak_fix'),
+    ('peak_mid_peak_fix', 'price_peak_fix', 'price_mid_peak_fix'),
+    ('off_peak_mid_peak_fix', 'price_off_peak_fix', 'price_mid_peak_fix')
+]
+
+DEC_JAN_COLUMNS = ['offpeak_diff_dec_january_energy', 'offpeak_diff_dec_january_power']
+MEAN_DIFF_COLUMNS = [name + '_mean_diff' for name, _, _ in PERIOD_DIFFS]
+MAX_DIFF_COLUMNS = [name + '_max_monthly_diff' for name, _, _ in PERIOD_DIFFS]
+PRICE_FEATURE_COLUMNS = DEC_JAN_COLUMNS + MEAN_DIFF_COLUMNS + MAX_DIFF_COLUMNS
+
+_OFF_PEAK_VAR = PRICE_COLUMNS.index('price_off_peak_var')
+_OFF_PEAK_FIX = PRICE_COLUMNS.index('price_off_peak_fix')
+_DIFF_LEFT = [PRICE_COLUMNS.index(left) for _, left, _ in PERIOD_DIFFS]
+_DIFF_RIGHT = [PRICE_COLUMNS.index(right) for _, _, right in PERIOD_DIFFS]
+# Low bits of an accumulator month key holding the date slot
+_DATE_BITS = 24
+
+
+def _levels(lengths):
+    """
+    Yield (level, groups) where groups are the indices of the groups holding at least level+1 rows
+    """
+    order = np.argsort(-lengths, kind='stable')
+    sorted_lengths = lengths[order]
+    for level in range(int(sorted_lengths[0]) if len(lengths) else 0):
+        yield level, order[:np.searchsorted(-sorted_lengths, -level, side='left')]
+
+
+def _kahan_add(sumx, compensation, nobs, target, val):
+    """
+    Add one row per target group to the running compensated sums, skipping NaNs like pandas does
+    """
+    valid = ~np.isnan(val)
+    s = sumx[target]
+    c = compensation[target]
+    y = val - c
+    t = s + y
+    new_c = t - s - y
+    new_c[np.isnan(new_c)] = 0
+    sumx[target] = np.where(valid, t, s)
+    compensation[target] = np.where(valid, new_c, c)
+    nobs[target] += valid
+
+
+def _finish_mean(sumx, nobs):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sumx / nobs
+    means[nobs == 0] = np.nan
+    return means
+
+
+def group_mean(values, labels, n_groups):
+    """
+    Per-group NaN-skipping mean of the rows of values, labels in [0, n_groups). Groups of one row
+    are copied and the others go through one pandas groupby mean, which sums each group in row
+    order with compensated summation, so the results match pandas exactly.
+    """
+    means = np.full((n_groups, values.shape[1]), np.nan)
+    single = np.bincount(labels, minlength=n_groups)[labels] == 1
+    means[labels[single]] = values[single]
+    if not single.all():
+        grouped = pd.DataFrame(values[~single]).groupby(labels[~single]).mean()
+        means[grouped.index.to_numpy()] = grouped.to_numpy()
+    return means
+
+
+def group_max(values, starts):
+    """
+    Per-group NaN-skipping max of the consecutive row blocks beginning at starts, all-NaN groups give NaN
+    """
+    if not len(starts):
+        return np.empty((0, values.shape[1]))
+    return np.fmax.reduceat(values, starts, axis=0)
+
+
+def group_first_last(values, starts):
+    """
+    Per-group first and last non-NaN value of the consecutive row blocks beginning at starts
+    """
+    if not len(starts):
+        return np.empty((0, values.shape[1])), np.empty((0, values.shape[1]))
+    rows = np.arange(len(values))[:, np.newaxis]
+    valid = ~np.isnan(values)
+    first = np.minimum.reduceat(np.where(valid, rows, len(values)), starts, axis=0)
+    last = np.maximum.reduceat(np.where(valid, rows, -1), starts, axis=0)
+    # Blocks without a value point at len(values) or -1, both the appended NaN row
+    padded = np.vstack([values, np.full((1, values.shape[1]), np.nan)])
+    return np.take_along_axis(padded, first, axis=0), np.take_along_axis(padded, last, axis=0)
+
+
+def _block_bounds(boundary):
+    """
+    Start offsets and lengths of the blocks delimited by a boolean 'row starts a new block' mask
+    """
+    starts = np.flatnonzero(boundary)
+    lengths = np.diff(np.append(starts, len(boundary)))
+    return starts, lengths
+
+
+def build_price_features(price_df):
+    '''
+    Compute every price feature for each company in one pass over the monthly price table.
+
+    The ids and date strings are factorized once, the means are one grouped pass per grouping
+    and the monthly aggregates are ufunc reductions over the sorted (id, month) blocks. Returns one row per id holding at least one
+    dated price row, with the columns 'id' + PRICE_FEATURE_COLUMNS.
+    '''
+    price_df = price_df[price_df['id'].notna()]
+    codes, uniques = pd.factorize(price_df['id'], sort=True)
+    values = price_df[PRICE_COLUMNS].to_numpy(dtype=np.float64)
+    # Each distinct date string is parsed once, the table holds only a few months
+    date_codes, date_strings = pd.factorize(price_df['price_date'])
+    date_ranks = np.unique(pd.to_datetime(pd.Series(date_strings, dtype=object), format=DATE_FORMAT)
+                           .to_numpy().view(np.int64), return_inverse=True)[1]
+
+    # Average price per period by company, rows kept in file order inside each company
+    with profile_step("group_mean_by_id", rows_in=len(codes), rows_out=len(uniques)):
+        mean_prices = group_mean(values, codes, len(uniques))
+
+    # Average price per company and month, the sorted keys put the months in chronological order
+    # inside each company
+    dated_rows = np.flatnonzero(date_codes >= 0)
+    with profile_step("group_mean_by_id_month", rows_in=len(dated_rows)) as step:
+        keys = codes[dated_rows].astype(np.int64) * len(date_strings) + date_ranks[date_codes[dated_rows]]
+        month_keys, month_labels = np.unique(keys, return_inverse=True)
+        monthly = group_mean(values[dated_rows], month_labels, len(month_keys))
+        month_codes = month_keys // max(len(date_strings), 1)
+        step.rows_out = len(month_keys)
+
+    with profile_step("price_feature_assembly", rows_in=len(monthly)) as step:
+        features = _assemble_features(uniques, mean_prices, month_codes, monthly)
+        step.rows_out = len(features)
+    return features
+
+
+def _assemble_features(uniques, mean_prices, month_codes, monthly):
+    """
+    Build the feature frame from the per-company mean prices (indexed by id code) and the monthly
+    mean prices sorted by id code then month
+    """
+    boundary = np.ones(len(month_codes), dtype=bool)
+    boundary[1:] = month_codes[1:] != month_codes[:-1]
+    id_starts = np.flatnonzero(boundary)
+    feature_ids = month_codes[id_starts]
+
+    jan_prices, dec_prices = group_first_last(monthly[:, [_OFF_PEAK_VAR, _OFF_PEAK_FIX]], id_starts)
+    max_monthly_diff = group_max(monthly[:, _DIFF_LEFT] - monthly[:, _DIFF_RIGHT], id_starts)
+
+    mean_prices = mean_prices[feature_ids]
+    mean_diff = mean_prices[:, _DIFF_LEFT] - mean_prices[:, _DIFF_RIGHT]
+
+    features = pd.DataFrame(
+        np.hstack([dec_prices - jan_prices, mean_diff, max_monthly_diff]),
+        columns=PRICE_FEATURE_COLUMNS
+    )
+    features.insert(0, 'id', uniques[feature_ids])
+    return features
+
+
+def _grow(array, size):
+    """
+    Return array with room for at least size rows, doubling the capacity when it runs out
+    """
+    if size <= len(array):
+        return array
+    grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class _SlotIndex:
+    """
+    Consecutive slots for distinct keys, looked up a whole array at a time through pandas' hash
+    index. New keys go to a small index that is merged into the large one once it holds an eighth
+    as many keys, so the large hash table is rebuilt a logarithmic number of times, not per chunk.
+    """
+
+    def __init__(self, keys=()):
+        self._large = pd.Index(keys)
+        self._small = self._large[:0]
+
+    def __len__(self):
+        return len(self._large) + len(self._small)
+
+    def keys(self):
+        if self._large.empty or self._small.empty:
+            return self._small if self._large.empty else self._large
+        return self._large.append(self._small)
+
+    def slots(self, keys, add=True):
+        """
+        Slot of each of the distinct keys, unseen keys get the next slots in order (or -1 without add)
+        """
+        slots = self._large.get_indexer(keys)
+        missing = slots < 0
+        if missing.any() and len(self._small):
+            found = self._small.get_indexer(keys[missing])
+            slots[missing] = np.where(found >= 0, found + len(self._large), -1)
+            missing = slots < 0
+        if add and missing.any():
+            slots[missing] = len(self) + np.arange(np.count_nonzero(missing))
+            self._small = keys[missing] if self._small.empty else self._small.append(keys[missing])
+            if len(self._small) * 8 > len(self._large):
+                self._large, self._small = self.keys(), self._small[:0]
+        return slots
+
+
+class PriceFeatureAccumulator:
+    '''
+    Running per-company state for the price features, fed one chunk of the price table at a time.
+
+    Keeps the compensated sums behind the per-company means and the per-company, per-month means,
+    so memory is bounded by the number of distinct companies (times months) and not by the number
+    of rows. features() returns exactly what build_price_features returns for the whole table.
+    '''
+
+    def __init__(self):
+        n_cols = len(PRICE_COLUMNS)
+        # State slots of the company ids, the price dates, and the month keys holding the id slot in
+        # the high bits and the date slot in the low _DATE_BITS bits
+        self._index = {'id': _SlotIndex(), 'date': _SlotIndex(), 'month': _SlotIndex()}
+        self._month_ids = np.zeros(0, dtype=np.int64)
+        self._month_dates = np.zeros(0, dtype=np.int64)
+        self._sums = {
+            'id': [np.zeros((0, n_cols)), np.zeros((0, n_cols)), np.zeros((0, n_cols), dtype=np.int64)],
+            'month': [np.zeros((0, n_cols)), np.zeros((0, n_cols)), np.zeros((0, n_cols), dtype=np.int64)]
+        }
+
+    def _accumulate(self, name, count, values, boundary, targets):
+        """
+        Fold the rows of values, sorted into blocks by boundary, into the state slots given per block
+        """
+        sums = self._sums[name]
+        sums[:] = [_grow(array, count) for array in sums]
+        starts, lengths = _block_bounds(boundary)
+        for level, groups in _levels(lengths):
+            _kahan_add(*sums, targets[groups], values[starts[groups] + level])
+
+    def update(self, chunk):
+        """
+        Fold a chunk of price rows into the running state, chunks must come in file order.
+        Returns the ids of the companies the chunk touched.
+        """
+        chunk = chunk[chunk['id'].notna()]
+        if chunk.empty:
+            return []
+        codes, uniques = pd.factorize(chunk['id'])
+        slots = self._index['id'].slots(pd.Index(uniques))[codes]
+        values = chunk[PRICE_COLUMNS].to_numpy(dtype=np.float64)
+        # Each distinct date string is parsed once
+        date_codes, date_strings = pd.factorize(chunk['price_date'])
+        date_values = pd.to_datetime(pd.Series(date_strings, dtype=object), format=DATE_FORMAT).to_numpy()
+        dated = date_codes >= 0
+        date_keys = np.zeros(len(date_codes), dtype=np.int64)
+        date_keys[dated] = date_values.view(np.int64)[date_codes[dated]]
+
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        boundary = np.ones(len(order), dtype=bool)
+        boundary[1:] = sorted_slots[1:] != sorted_slots[:-1]
+        self._accumulate('id', len(self._index['id']), values[order], boundary, sorted_slots[boundary])
+
+        dated_rows = np.flatnonzero(dated)
+        order = dated_rows[np.lexsort((date_keys[dated_rows], slots[dated_rows]))]
+        sorted_slots = slots[order]
+        sorted_dates = date_keys[order]
+        boundary = np.ones(len(order), dtype=bool)
+        boundary[1:] = (sorted_slots[1:] != sorted_slots[:-1]) | (sorted_dates[1:] != sorted_dates[:-1])
+        month_ids, month_dates = sorted_slots[boundary], sorted_dates[boundary]
+        month_date_codes, month_date_uniques = pd.factorize(month_dates)
+        date_slots = self._index['date'].slots(pd.Index(month_date_uniques))[month_date_codes]
+        month_slots = self._index['month'].slots(pd.Index((month_ids << _DATE_BITS) | date_slots))
+        count = len(self._index['month'])
+        self._month_ids = _grow(self._month_ids, count)
+        self._month_dates = _grow(self._month_dates, count)
+        self._month_ids[month_slots], self._month_dates[month_slots] = month_ids, month_dates
+        self._accumulate('month', count, values[order], boundary, month_slots)
+        return list(uniques)
+
+    def features(self, ids=None):
+        """
+        Feature frame for the given ids (default every company seen so far), same layout as
+        build_price_features. Only the state of the requested companies is read.
+        """
+        n_ids, n_months = len(self._index['id']), len(self._index['month'])
+        if ids is None:
+            # A slice keeps the month state as views, it is the largest part of the state
+            slots = np.arange(n_ids)
+            month_slots = slice(0, n_months)
+        else:
+            slots = self._index['id'].slots(pd.Index(ids), add=False)
+            if (slots < 0).any():
+                raise KeyError(f"No price state for {list(pd.Index(ids)[slots < 0][:3])}")
+            slots = np.unique(slots)
+            month_slots = np.flatnonzero(np.isin(self._month_ids[:n_months], slots))
+        codes, uniques = pd.factorize(self._index['id'].keys()[slots], sort=True)
+        slot_codes = np.full(n_ids, -1, dtype=np.int64)
+        slot_codes[slots] = codes
+
+        sumx, _, nobs = self._sums['id']
+        mean_prices = np.empty((len(slots), len(PRICE_COLUMNS)))
+        mean_prices[codes] = _finish_mean(sumx[slots], nobs[slots])
+
+        sumx, _, nobs = self._sums['month']
+        month_codes = slot_codes[self._month_ids[month_slots]]
+        order = np.lexsort((self._month_dates[month_slots], month_codes))
+        monthly = _finish_mean(sumx[month_slots], nobs[month_slots])[order]
+        return _assemble_features(uniques, mean_prices, month_codes[order], monthly)
+
+    def save(self, file_path):
+        """
+        Write the running state to an .npz file so later batches can be folded in without the history
+        """
+        n_ids, n_months = len(self._index['id']), len(self._index['month'])
+        arrays = {'ids': np.array(self._index['id'].keys(), dtype=str),
+                  'month_ids': self._month_ids[:n_months],
+                  'month_dates': self._month_dates[:n_months]}
+        for name, count in (('id', n_ids), ('month', n_months)):
+            for part, array in zip(('sum', 'compensation', 'nobs'), self._sums[name]):
+                arrays[f"{name}_{part}"] = array[:count]
+        np.savez(file_path, **arrays)
+
+    @classmethod
+    def load(cls, file_path):
+        accumulator = cls()
+        with np.load(file_path) as arrays:
+            accumulator._month_ids = arrays['month_ids']
+            accumulator._month_dates = arrays['month_dates']
+            date_slots, dates = pd.factorize(accumulator._month_dates)
+            accumulator._index = {
+                'id': _SlotIndex(arrays['ids'].tolist()),
+                'date': _SlotIndex(dates),
+                'month': _SlotIndex((accumulator._month_ids << _DATE_BITS) | date_slots)
+            }
+            for name in ('id', 'month'):
+                accumulator._sums[name] = [arrays[f"{name}_{part}"] for part in ('sum', 'compensation', 'nobs')]
+        return accumulator
+
+
+def stream_price_features(price_data_path, chunksize):
+    '''
+    Build the price features reading the price table in chunks of chunksize rows
+    '''
+    accumulator = PriceFeatureAccumulator()
+    for chunk in pd.read_csv(price_data_path, chunksize=chunksize, **csv_options(PRICE_SCHEMA)):
+        accumulator.update(chunk)
+    return accumulator.features()
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Every column the pipeline reads from the raw tables. 'dtype' is the type the column is read as:
+# 'str', 'int64', 'float64', 'category' (strings from a fixed set) or 'date' (strings in DATE_FORMAT,
+# parsed after the read). Optional rules: 'categories' (allowed values), 'min' / 'max' (inclusive
+# range) and 'nullable' (missing values allowed, False by default).
+CLIENT_SCHEMA = {
+    'id': {'dtype': 'str'},
+    'channel_sales': {'dtype': 'category', 'categories': [
+        'MISSING',
+        'epumfxlbckeskwekxbiuasklxalciiuu',
+        'ewpakwlliwisiwduibdlfmalxowmwpci',
+        'fixdbufsefwooaasfcxdxadsiekoceaa',
+        'foosdfpfkusacimwkcsosbicdxkicaua',
+        'lmkebamcaaclubfxadlmueccxoimlema',
+        'sddiedcslfslkckwlfkdpoeeailfpeds',
+        'usilxuppasemubllopkaafesmlibmsdf'
+    ]},
+    'cons_12m': {'dtype': 'int64', 'min': 0},
+    'cons_gas_12m': {'dtype': 'int64', 'min': 0},
+    'cons_last_month': {'dtype': 'int64', 'min': 0},
+    'date_activ': {'dtype': 'date'},
+    'date_end': {'dtype': 'date'},
+    'date_modif_prod': {'dtype': 'date'},
+    'date_renewal': {'dtype': 'date'},
+    'forecast_cons_12m': {'dtype': 'float64', 'min': 0},
+    'forecast_cons_year': {'dtype': 'int64', 'min': 0},
+    'forecast_discount_energy': {'dtype': 'float64', 'min': 0, 'max': 100},
+    'forecast_meter_rent_12m': {'dtype': 'float64', 'min': 0},
+    'forecast_price_energy_off_peak': {'dtype': 'float64', 'min': 0, 'max': 1},
+    'forecast_price_energy_peak': {'dtype': 'float64', 'min': 0, 'max': 1},
+    'forecast_price_pow_off_peak': {'dtype': 'float64', 'min': 0, 'max': 100},
+    'has_gas': {'dtype': 'str', 'categories': ['f', 't']},
+    'imp_cons': {'dtype': 'float64', 'min': 0},
+    'margin_gross_pow_ele': {'dtype': 'float64'},
+    'margin_net_pow_ele': {'dtype': 'float64'},
+    'nb_prod_act': {'dtype': 'int64', 'min': 1},
+    'net_margin': {'dtype': 'float64'},
+    'num_years_antig': {'dtype': 'int64', 'min': 0},
+    'origin_up': {'dtype': 'category', 'categories': [
+        'MISSING',
+        'ewxeelcelemmiwuafmddpobolfuxioce',
+        'kamkkxfxxuwbdslkwifmmcsiusiuosws',
+        'ldkssxwpmemidmecebumciepifcamkci',
+        'lxidpiddsbxsbosboudacockeimpuepw',
+        'usapbepcfoloekilkwsdiboslwaxobdp'
+    ]},
+    'pow_max': {'dtype': 'float64', 'min': 0},
+    'churn': {'dtype': 'int64', 'min': 0, 'max': 1}
+}
+
+# Monthly prices per client, a month or period without a price is left empty
+PRICE_SCHEMA = {
+    'id': {'dtype': 'str'},
+    'price_date': {'dtype': 'date', 'nullable': True},
+    'price_off_peak_var': {'dtype': 'float64', 'min': 0, 'max': 1, 'nullable': True},
+    'price_peak_var': {'dtype': 'float64', 'min': 0, 'max': 1, 'nullable': True},
+    'price_mid_peak_var': {'dtype': 'float64', 'min': 0, 'max': 1, 'nullable': True},
+    'price_off_peak_fix': {'dtype': 'float64', 'min': 0, 'max': 100, 'nullable': True},
+    'price_peak_fix': {'dtype': 'float64', 'min': 0, 'max': 100, 'nullable': True},
+    'price_mid_peak_fix': {'dtype': 'float64', 'min': 0, 'max': 100, 'nullable': True}
+}
+
+# Offending values quoted per problem in a report
+_EXAMPLES = 3
+
+
+class SchemaError(ValueError):
+    '''
+    Raised with the compact report of every problem found in a table
+    '''
+
+
+def read_options(schema, columns=None):
+    '''
+    Keyword arguments for read_csv_cached reading only columns (all of the schema by default):
+    usecols, dtype, and the date and category columns it converts after the read
+    '''
+    columns = list(schema) if columns is None else list(columns)
+    return {
+        'usecols': columns,
+        'dtype': {column: schema[column]['dtype'] for column in columns
+                  if schema[column]['dtype'] not in ('date', 'category')},
+        'parse_dates': [column for column in columns if schema[column]['dtype'] == 'date'],
+        'categories': [column for column in columns if schema[column]['dtype'] == 'category']
+    }
+
+
+def csv_options(schema, columns=None):
+    '''
+    usecols and dtype for a plain pd.read_csv, dates and categories are read as strings
+    '''
+    options = read_options(schema, columns)
+    options['dtype'].update({column: 'str' for column in options['parse_dates'] + options['categories']})
+    return {'usecols': options['usecols'], 'dtype': options['dtype']}
+
+
+def _problem(problems, column, check, mask, values):
+    count = int(np.count_nonzero(mask))
+    if count:
+        entry = problems.setdefault((column, check), [0, []])
+        entry[0] += count
+        entry[1].extend(values[mask][:_EXAMPLES - len(entry[1])].tolist())
+
+
+def check_frame(df, schema, problems=None):
+    '''
+    Check the columns of df read as strings against schema, each rule as one vectorized pass over a
+    column. Problems are accumulated in the dict problems, {(column, check): [count, examples]},
+    so the chunks of a large table can be checked one after the other. Returns problems.
+    '''
+    problems = {} if problems is None else problems
+    for column, rules in schema.items():
+        if column not in df.columns:
+            problems.setdefault((column, "missing column"), [1, []])
+            continue
+        raw = df[column].to_numpy(dtype=object)
+        missing = df[column].isna().to_numpy()
+        if not rules.get('nullable', False):
+            _problem(problems, column, "missing values at rows", missing, df.index.to_numpy())
+
+        dtype = rules['dtype']
+        if dtype == 'date':
+            parsed = pd.to_datetime(df[column], format=DATE_FORMAT, errors='coerce')
+            _problem(problems, column, f"not a {DATE_FORMAT} date", parsed.isna().to_numpy() & ~missing, raw)
+        elif dtype in ('int64', 'float64'):
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+            invalid = np.isnan(values) & ~missing
+            _problem(problems, column, "not a number", invalid, raw)
+            if dtype == 'int64':
+                _problem(problems, column, "not an integer", ~invalid & ~missing & (values != np.round(values)), raw)
+            with np.errstate(invalid='ignore'):
+                if 'min' in rules:
+                    _problem(problems, column, f"below {rules['min']}", values < rules['min'], raw)
+                if 'max' in rules:
+                    _problem(problems, column, f"above {rules['max']}", values > rules['max'], raw)
+        if 'categories' in rules:
+            _problem(problems, column, "unknown category", ~df[column].isin(rules['categories']).to_numpy() & ~missing, raw)
+    return problems
+
+
+def format_report(name, n_rows, problems):
+    '''
+    One line for the table and one line per (column, check) with its count and a few examples
+    '''
+    lines = [f"{name}: {len(problems)} problem(s) in {n_rows} rows"]
+    for (column, check), (count, examples) in problems.items():
+        if check == "missing column":
+            lines.append(f"  {column}: missing column")
+        else:
+            lines.append(f"  {column}: {count} {check}, e.g. {examples}")
+    return "\n".join(lines)
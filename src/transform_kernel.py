@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+# Skewed consumption and forecast columns, replaced by log10(x + 1)
+LOG10_COLUMNS = [
+    'cons_12m',
+    'cons_gas_12m',
+    'cons_last_month',
+    'forecast_cons_12m',
+    'forecast_cons_year',
+    'forecast_meter_rent_12m',
+    'imp_cons'
+]
+
+# The one-hot encodings keep a fixed set of categories, so every batch gets the same columns.
+# The rarest sales channels and campaigns (and a missing campaign) are left out and encode as all zeros.
+CHANNEL_CATEGORIES = [
+    'MISSING',
+    'ewpakwlliwisiwduibdlfmalxowmwpci',
+    'foosdfpfkusacimwkcsosbicdxkicaua',
+    'lmkebamcaaclubfxadlmueccxoimlema',
+    'usilxuppasemubllopkaafesmlibmsdf'
+]
+ORIGIN_CATEGORIES = [
+    'kamkkxfxxuwbdslkwifmmcsiusiuosws',
+    'ldkssxwpmemidmecebumciepifcamkci',
+    'lxidpiddsbxsbosboudacockeimpuepw'
+]
+
+# (column, kind, argument): 'log1p10' replaces x by log10(x + 1), 'map' replaces values through
+# the argument dict and 'onehot' replaces the column by one boolean column per (prefix, categories)
+CLIENT_TRANSFORMS = (
+    [('has_gas', 'map', {'t': 1, 'f': 0}),
+     ('channel_sales', 'onehot', ('channel', CHANNEL_CATEGORIES))]
+    + [(column, 'log1p10', None) for column in LOG10_COLUMNS]
+)
+ORIGIN_TRANSFORMS = [('origin_up', 'onehot', ('origin_up', ORIGIN_CATEGORIES))]
+
+
+def apply_transforms(df, spec):
+    '''
+    Apply a transform spec to df in place and return it.
+
+    Each log1p10 column is converted into one new float64 buffer and transformed inside it
+    (np.add then np.log10 with out=), so there is one allocation per column instead of two
+    temporaries. Converting all of them as one block is slower and holds more memory, because
+    assigning the block back copies it into one column per block again (see the transform_kernel
+    benchmark stage). One-hot columns are built from the category positions (values outside the
+    categories encode as all zeros) and appended at the end in spec order, the same layout
+    pd.get_dummies gives, and their source columns are removed.
+    '''
+    for column, kind, argument in spec:
+        if kind == 'log1p10':
+            values = np.add(df[column].to_numpy(), 1, dtype=np.float64)
+            df[column] = np.log10(values, out=values)
+        elif kind == 'map':
+            df[column] = df[column].map(argument)
+
+    for column, kind, argument in spec:
+        if kind == 'onehot':
+            prefix, categories = argument
+            codes = pd.Index(categories).get_indexer(df.pop(column))
+            for code, category in enumerate(categories):
+                df[f"{prefix}_{category}"] = codes == code
+    return df
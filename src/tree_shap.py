@@ -0,0 +1,181 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.exception import CustomException
+
+# Rows explained together, every node of a tree is visited once per block. The work per node
+# follows the distinct split patterns, which grow much slower than the rows, so blocks are large.
+_ROW_BLOCK = 1 << 15
+
+
+def _tree_arrays(tree, n_classes, class_index, scale):
+    # Leaf values normalised like DecisionTreeClassifier.predict_proba, for one class
+    proba = tree.value[:, 0, :n_classes]
+    normalizer = proba.sum(axis=1)
+    normalizer[normalizer == 0.0] = 1.0
+    return {
+        'left': tree.children_left,
+        'right': tree.children_right,
+        'feature': tree.feature,
+        'threshold': tree.threshold,
+        'missing_left': tree.missing_go_to_left.astype(bool),
+        'cover': tree.weighted_n_node_samples,
+        'value': proba[:, class_index] / normalizer * scale
+    }
+
+
+def _extend(weights, depth, zero_fraction, one_fraction):
+    '''
+    Add a path element to the permutation weights of every pattern (shap's extend_path, vectorized)
+    '''
+    extended = np.zeros((depth + 1, weights.shape[1]))
+    if depth == 0:
+        extended[0] = 1.0
+        return extended
+    position = np.arange(depth)[:, np.newaxis]
+    extended[:depth] = zero_fraction * weights * (depth - position) / (depth + 1)
+    extended[1:] += one_fraction * weights * (position + 1) / (depth + 1)
+    return extended
+
+
+def _unwind(weights, depth, zero_fraction, one_fraction):
+    '''
+    Remove a path element from the weights (shap's unwind_path), one fractions are 0 or 1 per pattern
+    '''
+    unwound = np.empty((depth, weights.shape[1]))
+    next_one = weights[depth].copy()
+    hot = one_fraction != 0
+    for i in range(depth - 1, -1, -1):
+        unwound[i] = np.where(hot, next_one * (depth + 1) / (i + 1),
+                              weights[i] * (depth + 1) / (zero_fraction * (depth - i)))
+        next_one = weights[i] - unwound[i] * zero_fraction * (depth - i) / (depth + 1)
+    return unwound
+
+
+def _unwound_sums(weights, depth, zero_fractions, one_fractions):
+    '''
+    Sums of the weights with each path element removed in turn (shap's unwound_path_sum for every
+    element at once), shape (depth, n_patterns). Where an element is cold the sum does not
+    depend on the recurrence and is one weighted sum over the path divided by its zero fraction.
+    '''
+    position = np.arange(depth)[:, np.newaxis]
+    cold = (weights[:depth] / (depth - position)).sum(axis=0) / zero_fractions
+    next_one = np.repeat(weights[depth][np.newaxis], depth, axis=0)
+    hot = np.zeros_like(next_one)
+    step = np.empty_like(next_one)
+    for i in range(depth - 1, -1, -1):
+        np.multiply(next_one, 1.0 / (i + 1), out=step)
+        hot += step
+        np.multiply(step, zero_fractions * (depth - i), out=next_one)
+        np.subtract(weights[i], next_one, out=next_one)
+    return np.where(one_fractions != 0, hot, cold) * (depth + 1)
+
+
+def _tree_shap(tree, X, phi_t):
+    '''
+    Add the exact path-dependent TreeSHAP values of one tree for the rows of X to phi_t, shaped
+    (n_features, n_rows). Along a path the features and zero fractions are the same for every row,
+    only the one fractions differ, and they are set by which side of each split the row took. So
+    the weights are held per distinct pattern of split outcomes, with inverse mapping every row to
+    its pattern, and a node costs numpy operations over the patterns that reach it, not the rows.
+    '''
+    n_rows = len(X)
+
+    def recurse(node, weights, features, zeros, ones, depth, zero_fraction, one_fraction, feature, inverse):
+        weights = _extend(weights, depth, zero_fraction, one_fraction)
+        features, zeros, ones = features + [feature], zeros + [zero_fraction], ones + [one_fraction]
+
+        left = tree['left'][node]
+        if left == -1:
+            if depth:
+                zero_fractions = np.array(zeros[1:])[:, np.newaxis]
+                one_fractions = np.array(ones[1:])
+                weight = _unwound_sums(weights, depth, zero_fractions, one_fractions)
+                contributions = weight * (one_fractions - zero_fractions) * tree['value'][node]
+                if contributions.shape[1] == 1:
+                    # Features are unique along the path, so the fancy-indexed add has no collisions
+                    phi_t[features[1:]] += contributions
+                else:
+                    for path_feature, contribution in zip(features[1:], contributions):
+                        phi_t[path_feature] += contribution.take(inverse)
+            return
+
+        right = tree['right'][node]
+        split = tree['feature'][node]
+        x = X[:, split]
+        go_left = (x <= tree['threshold'][node]) | (np.isnan(x) & tree['missing_left'][node])
+
+        # Split every pattern by the side its rows take, both children share the refined patterns
+        n_patterns = weights.shape[1]
+        code = inverse * 2 + go_left
+        present = np.flatnonzero(np.bincount(code, minlength=2 * n_patterns))
+        if len(present) > n_patterns:
+            remap = np.empty(2 * n_patterns, dtype=np.intp)
+            remap[present] = np.arange(len(present))
+            inverse = remap[code]
+        parent, went_left = present // 2, (present % 2).astype(bool)
+        weights, ones = weights[:, parent], [one[parent] for one in ones]
+
+        # A feature already on the path is unwound and split again with the combined fractions
+        incoming_zero, incoming_one = 1.0, np.ones(len(present))
+        if split in features[1:]:
+            k = features.index(split, 1)
+            incoming_zero, incoming_one = zeros[k], ones[k]
+            weights = _unwind(weights, depth, zeros[k], ones[k])
+            features, zeros, ones = features[:k] + features[k + 1:], zeros[:k] + zeros[k + 1:], ones[:k] + ones[k + 1:]
+            depth -= 1
+
+        cover = tree['cover'][node]
+        recurse(left, weights, features, zeros, ones, depth + 1, tree['cover'][left] / cover * incoming_zero,
+                incoming_one * went_left, split, inverse)
+        recurse(right, weights, features, zeros, ones, depth + 1, tree['cover'][right] / cover * incoming_zero,
+                incoming_one * ~went_left, split, inverse)
+
+    recurse(0, np.zeros((0, 1)), [], [], [], 0, 1.0, np.ones(1), -1, np.zeros(n_rows, dtype=np.intp))
+
+
+def _expected_value(tree):
+    leaves = tree['left'] == -1
+    return float((tree['value'][leaves] * tree['cover'][leaves]).sum() / tree['cover'][0])
+
+
+def _forest_shap(trees, X, n_features):
+    phi = np.zeros((len(X), n_features))
+    for start in range(0, len(X), _ROW_BLOCK):
+        # Feature major, so the per-leaf adds write contiguous rows
+        block_t = np.zeros((n_features, len(X[start:start + _ROW_BLOCK])))
+        for tree in trees:
+            _tree_shap(tree, X[start:start + _ROW_BLOCK], block_t)
+        phi[start:start + _ROW_BLOCK] = block_t.T
+    return phi
+
+
+def forest_shap_values(model, X, class_index=1, max_workers=None):
+    '''
+    Exact path-dependent TreeSHAP contributions of a fitted RandomForestClassifier to the
+    probability of classes_[class_index], shape (n_rows, n_features), and the expected value.
+
+    Each tree is walked once per block of rows with the path weights of every distinct split
+    pattern held as one array, so the recursion costs numpy operations over patterns instead of a
+    Python loop per row, and chunks of trees run in parallel processes. For every row the contributions plus the
+    expected value add up to predict_proba.
+    '''
+    try:
+        X = np.asarray(X, dtype=np.float32)
+        scale = 1.0 / len(model.estimators_)
+        trees = [_tree_arrays(estimator.tree_, model.n_classes_, class_index, scale)
+                 for estimator in model.estimators_]
+        expected_value = sum(_expected_value(tree) for tree in trees)
+
+        n_chunks = min(len(trees), max_workers or 1)
+        if n_chunks <= 1:
+            return _forest_shap(trees, X, model.n_features_in_), expected_value
+        chunks = [trees[i::n_chunks] for i in range(n_chunks)]
+        with ProcessPoolExecutor(max_workers=n_chunks) as executor:
+            futures = [executor.submit(_forest_shap, chunk, X, model.n_features_in_) for chunk in chunks]
+            return sum(future.result() for future in futures), expected_value
+
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -1,10 +1,19 @@
 import os
 import sys
+import glob
+import hashlib
+import json
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import pickle
 
 from src.exception import CustomException
+from src.logger import logging, profile_step
+from src.schema import CLIENT_SCHEMA, DATE_FORMAT
+
+CACHE_DIR = os.path.join('data', 'cache')
+CLIENT_DATE_COLUMNS = [column for column, rules in CLIENT_SCHEMA.items() if rules['dtype'] == 'date']
+CLIENT_CATEGORY_COLUMNS = [column for column, rules in CLIENT_SCHEMA.items() if rules['dtype'] == 'category']
 
 def save_object(file_path, obj):
     try:
@@ -18,6 +27,72 @@ def save_object(file_path, obj):
     except Exception as e:
         raise CustomException(e, sys)
 
+def load_object(file_path):
+    try:
+        with open(file_path, "rb") as file_obj:
+            return pickle.load(file_obj)
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def file_fingerprint(file_path, block_size=1 << 20):
+    '''
+    this function will return the sha256 hex digest of the file contents
+    '''
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_csv_cached(file_path, parse_dates=(), categories=(), cache_dir=CACHE_DIR, **read_csv_kwargs):
+    '''
+    Read a csv through a columnar Parquet cache keyed by the file contents and the parse options.
+
+    Date columns are stored as native datetimes and the given columns as categoricals, so a warm
+    read skips both the text parsing and the date conversion. A changed source file gets a new key,
+    the stale cache entries of that file are removed and the cache is rebuilt from the csv.
+    '''
+    try:
+        parse_dates, categories = list(parse_dates), list(categories)
+        options = json.dumps([parse_dates, categories, sorted(read_csv_kwargs.items())], default=str)
+        content_key = file_fingerprint(file_path)[:16]
+        options_key = hashlib.sha256(options.encode()).hexdigest()[:8]
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        cache_path = os.path.join(cache_dir, f"{stem}-{content_key}-{options_key}.parquet")
+
+        if os.path.exists(cache_path):
+            logging.info(f"Read {file_path} from cache {cache_path}")
+            with profile_step(f"read_parquet:{stem}") as step:
+                df = pd.read_parquet(cache_path)
+                step.rows_out = len(df)
+            return df
+
+        with profile_step(f"read_csv:{stem}") as step:
+            df = pd.read_csv(file_path, **read_csv_kwargs)
+            for column in parse_dates:
+                df[column] = pd.to_datetime(df[column], format=DATE_FORMAT)
+            for column in categories:
+                df[column] = df[column].astype('category')
+            step.rows_out = len(df)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale_path in glob.glob(os.path.join(cache_dir, f"{glob.escape(stem)}-*-*.parquet")):
+            if not os.path.basename(stale_path).startswith(f"{stem}-{content_key}-"):
+                os.remove(stale_path)
+        # Write then rename so an interrupted run never leaves a truncated cache entry
+        tmp_path = cache_path + ".tmp"
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"Cached {file_path} as {cache_path}")
+        return df
+
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
 def annotate_stacked_bars(ax, pad=0.99, colour="white", textsize=13):
     # Iterate over the plotted rectanges/bars
     for p in ax.patches:
@@ -33,7 +108,9 @@ def annotate_stacked_bars(ax, pad=0.99, colour="white", textsize=13):
             size=textsize
         )
 
-def plot_stacked_bars(dataframe, title_, size_=(18, 10), rot_=0, legend_="upper right"):
+def plot_stacked_bars(dataframe, title_, size_=(18, 10), rot_=0, legend_="upper right", show=True):
+    import matplotlib.pyplot as plt
+
     ax = dataframe.plot(
         kind="bar",
         stacked=True,
@@ -49,7 +126,10 @@ def plot_stacked_bars(dataframe, title_, size_=(18, 10), rot_=0, legend_="upper
     # Labels
     plt.ylabel("Company base (%)")
     plt.savefig(os.path.join('images', title_+".png"))
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close(ax.figure)
 
 def plot_distribution(dataframe, column, ax, bins_=50):
     """
@@ -63,4 +143,67 @@ def plot_distribution(dataframe, column, ax, bins_=50):
     # X-axis label
     ax.set_xlabel(column)
     # Change the x-axis to plain style
-    ax.ticklabel_format(style='plain', axis='x')
\ No newline at end of file
+    ax.ticklabel_format(style='plain', axis='x')
+
+
+def distribution_stats(values, churn, bins_=50, max_fliers=1000):
+    """
+    Compact summary of one column for the distribution and box plots: histogram counts of retained
+    and churned companies on shared bin edges, and the box plot quartiles, whiskers and outliers
+    """
+    values = np.asarray(values, dtype=np.float64)
+    churn = np.asarray(churn)
+    valid = ~np.isnan(values)
+    values, churn = values[valid], churn[valid]
+
+    # Same edges as a pandas stacked histogram of both groups, last bin closed like np.histogram
+    edges = np.histogram_bin_edges(values, bins=bins_)
+    index = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, bins_ - 1)
+    counts = np.bincount(index + bins_ * (churn == 1), minlength=2 * bins_).reshape(2, bins_)
+
+    # Quartiles and 1.5 IQR whiskers as computed by matplotlib's boxplot
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    fliers = np.unique(values[(values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)])
+    if len(fliers) > max_fliers:
+        # Keep the extremes and an evenly spaced sample of the rest
+        fliers = fliers[np.linspace(0, len(fliers) - 1, max_fliers).astype(int)]
+
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()) if len(values) else None,
+        'min': float(edges[0]),
+        'max': float(edges[-1]),
+        'edges': edges.tolist(),
+        'retention': counts[0].tolist(),
+        'churn': counts[1].tolist(),
+        'box': {
+            'q1': float(q1), 'med': float(med), 'q3': float(q3),
+            'whislo': float(inside.min()), 'whishi': float(inside.max()),
+            'fliers': fliers.tolist()
+        }
+    }
+
+
+def plot_distribution_stats(stats, column, ax):
+    """
+    Plot a stacked histogram of churned or retained company from distribution_stats
+    """
+    edges = np.asarray(stats['edges'])
+    ax.hist([edges[:-1], edges[:-1]], bins=edges, weights=[stats['retention'], stats['churn']], stacked=True,
+            label=["Retention", "Churn"])
+    ax.legend()
+    ax.set_ylabel("Frequency")
+    # X-axis label
+    ax.set_xlabel(column)
+    # Change the x-axis to plain style
+    ax.ticklabel_format(style='plain', axis='x')
+
+
+def plot_box_stats(stats, column, ax):
+    """
+    Plot a box plot from the quartiles, whiskers and outliers in distribution_stats
+    """
+    ax.bxp([dict(stats['box'], label=column)], showfliers=True)
+    ax.set_ylabel(column)
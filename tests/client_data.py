@@ -0,0 +1,23 @@
+import pandas as pd
+
+from src.schema import CLIENT_SCHEMA
+
+
+def client_rows(n=3):
+    '''
+    n raw client rows valid under CLIENT_SCHEMA, every value as a string like a csv read with dtype=str
+    '''
+    values = {
+        'date': '2015-06-01',
+        'int64': '1',
+        'float64': '0.5',
+        'str': 'f'
+    }
+    rows = {}
+    for column, rules in CLIENT_SCHEMA.items():
+        if 'categories' in rules:
+            rows[column] = [rules['categories'][0]] * n
+        else:
+            rows[column] = [values[rules['dtype']]] * n
+    rows['id'] = [f"client_{i}" for i in range(n)]
+    return pd.DataFrame(rows)
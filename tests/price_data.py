@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from src.price_features import PRICE_COLUMNS, PRICE_FEATURE_COLUMNS
+from src.schema import PRICE_SCHEMA, csv_options
+
+
+def synthetic_prices(n_ids=40, seed=0):
+    '''
+    Monthly price rows in shuffled order, with repeated months, missing prices and undated rows
+    '''
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_ids):
+        months = rng.choice(np.arange(1, 13), size=rng.integers(1, 13), replace=False)
+        months = np.concatenate([months, rng.choice(months, size=rng.integers(0, 3))])
+        for month in months:
+            rows.append([f"id{i:03d}", f"2015-{month:02d}-01"] + list(rng.random(3)) + list(rng.random(3) * 50))
+    price_df = pd.DataFrame(rows, columns=['id', 'price_date'] + PRICE_COLUMNS)
+    values = price_df[PRICE_COLUMNS].to_numpy(copy=True)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    price_df[PRICE_COLUMNS] = values
+    price_df.loc[rng.random(len(price_df)) < 0.03, 'price_date'] = np.nan
+    return price_df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def assert_same_features(features, expected):
+    features = features.sort_values('id', ignore_index=True)
+    assert list(features.columns) == ['id'] + PRICE_FEATURE_COLUMNS
+    assert features['id'].tolist() == expected['id'].tolist()
+    np.testing.assert_array_equal(features[PRICE_FEATURE_COLUMNS].to_numpy(dtype=np.float64),
+                                  expected[PRICE_FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+
+
+def read_prices(file_path):
+    return pd.read_csv(file_path, **csv_options(PRICE_SCHEMA))
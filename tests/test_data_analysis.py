@@ -0,0 +1,44 @@
+import os
+
+from client_data import client_rows
+from price_data import synthetic_prices
+from src.components.data_analysis import DataAnalysis
+
+
+def _analysis(tmp_path, price_chunksize=None):
+    obj = DataAnalysis()
+    config = obj.analysis_config
+    config.client_data_path = str(tmp_path / "client_data.csv")
+    config.price_data_path = str(tmp_path / "price_data.csv")
+    config.cache_dir = str(tmp_path / "cache")
+    config.price_chunksize = price_chunksize
+    return obj
+
+
+def _write_clients(tmp_path, n):
+    clients = client_rows(n)
+    clients['churn'] = [str(i % 2) for i in range(n)]
+    clients['has_gas'] = ['t' if i % 3 else 'f' for i in range(n)]
+    clients['cons_12m'] = [str(i * 10) for i in range(n)]
+    clients.to_csv(tmp_path / "client_data.csv", index=False)
+
+
+def test_eda_stats_cache_keeps_one_entry_per_source(tmp_path, monkeypatch):
+    # The Parquet cache of the raw tables goes under the working directory
+    monkeypatch.chdir(tmp_path)
+    _write_clients(tmp_path, 12)
+    price_df = synthetic_prices()
+    price_df.to_csv(tmp_path / "price_data.csv", index=False)
+
+    stats = _analysis(tmp_path).eda_stats()
+    assert stats['clients'] == 12
+    assert stats['price_non_null'] == {column: int(count) for column, count in price_df.notna().sum().items()}
+    # The streamed price counts match the whole-table ones
+    os.utime(tmp_path / "price_data.csv", ns=(0, 0))
+    assert _analysis(tmp_path, price_chunksize=7).price_non_null() == stats['price_non_null']
+
+    _write_clients(tmp_path, 20)
+    os.utime(tmp_path / "price_data.csv", ns=(10**9, 10**9))
+    assert _analysis(tmp_path).eda_stats()['clients'] == 20
+    entries = sorted(name.split('-')[0] for name in os.listdir(tmp_path / "cache") if name.endswith(".json"))
+    assert entries == ["eda_price_counts", "eda_stats"]
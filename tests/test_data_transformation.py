@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from client_data import client_rows
+from price_data import synthetic_prices
+from src.components.data_transformation import DataTransformation
+from src.price_features import build_price_features
+from src.schema import CLIENT_SCHEMA, PRICE_SCHEMA, read_options
+from src.utils import read_csv_cached
+
+
+def _tables(tmp_path, n_clients=45):
+    # Five of the clients have no price history and drop out of the join
+    clients = client_rows(n_clients).assign(id=[f"id{i:03d}" for i in range(n_clients)])
+    rng = np.random.default_rng(0)
+    clients['cons_12m'] = rng.integers(0, 10**6, n_clients).astype(str)
+    clients['has_gas'] = rng.choice(['t', 'f'], n_clients)
+    clients['channel_sales'] = rng.choice(CLIENT_SCHEMA['channel_sales']['categories'], n_clients)
+    clients.to_csv(tmp_path / "clean_data_after_eda.csv", index=False)
+    synthetic_prices(n_ids=40).to_csv(tmp_path / "price_data.csv", index=False)
+    cache_dir = str(tmp_path / "cache")
+    return (read_csv_cached(str(tmp_path / "clean_data_after_eda.csv"), cache_dir=cache_dir,
+                            **read_options(CLIENT_SCHEMA)),
+            read_csv_cached(str(tmp_path / "price_data.csv"), cache_dir=cache_dir, **read_options(PRICE_SCHEMA)))
+
+
+def test_partitioned_transform_matches_serial(tmp_path):
+    client_df, price_df = _tables(tmp_path)
+    serial = DataTransformation.transform_features(client_df.copy(), build_price_features(price_df))
+    assert len(serial) == 40
+
+    partitioned = DataTransformation.partitioned_transform(client_df, price_df, n_partitions=3, max_workers=2)
+    pd.testing.assert_frame_equal(partitioned, serial)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from src.drift import PSI_EPSILON, FeatureSketch, drift_metrics
+
+COLUMNS = ['cons_12m', 'margin', 'num_years_antig']
+
+
+def reference_rows(rng, n):
+    return np.column_stack([rng.lognormal(10, 1, n), rng.normal(0, 1, n), rng.integers(1, 12, n).astype(float)])
+
+
+def bin_proportions(X, edges):
+    # The same bins as the sketch, counted with numpy directly: bin k is [edges[k - 1], edges[k])
+    proportions = []
+    for j in range(X.shape[1]):
+        column = X[~np.isnan(X[:, j]), j]
+        bounds = np.concatenate([[-np.inf], edges[j], [np.inf]])
+        counts = np.array([((column >= low) & (column < high)).sum() for low, high in zip(bounds[:-1], bounds[1:])])
+        proportions.append(counts / max(len(column), 1))
+    return np.array(proportions)
+
+
+def test_psi_and_ks_match_a_direct_computation():
+    rng = np.random.default_rng(0)
+    X_ref = reference_rows(rng, 5000)
+    X_cur = reference_rows(rng, 3000)
+    X_cur[:, 1] += 0.5
+    X_cur[rng.random(3000) < 0.1, 0] = np.nan
+
+    reference = FeatureSketch.from_reference(X_ref, COLUMNS, n_bins=32)
+    current = reference.empty().update(X_cur)
+    metrics = drift_metrics(reference, current)
+
+    expected, actual = bin_proportions(X_ref, reference.edges), bin_proportions(X_cur, reference.edges)
+    floored_expected, floored_actual = np.maximum(expected, PSI_EPSILON), np.maximum(actual, PSI_EPSILON)
+    psi = ((floored_actual - floored_expected) * np.log(floored_actual / floored_expected)).sum(axis=1)
+    ks = np.abs(np.cumsum(actual, axis=1) - np.cumsum(expected, axis=1)).max(axis=1)
+    np.testing.assert_allclose(metrics['psi'], psi)
+    np.testing.assert_allclose(metrics['ks'], ks)
+    assert list(metrics['feature']) == COLUMNS
+    assert metrics['rows'].eq(3000).all()
+    np.testing.assert_allclose(metrics['current_missing_rate'], np.isnan(X_cur).mean(axis=0))
+
+    # The discrete feature collapses its repeated quantiles, the unused edges are +inf
+    assert np.isinf(reference.edges[2]).any()
+    # The shifted feature drifts, the others do not
+    assert metrics['psi'][1] > 0.2 and metrics['ks'][1] > 0.15
+    assert (metrics['psi'][[0, 2]] < 0.02).all() and (metrics['ks'][[0, 2]] < 0.05).all()
+
+
+def test_identical_rows_do_not_drift():
+    X = reference_rows(np.random.default_rng(1), 2000)
+    reference = FeatureSketch.from_reference(X, COLUMNS)
+    metrics = drift_metrics(reference, reference.empty().update(X))
+    np.testing.assert_allclose(metrics['psi'], 0, atol=1e-12)
+    np.testing.assert_allclose(metrics['ks'], 0, atol=1e-12)
+
+
+def test_update_merge_and_save_load_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    X = reference_rows(rng, 3000)
+    reference = FeatureSketch.from_reference(X, COLUMNS)
+
+    # Batches summed by merge count the same as the rows in one update
+    whole = reference.empty().update(X)
+    merged = reference.empty().update(X[:1000]).merge(reference.empty().update(X[1000:]))
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    np.testing.assert_array_equal(merged.counts, reference.counts)
+    assert merged.n_rows == 3000
+
+    reference.save(tmp_path / "reference.npz")
+    loaded = FeatureSketch.load(tmp_path / "reference.npz")
+    assert loaded.feature_columns == COLUMNS
+    np.testing.assert_array_equal(loaded.edges, reference.edges)
+    np.testing.assert_array_equal(loaded.counts, reference.counts)
+    np.testing.assert_array_equal(loaded.missing, reference.missing)
+
+    other = FeatureSketch.from_reference(X[:100], COLUMNS)
+    with pytest.raises(ValueError):
+        reference.empty().merge(other)
+    with pytest.raises(ValueError):
+        drift_metrics(reference, other)
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from src.feature_matrix import load_feature_matrix
+
+
+def test_feature_matrix_matches_csv_and_rebuilds_on_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'id': [f"c{i}" for i in range(50)], 'cons_12m': rng.integers(0, 10**6, 50),
+                       'margin': rng.random(50), 'churn': rng.integers(0, 2, 50)})
+    df.to_csv("data_for_predictions.csv")
+
+    X, y, columns = load_feature_matrix("data_for_predictions.csv", "matrix")
+    assert columns == ['cons_12m', 'margin']
+    assert X.dtype == np.float32 and not X.flags.writeable
+    np.testing.assert_array_equal(X, df[columns].to_numpy(np.float32))
+    np.testing.assert_array_equal(y, df['churn'].to_numpy())
+
+    # A changed csv gets its matrix rebuilt
+    df.assign(margin=df['margin'] + 1).to_csv("data_for_predictions.csv")
+    X, _, _ = load_feature_matrix("data_for_predictions.csv", "matrix")
+    np.testing.assert_array_equal(X[:, 1], (df['margin'] + 1).to_numpy(np.float32))
@@ -0,0 +1,48 @@
+import json
+
+from price_data import assert_same_features, read_prices, synthetic_prices
+from src.benchmarks.reference import groupby_price_features
+from src.feature_store import PriceFeatureStore
+
+
+def test_feature_store_refresh_matches_groupby(tmp_path):
+    price_df = synthetic_prices(seed=1)
+    price_path = tmp_path / "price_data.csv"
+    store = PriceFeatureStore(str(tmp_path / "price_store"), chunksize=17)
+
+    first = len(price_df) * 2 // 3
+    price_df.iloc[:first].to_csv(price_path, index=False)
+    assert_same_features(store.refresh(str(price_path)), groupby_price_features(read_prices(price_path)))
+
+    # Appended rows update the touched companies and add new ones
+    price_df.iloc[first:].to_csv(price_path, mode="a", header=False, index=False)
+    synthetic_prices(n_ids=5, seed=2).assign(id=lambda df: df['id'] + "_new").to_csv(
+        price_path, mode="a", header=False, index=False)
+    expected = groupby_price_features(read_prices(price_path))
+    assert_same_features(store.refresh(str(price_path)), expected)
+    assert_same_features(store.features(), expected)
+
+    # A rewrite of rows already folded in is picked up too
+    rewritten = read_prices(price_path)
+    rewritten.loc[0, 'price_peak_var'] = 0.5
+    rewritten.loc[len(rewritten) - 1, 'price_off_peak_fix'] = 1.0
+    rewritten.to_csv(price_path, index=False)
+    assert_same_features(store.refresh(str(price_path)), groupby_price_features(read_prices(price_path)))
+
+
+def test_feature_store_leaves_a_partial_last_line(tmp_path):
+    price_df = synthetic_prices(seed=3)
+    price_path = tmp_path / "price_data.csv"
+    store = PriceFeatureStore(str(tmp_path / "price_store"), chunksize=50)
+
+    # A writer stopped in the middle of the last row, only the complete rows are folded in
+    text = price_df.to_csv(index=False)
+    cut = text.rindex("\n", 0, len(text) - 1) + 5
+    price_path.write_text(text[:cut])
+    complete = read_prices(price_path).iloc[:-1]
+    assert_same_features(store.refresh(str(price_path)), groupby_price_features(complete))
+    with open(tmp_path / "price_store" / "meta.json") as file_obj:
+        assert json.load(file_obj)['offset'] == text.rindex("\n", 0, len(text) - 1) + 1
+
+    price_path.write_text(text)
+    assert_same_features(store.refresh(str(price_path)), groupby_price_features(read_prices(price_path)))
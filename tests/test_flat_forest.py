@@ -0,0 +1,32 @@
+import numpy as np
+
+from src.flat_forest import FlatForest
+
+
+def test_flat_forest_matches_sklearn():
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    X = rng.random((400, 6)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(0, 0.2, len(X)) > 0.8).astype(int)
+    X[rng.random(X.shape) < 0.05] = np.nan
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0, n_jobs=1).fit(X, y)
+
+    X_test = rng.random((300, 6)).astype(np.float32)
+    X_test[rng.random(X_test.shape) < 0.05] = np.nan
+    flat = FlatForest.from_sklearn(model)
+    np.testing.assert_array_equal(flat.predict_proba(X_test), model.predict_proba(X_test))
+    np.testing.assert_array_equal(flat.predict(X_test), model.predict(X_test))
+
+
+def test_flat_forest_save_load(tmp_path):
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(1)
+    X = rng.random((200, 4)).astype(np.float32)
+    model = RandomForestClassifier(n_estimators=5, random_state=0, n_jobs=1).fit(X, X[:, 0] > 0.5)
+    flat = FlatForest.from_sklearn(model)
+    flat.save(str(tmp_path / "forest.npz"))
+    loaded = FlatForest.load(str(tmp_path / "forest.npz"))
+    assert loaded.n_estimators == 5
+    np.testing.assert_array_equal(loaded.predict_proba(X), flat.predict_proba(X))
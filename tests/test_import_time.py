@@ -0,0 +1,15 @@
+import pytest
+
+from src.benchmarks.import_time import HEAVY_MODULES, IMPORT_BUDGETS, check_budgets, measure_import
+
+
+def test_logger_import_is_light_and_creates_nothing():
+    seconds, loaded, created = measure_import('src.logger', repeat=3)
+    assert seconds > 0
+    assert not set(loaded) & set(HEAVY_MODULES + ['pandas', 'numpy'])
+    assert created == []
+
+
+@pytest.mark.parametrize('budget', IMPORT_BUDGETS, ids=[module for module, _, _ in IMPORT_BUDGETS])
+def test_import_time_budget(budget):
+    assert check_budgets(budgets=[budget], repeat=3) == []
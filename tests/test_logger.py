@@ -0,0 +1,42 @@
+import json
+import threading
+
+from src import logger
+from src.logger import profile_step
+
+
+def _sampler_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "profile_step-rss"]
+
+
+def test_profile_step_records_nested_steps_and_stops_the_sampler(tmp_path, monkeypatch):
+    profile_path = tmp_path / "profile.jsonl"
+    monkeypatch.setattr(logger, "PROFILE_ENABLED", True)
+    monkeypatch.setattr(logger, "PROFILE_FILE_PATH", str(profile_path))
+
+    for _ in range(2):
+        with profile_step("outer", rows_in=3) as outer:
+            with profile_step("inner"):
+                buffer = bytearray(8 << 20)
+            assert len(_sampler_threads()) == 1
+            outer.rows_out = len(buffer) // (4 << 20)
+        # The sampler only runs while a step is open
+        assert not _sampler_threads()
+
+    records = [json.loads(line) for line in profile_path.read_text().splitlines()]
+    assert [record["step"] for record in records] == ["outer/inner", "outer"] * 2
+    assert records[1]["rows_in"] == 3 and records[1]["rows_out"] == 2
+    assert all(record["status"] == "ok" and record["peak_rss_mb"] > 0 for record in records)
+    assert records[1]["peak_rss_mb"] >= records[0]["peak_rss_mb"]
+
+
+def test_profile_step_is_a_no_op_when_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger, "PROFILE_ENABLED", False)
+    monkeypatch.setattr(logger, "PROFILE_FILE_PATH", str(tmp_path / "profile.jsonl"))
+
+    @profile_step("decorated")
+    def work():
+        return 1
+
+    assert work() == 1
+    assert not (tmp_path / "profile.jsonl").exists() and not _sampler_threads()
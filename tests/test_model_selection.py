@@ -0,0 +1,60 @@
+import threading
+
+import numpy as np
+
+from src.components.model_selection import ModelSelection
+
+
+def _selection():
+    obj = ModelSelection()
+    config = obj.model_selection_config
+    config.candidates_per_family = 3
+    config.n_folds = 2
+    config.resources = {'random_forest': (3, 9), 'xgboost': (5, 45), 'catboost': (5, 15)}
+    config.cpu_budget, config.parallel_trials = 2, 2
+    return obj
+
+
+def _folds(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, 5)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(0, 0.2, n) > 0.8).astype(int)
+    return X, y, np.arange(n) % 2
+
+
+def test_trials_train_the_refit_model():
+    obj = _selection()
+    X, y, folds = _folds()
+    data = obj._fold_data(X, y, folds)[0]
+    for candidate in obj.sample_candidates():
+        if candidate['family'] == 'random_forest':
+            continue
+        # The trial on the binned fold matrices scores what the refit estimator predicts
+        model = obj.build_model(candidate, 7, 1).fit(data['X_train'], data['y_train'])
+        expected = obj._score(data['y_val'], model.predict_proba(data['X_val'])[:, 1])
+        assert obj._trial(candidate, 0, data, 7, 1) == expected
+
+
+def test_successive_halving_uses_each_family_resources():
+    obj = _selection()
+    X, y, folds = _folds()
+    candidates = obj.sample_candidates()
+    leaderboard = obj.successive_halving(candidates, obj._fold_data(X, y, folds))
+
+    assert sorted(leaderboard['candidate']) == list(range(len(candidates)))
+    for row in leaderboard.itertuples():
+        assert row.n_estimators == obj.rung_resource(row.family, row.rung)
+    assert obj.rung_resource('random_forest', 5) == 9 and obj.rung_resource('xgboost', 1) == 15
+
+
+def test_fold_matrices_are_per_thread():
+    obj = _selection()
+    X, y, folds = _folds()
+    data = obj._fold_data(X, y, folds)[0]
+    built = []
+    thread = threading.Thread(target=lambda: built.append(obj._fold_matrices('catboost', 0, data)))
+    thread.start()
+    thread.join()
+    own = obj._fold_matrices('catboost', 0, data)
+    assert own is obj._fold_matrices('catboost', 0, data)
+    assert own is not built[0]
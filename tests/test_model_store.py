@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.exception import CustomException
+from src.model_store import ModelStore
+
+
+def _forest(seed):
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(seed)
+    X = rng.random((200, 3)).astype(np.float32)
+    return X, RandomForestClassifier(n_estimators=4, random_state=seed, n_jobs=1).fit(X, X[:, 0] > 0.5)
+
+
+def test_model_store_round_trip(tmp_path):
+    store = ModelStore(str(tmp_path))
+    X, model = _forest(0)
+
+    def write_note(path):
+        with open(path, "w") as file_obj:
+            file_obj.write("reference")
+
+    version = store.save("churn", model, ['a', 'b', 'c'], "hash", {'accuracy': np.float64(0.9)},
+                         artifacts={'note.txt': write_note})
+    assert version == "v0001" and store.latest("churn") == "v0001"
+
+    manifest = store.manifest("churn")
+    assert manifest['feature_columns'] == ['a', 'b', 'c'] and manifest['training_data_hash'] == "hash"
+    assert manifest['metrics'] == {'accuracy': 0.9} and manifest['n_estimators'] == 4 and manifest['flat']
+    assert manifest['artifacts'] == ['note.txt']
+    with open(store.artifact_path("churn", "note.txt")) as file_obj:
+        assert file_obj.read() == "reference"
+
+    np.testing.assert_array_equal(store.load_model("churn").predict_proba(X), model.predict_proba(X))
+    flat = store.load_flat("churn")
+    assert isinstance(flat.feature, np.memmap)
+    np.testing.assert_array_equal(flat.predict_proba(X), model.predict_proba(X))
+
+
+def test_model_store_prunes_old_versions(tmp_path):
+    store = ModelStore(str(tmp_path), keep_versions=2)
+    for seed in range(4):
+        store.save("churn", _forest(seed)[1], ['a', 'b', 'c'], f"hash{seed}", {})
+
+    assert store.versions("churn") == ["v0003", "v0004"]
+    assert store.latest("churn") == "v0004"
+    assert store.manifest("churn", "v0003")['training_data_hash'] == "hash2"
+    assert not any(entry.endswith(".tmp") for entry in os.listdir(tmp_path / "churn"))
+    with pytest.raises(CustomException):
+        store.manifest("churn", "v0001")
@@ -0,0 +1,52 @@
+import numpy as np
+
+from src.components.model_trainer import ModelTrainer, out_of_bag_rows
+
+
+def _training_data(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, 5)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(0, 0.2, n) > 0.8).astype(int)
+    return X, y
+
+
+def _trainer(**config):
+    trainer = ModelTrainer()
+    for name, value in dict(n_estimators=60, estimator_step=20, n_jobs=1, **config).items():
+        setattr(trainer.model_trainer_config, name, value)
+    return trainer
+
+
+def test_out_of_bag_rows_match_sklearn():
+    from sklearn.ensemble import RandomForestClassifier
+
+    X, y = _training_data()
+    model = RandomForestClassifier(n_estimators=30, oob_score=True, random_state=0, n_jobs=1).fit(X, y)
+    proba = np.zeros((len(y), 2))
+    for tree in model.estimators_:
+        rows = out_of_bag_rows(tree, len(y))
+        proba[rows] += tree.predict_proba(X[rows])
+    np.testing.assert_allclose(proba / proba.sum(axis=1, keepdims=True), model.oob_decision_function_)
+
+
+def test_fit_forest_grows_in_steps():
+    X, y = _training_data()
+    for score in ("oob", "validation"):
+        model = _trainer(early_stopping_score=score, patience=10).fit_forest(X, y)
+        assert len(model.estimators_) == 60
+        assert not hasattr(model, 'oob_score_')
+
+
+def test_serving_forest_is_a_leading_subset():
+    X, y = _training_data()
+    trainer = _trainer(early_stopping=False)
+    model = trainer.fit_forest(X, y)
+
+    trainer.model_trainer_config.serving_tolerance = 1.0
+    serving = trainer.serving_forest(model, X, y)
+    assert serving.estimators_ == model.estimators_[:20] and serving.n_estimators == 20
+    assert len(model.estimators_) == 60
+
+    trainer.model_trainer_config.serving_tolerance = 0.0
+    serving = trainer.serving_forest(model, X, y)
+    assert serving.estimators_ == model.estimators_[:len(serving.estimators_)]
@@ -0,0 +1,43 @@
+import functools
+
+import pytest
+
+from src.exception import CustomException
+from src.pipeline import Pipeline, Stage
+
+
+def upper_copy(source, target):
+    with open(source) as source_obj, open(target, "w") as target_obj:
+        target_obj.write(source_obj.read().upper())
+
+
+def _stage(name, source, target):
+    return Stage(name, functools.partial(upper_copy, str(source), str(target)), inputs=[str(source)],
+                 outputs=[str(target)])
+
+
+def test_pipeline_skips_up_to_date_stages(tmp_path):
+    raw, clean, report = tmp_path / "raw.txt", tmp_path / "clean.txt", tmp_path / "report.txt"
+    raw.write_text("churn")
+    pipeline = Pipeline([_stage('report', clean, report), _stage('clean', raw, clean)],
+                        state_path=str(tmp_path / "state.json"), max_workers=1)
+
+    assert pipeline.run() == {'clean': "ran", 'report': "ran"}
+    assert report.read_text() == "CHURN"
+    assert pipeline.run() == {'clean': "skipped", 'report': "skipped"}
+
+    # A touched output reruns its stage, a changed input reruns every stage downstream of it
+    report.write_text("edited")
+    assert pipeline.run() == {'clean': "skipped", 'report': "ran"}
+    raw.write_text("price")
+    assert pipeline.run() == {'clean': "ran", 'report': "ran"}
+    assert report.read_text() == "PRICE"
+    assert pipeline.run(force=True) == {'clean': "ran", 'report': "ran"}
+
+
+def test_pipeline_rejects_an_input_cycle(tmp_path):
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    pipeline = Pipeline([_stage('forward', first, second), _stage('back', second, first)],
+                        state_path=str(tmp_path / "state.json"), max_workers=1)
+    with pytest.raises(CustomException, match="can never run"):
+        pipeline.run()
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from price_data import assert_same_features, read_prices, synthetic_prices
+from src.benchmarks.reference import groupby_price_features
+from src.price_features import PriceFeatureAccumulator, build_price_features, stream_price_features
+from src.schema import PRICE_SCHEMA, csv_options
+
+
+def test_build_price_features_matches_groupby(tmp_path):
+    price_path = tmp_path / "price_data.csv"
+    synthetic_prices().to_csv(price_path, index=False)
+    price_df = read_prices(price_path)
+    assert_same_features(build_price_features(price_df), groupby_price_features(price_df))
+
+
+def test_build_price_features_without_dated_rows():
+    price_df = synthetic_prices(n_ids=3).assign(price_date=None)
+    assert build_price_features(price_df).empty
+
+
+def test_stream_price_features_matches_groupby(tmp_path):
+    price_path = tmp_path / "price_data.csv"
+    synthetic_prices().to_csv(price_path, index=False)
+    expected = groupby_price_features(read_prices(price_path))
+    for chunksize in (1, 17, 10_000):
+        assert_same_features(stream_price_features(price_path, chunksize), expected)
+
+
+def test_accumulator_state_round_trip(tmp_path):
+    price_path = tmp_path / "price_data.csv"
+    synthetic_prices(seed=3).to_csv(price_path, index=False)
+    accumulator = PriceFeatureAccumulator()
+    for i, chunk in enumerate(pd.read_csv(price_path, chunksize=25, **csv_options(PRICE_SCHEMA))):
+        accumulator.update(chunk)
+        if i % 3 == 0:
+            accumulator.save(tmp_path / "state.npz")
+            accumulator = PriceFeatureAccumulator.load(tmp_path / "state.npz")
+    expected = groupby_price_features(read_prices(price_path))
+    assert_same_features(accumulator.features(), expected)
+    ids = expected['id'].iloc[[4, 0, 9]]
+    assert_same_features(accumulator.features(ids), expected[expected['id'].isin(ids)].reset_index(drop=True))
@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pytest
+
+from client_data import client_rows
+from price_data import synthetic_prices
+from src.components.data_validation import DataValidation
+from src.exception import CustomException
+from src.schema import CLIENT_SCHEMA, PRICE_SCHEMA, check_frame, format_report
+
+
+def test_check_frame_accepts_valid_rows():
+    assert check_frame(client_rows(5), CLIENT_SCHEMA) == {}
+    # Missing prices and dates are allowed by the price schema
+    prices = synthetic_prices().astype(str).replace('nan', np.nan)
+    assert check_frame(prices, PRICE_SCHEMA) == {}
+
+
+def test_check_frame_reports_every_rule():
+    df = client_rows(6).drop(columns='pow_max')
+    df.loc[0, 'cons_12m'] = "-5"
+    df.loc[1, 'cons_12m'] = "many"
+    df.loc[2, 'nb_prod_act'] = "1.5"
+    df.loc[3, 'forecast_discount_energy'] = "101"
+    df.loc[4, 'date_activ'] = "2015/06/01"
+    df.loc[5, 'has_gas'] = "yes"
+    df.loc[[1, 2], 'id'] = np.nan
+
+    problems = check_frame(df, CLIENT_SCHEMA)
+    assert problems == {
+        ('id', "missing values at rows"): [2, [1, 2]],
+        ('cons_12m', "not a number"): [1, ["many"]],
+        ('cons_12m', "below 0"): [1, ["-5"]],
+        ('date_activ', "not a %Y-%m-%d date"): [1, ["2015/06/01"]],
+        ('forecast_discount_energy', "above 100"): [1, ["101"]],
+        ('has_gas', "unknown category"): [1, ["yes"]],
+        ('nb_prod_act', "not an integer"): [1, ["1.5"]],
+        ('pow_max', "missing column"): [1, []]
+    }
+    report = format_report("client_data.csv", len(df), problems)
+    assert report.splitlines()[0] == "client_data.csv: 8 problem(s) in 6 rows"
+    assert "  cons_12m: 1 below 0, e.g. ['-5']" in report.splitlines()
+
+
+def test_check_frame_accumulates_chunks_with_few_examples():
+    df = client_rows(10)
+    df['cons_12m'] = [str(-i) for i in range(10)]
+    problems = {}
+    for start in range(0, 10, 4):
+        check_frame(df.iloc[start:start + 4], CLIENT_SCHEMA, problems)
+    assert problems == {('cons_12m', "below 0"): [9, ["-1", "-2", "-3"]]}
+
+
+def test_validate_writes_the_report_and_raises(tmp_path):
+    obj = DataValidation()
+    config = obj.data_validation_config
+    config.client_data_path = str(tmp_path / "client_data.csv")
+    config.price_data_path = str(tmp_path / "price_data.csv")
+    config.report_path = str(tmp_path / "validation_report.json")
+    config.price_chunksize = 50
+    client_rows(4).to_csv(config.client_data_path, index=False)
+    synthetic_prices().to_csv(config.price_data_path, index=False)
+    assert obj.validate()['price_data.csv']['problems'] == []
+
+    client_rows(4).assign(churn="2").to_csv(config.client_data_path, index=False)
+    with pytest.raises(CustomException, match="churn: 4 above 1"):
+        obj.validate()
+    with open(config.report_path) as file_obj:
+        report = json.load(file_obj)
+    assert report['client_data.csv']['problems'] == [
+        {'column': 'churn', 'check': "above 1", 'count': 4, 'examples': ["2", "2", "2"]}]
@@ -0,0 +1,72 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from client_data import client_rows
+from src.components.scoring_service import ScoringService, create_app
+from src.schema import SchemaError
+
+
+class EchoService(ScoringService):
+    '''
+    Scores every row 0.5 and fails any frame holding the id "bad", counting the score_frame calls
+    '''
+    def __init__(self):
+        super().__init__()
+        self.manifest = {'name': 'churn_serving', 'version': 'v0001'}
+        self.calls = []
+
+    def score_frame(self, client_df):
+        self.calls.append(len(client_df))
+        if (client_df['id'] == "bad").any():
+            raise RuntimeError("model failed")
+        scores = pd.DataFrame({'id': client_df['id'].to_numpy(), 'churn_probability': 0.5})
+        if '_request' in client_df.columns:
+            scores['_request'] = client_df['_request'].to_numpy()
+        return scores
+
+
+def test_failed_batch_only_fails_the_bad_request():
+    service = EchoService()
+    service.scoring_config.max_wait_ms = 200
+    good, bad = client_rows(2), client_rows(1).assign(id="bad")
+    results = {}
+
+    def send(name, client_df):
+        try:
+            results[name] = service.submit(client_df)
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=send, args=item) for item in (("good", good), ("bad", bad))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results["good"]['id'].tolist() == good['id'].tolist()
+    assert isinstance(results["bad"], RuntimeError)
+    # One merged batch, then one call per request
+    assert service.calls[0] == 3 and sorted(service.calls[1:]) == [1, 2]
+
+
+def test_submit_rejects_rows_failing_the_schema():
+    with pytest.raises(SchemaError, match="cons_12m"):
+        EchoService().submit(client_rows(1).assign(cons_12m="-1"))
+
+
+def test_score_status_codes():
+    client = create_app(EchoService()).test_client()
+    records = client_rows(2).to_dict(orient='records')
+
+    response = client.post('/score', json=records)
+    assert response.status_code == 200
+    assert [score['id'] for score in response.get_json()['scores']] == ["client_0", "client_1"]
+
+    assert client.post('/score', data="{not json", content_type='application/json').status_code == 400
+    assert client.post('/score', json={'rows': records}).status_code == 400
+    records[0]['cons_12m'] = "-1"
+    assert client.post('/score', json=records).status_code == 400
+    # A failure of the service itself is not the client's fault
+    assert client.post('/score', json=[dict(records[1], id="bad")]).status_code == 500
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from src.benchmarks.reference import block_log_transform
+from src.transform_kernel import CLIENT_TRANSFORMS, CHANNEL_CATEGORIES, LOG10_COLUMNS, apply_transforms
+
+
+def test_apply_transforms_matches_the_pandas_expressions():
+    rng = np.random.default_rng(0)
+    n = 200
+    df = pd.DataFrame({column: rng.integers(0, 10**6, n) for column in LOG10_COLUMNS})
+    df['imp_cons'] = rng.random(n) * 100
+    df.loc[::17, 'forecast_cons_12m'] = np.nan
+    df['has_gas'] = rng.choice(['t', 'f'], n)
+    # Channels outside the kept categories encode as all zeros
+    df['channel_sales'] = pd.Categorical(rng.choice(CHANNEL_CATEGORIES + ['rare_channel'], n))
+    df.insert(0, 'id', [f"c{i}" for i in range(n)])
+    original = df.copy()
+
+    transformed = apply_transforms(df, CLIENT_TRANSFORMS)
+    for column in LOG10_COLUMNS:
+        np.testing.assert_array_equal(transformed[column].to_numpy(), np.log10(original[column] + 1).to_numpy())
+    assert transformed['has_gas'].tolist() == (original['has_gas'] == 't').astype(int).tolist()
+
+    dummies = pd.get_dummies(original['channel_sales'], prefix='channel')[[f"channel_{c}" for c in CHANNEL_CATEGORIES]]
+    assert list(transformed.columns) == ['id'] + LOG10_COLUMNS + ['has_gas'] + list(dummies.columns)
+    pd.testing.assert_frame_equal(transformed[dummies.columns], dummies)
+
+
+def test_block_log_transform_matches_the_kernel():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({column: rng.integers(0, 10**6, 50) for column in LOG10_COLUMNS})
+    df['imp_cons'] = rng.random(50)
+    pd.testing.assert_frame_equal(block_log_transform(df.copy(), LOG10_COLUMNS),
+                                  apply_transforms(df.copy(), [(column, 'log1p10', None) for column in LOG10_COLUMNS]))
@@ -0,0 +1,67 @@
+import itertools
+import math
+
+import numpy as np
+
+from src.tree_shap import forest_shap_values
+
+
+def _forest(n_features=4, seed=0):
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(seed)
+    X = rng.random((300, n_features)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(0, 0.2, len(X)) > 0.8).astype(int)
+    X[rng.random(X.shape) < 0.05] = np.nan
+    model = RandomForestClassifier(n_estimators=5, max_depth=4, random_state=seed, n_jobs=1).fit(X, y)
+    X_test = rng.random((20, n_features)).astype(np.float32)
+    X_test[rng.random(X_test.shape) < 0.1] = np.nan
+    return model, X_test
+
+
+def _conditional_expectation(tree, x, subset, node=0):
+    # E[f(x) | x_subset] the path-dependent way: follow x on the subset's splits, weigh by cover elsewhere
+    if tree.children_left[node] == -1:
+        proba = tree.value[node, 0]
+        return proba[1] / proba.sum()
+    left, right = tree.children_left[node], tree.children_right[node]
+    feature = tree.feature[node]
+    if feature in subset:
+        value = x[feature]
+        go_left = tree.missing_go_to_left[node] if np.isnan(value) else value <= tree.threshold[node]
+        return _conditional_expectation(tree, x, subset, left if go_left else right)
+    cover = tree.weighted_n_node_samples
+    return (cover[left] * _conditional_expectation(tree, x, subset, left)
+            + cover[right] * _conditional_expectation(tree, x, subset, right)) / cover[node]
+
+
+def _brute_force_shap(model, x):
+    n = len(x)
+    phi = np.zeros(n)
+    for estimator in model.estimators_:
+        for i in range(n):
+            others = [j for j in range(n) if j != i]
+            for size in range(n):
+                weight = math.factorial(size) * math.factorial(n - size - 1) / math.factorial(n)
+                for subset in itertools.combinations(others, size):
+                    phi[i] += weight * (_conditional_expectation(estimator.tree_, x, set(subset) | {i})
+                                        - _conditional_expectation(estimator.tree_, x, set(subset)))
+    return phi / len(model.estimators_)
+
+
+def test_tree_shap_matches_brute_force_shapley_values():
+    model, X_test = _forest()
+    phi, _ = forest_shap_values(model, X_test)
+    for row in range(5):
+        np.testing.assert_allclose(phi[row], _brute_force_shap(model, X_test[row]), atol=1e-12)
+
+
+def test_tree_shap_adds_up_to_predict_proba():
+    model, X_test = _forest(n_features=6, seed=1)
+    phi, expected_value = forest_shap_values(model, X_test)
+    assert phi.shape == X_test.shape
+    np.testing.assert_allclose(phi.sum(axis=1) + expected_value, model.predict_proba(X_test)[:, 1], atol=1e-10)
+
+    parallel_phi, parallel_expected = forest_shap_values(model, X_test, max_workers=2)
+    np.testing.assert_allclose(parallel_phi, phi, atol=1e-12)
+    assert parallel_expected == expected_value
@@ -0,0 +1,40 @@
+import os
+
+import pandas as pd
+
+from src.utils import read_csv_cached
+
+
+def _cache_files(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def test_read_csv_cached_keys_on_contents_and_options(tmp_path):
+    csv_path = tmp_path / "client_data.csv"
+    cache_dir = str(tmp_path / "cache")
+    pd.DataFrame({'id': ['a', 'b'], 'date_activ': ['2015-01-02', '2016-03-04'], 'cons_12m': [1, 2]}).to_csv(
+        csv_path, index=False)
+
+    cold = read_csv_cached(str(csv_path), parse_dates=['date_activ'], categories=['id'], cache_dir=cache_dir)
+    assert pd.api.types.is_datetime64_any_dtype(cold['date_activ'])
+    assert isinstance(cold['id'].dtype, pd.CategoricalDtype)
+    first_entry = _cache_files(cache_dir)
+    assert len(first_entry) == 1 and first_entry[0].startswith("client_data-")
+
+    # A warm read comes from the cache entry and matches the cold read
+    os.utime(csv_path, (0, 0))
+    pd.testing.assert_frame_equal(
+        read_csv_cached(str(csv_path), parse_dates=['date_activ'], categories=['id'], cache_dir=cache_dir), cold)
+    assert _cache_files(cache_dir) == first_entry
+
+    # Other parse options get their own entry for the same contents
+    plain = read_csv_cached(str(csv_path), cache_dir=cache_dir)
+    assert not pd.api.types.is_datetime64_any_dtype(plain['date_activ'])
+    assert len(_cache_files(cache_dir)) == 2
+
+    # Changed contents get a new key and the stale entries of the file are removed
+    pd.DataFrame({'id': ['c'], 'date_activ': ['2017-05-06'], 'cons_12m': [3]}).to_csv(csv_path, index=False)
+    changed = read_csv_cached(str(csv_path), parse_dates=['date_activ'], categories=['id'], cache_dir=cache_dir)
+    assert changed['id'].tolist() == ['c']
+    remaining = _cache_files(cache_dir)
+    assert len(remaining) == 1 and remaining[0] not in first_entry